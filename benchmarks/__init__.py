@@ -0,0 +1,38 @@
+"""
+Benchmarks for the Python side of the Puff runtime.
+
+Benchmarks are registered with the `benchmark` decorator in `benchmarks/bench_*.py` modules. A benchmark is a
+factory: it takes one parameter, does its setup and returns the zero argument callable that is timed. Everything
+runs on a greenlet event loop backed by `puff.local_runtime`, so no compiled Puff runtime is needed.
+
+    python -m benchmarks --output results.json
+    python -m benchmarks --compare results.json -k postgres
+"""
+from dataclasses import dataclass
+from typing import Any, Callable, Sequence
+
+
+@dataclass(frozen=True)
+class Benchmark:
+    name: str
+    factory: Callable[[Any], Callable[[], Any]]
+    params: Sequence[Any]
+    ops: int
+
+
+BENCHMARKS = []
+
+
+def benchmark(params: Sequence[Any] = (None,), ops: int = 1):
+    """
+    Register a benchmark factory, run once for each of `params`.
+
+    `ops` is how many operations one call of the timed callable performs, used to report ns/op.
+    """
+
+    def decorator(factory):
+        name = f"{factory.__module__.rsplit('.', 1)[-1]}.{factory.__name__}"
+        BENCHMARKS.append(Benchmark(name=name, factory=factory, params=params, ops=ops))
+        return factory
+
+    return decorator
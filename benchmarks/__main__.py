@@ -0,0 +1,134 @@
+import argparse
+import importlib
+import json
+import pkgutil
+import platform
+import statistics
+import sys
+import time
+from importlib import metadata
+
+import benchmarks
+from benchmarks import BENCHMARKS
+from puff import local_runtime
+
+
+def result_key(bench, param):
+    return bench.name if param is None else f"{bench.name}[{param}]"
+
+
+def measure(fn, repeat, min_time):
+    fn()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9)))
+    samples = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number)
+    return samples, number
+
+
+def run_benchmarks(selected, repeat, min_time):
+    results = {}
+    for bench in selected:
+        for param in bench.params:
+            key = result_key(bench, param)
+            fn = bench.factory(param)
+            samples, number = measure(fn, repeat, min_time)
+            median = statistics.median(samples)
+            results[key] = {
+                "median_s": median,
+                "mean_s": statistics.fmean(samples),
+                "min_s": min(samples),
+                "stdev_s": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+                "ops": bench.ops,
+                "ns_per_op": median * 1e9 / bench.ops,
+                "number": number,
+                "repeat": len(samples),
+            }
+            print(
+                f"{key:<55} {median * 1e3:>10.3f} ms  {median * 1e9 / bench.ops:>12.0f} ns/op",
+                flush=True,
+            )
+    return results
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for key, result in results.items():
+        old = baseline.get("results", {}).get(key)
+        if old is None:
+            continue
+        ratio = result["median_s"] / old["median_s"]
+        marker = ""
+        if ratio > 1 + threshold:
+            marker = "  REGRESSION"
+            regressions.append(key)
+        elif ratio < 1 - threshold:
+            marker = "  improved"
+        print(f"{key:<55} {ratio:>7.2f}x{marker}")
+    return regressions
+
+
+def load_modules():
+    for module in pkgutil.iter_modules(benchmarks.__path__):
+        if module.name.startswith("bench_"):
+            importlib.import_module(f"benchmarks.{module.name}")
+
+
+def package_version():
+    try:
+        return metadata.version("puff-py")
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument("-k", dest="filter", help="only run benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-time", type=float, default=0.1, help="seconds per sample")
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--compare", help="JSON file from an earlier run to compare against")
+    parser.add_argument(
+        "--threshold", type=float, default=0.1, help="relative slowdown reported as a regression"
+    )
+    options = parser.parse_args()
+
+    load_modules()
+    selected = [b for b in BENCHMARKS if not options.filter or options.filter in b.name]
+    local_runtime.install()
+    results = local_runtime.run(run_benchmarks, selected, options.repeat, options.min_time)
+
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(
+                {
+                    "version": package_version(),
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "timestamp": time.time(),
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, options.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+from dataclasses import dataclass, make_dataclass
+from typing import Any, List, Optional, get_type_hints
+
+from puff.graphql import load_aggro_type, type_to_description, wrap_method
+from benchmarks import benchmark
+
+
+@dataclass
+class AuthorFilter:
+    name: str
+    min_books: Optional[int] = None
+
+
+@dataclass
+class Book:
+    id: int
+    title: str
+    rating: Optional[float]
+
+    @classmethod
+    def by_author(cls, context, /, author_id: int, limit: int = 10) -> List["Book"]:
+        ...
+
+
+@dataclass
+class Author:
+    id: int
+    name: str
+
+    @classmethod
+    def books(cls, context, /, limit: int = 10) -> List[Book]:
+        ...
+
+
+@dataclass
+class Query:
+    @classmethod
+    def authors(cls, context, /, filters: Optional[AuthorFilter] = None) -> List[Author]:
+        ...
+
+    @classmethod
+    def books(cls, context, /, ids: List[int]) -> List[Book]:
+        ...
+
+
+@dataclass
+class Schema:
+    query: Query
+
+
+def chain_of_types(n):
+    t = make_dataclass(f"T{n}", [("id", int), ("name", str)])
+    for i in reversed(range(n)):
+        t = make_dataclass(f"T{i}", [("id", int), ("name", str), ("next", Optional[t])])
+    return t
+
+
+@benchmark()
+def schema_description(_):
+    def run():
+        type_to_description(Schema)
+
+    return run
+
+
+@benchmark(params=(10, 100))
+def load_aggro_type_chain(n):
+    root = chain_of_types(n)
+
+    def run():
+        load_aggro_type(root, {}, {}, False)
+
+    return run
+
+
+class StubContext:
+    def connection(self):
+        return None
+
+
+def filter_authors(
+    context, /, filters: AuthorFilter, others: List[AuthorFilter], limit: int
+) -> Any:
+    return filters
+
+
+@benchmark(params=(1, 100))
+def wrap_method_coercion(n):
+    wrapped = wrap_method(filter_authors, get_type_hints(filter_authors))
+    ctx = StubContext()
+    others = [{"name": "x", "min_books": i} for i in range(n)]
+
+    def run():
+        wrapped(ctx, filters={"name": "a"}, others=others, limit=10)
+
+    return run
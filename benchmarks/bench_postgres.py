@@ -0,0 +1,24 @@
+from puff.postgres import PostgresCursor
+from benchmarks import benchmark
+
+
+class StubRustCursor:
+    arraysize = 1
+
+    def execute(self, r, q, params):
+        r(None, None)
+
+    def close(self):
+        pass
+
+
+@benchmark(params=(1, 100, 1_000, 10_000))
+def execute_placeholders(n):
+    cursor = PostgresCursor(StubRustCursor(), None)
+    query = "SELECT * FROM polls_question WHERE id IN (%s)" % ", ".join(["%s"] * n)
+    params = list(range(n))
+
+    def run():
+        cursor.execute(query, params)
+
+    return run
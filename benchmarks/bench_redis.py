@@ -0,0 +1,14 @@
+from puff.redis import RedisClient
+from benchmarks import benchmark
+
+
+@benchmark(params=(10, 1_000, 10_000))
+def mget(n):
+    client = RedisClient()
+    keys = [f"bench:mget:{i}" for i in range(n)]
+    client.mset({key: b"x" * 64 for key in keys})
+
+    def run():
+        client.mget(keys)
+
+    return run
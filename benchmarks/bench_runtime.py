@@ -0,0 +1,72 @@
+import asyncio
+import threading
+
+import puff
+from puff.asyncio_support import AsyncioThread
+from benchmarks import benchmark
+
+ROUND_TRIPS = 1000
+
+
+def stub_rust_call(rr):
+    rr(None, None)
+
+
+def noop():
+    return None
+
+
+@benchmark(ops=ROUND_TRIPS)
+def wrap_async_greenlet(_):
+    def run():
+        for _ in range(ROUND_TRIPS):
+            puff.wrap_async(stub_rust_call)
+
+    return run
+
+
+asyncio_thread = None
+asyncio_lock = threading.Lock()
+
+
+def asyncio_loop():
+    global asyncio_thread
+    with asyncio_lock:
+        if asyncio_thread is None:
+            asyncio_thread = AsyncioThread()
+            asyncio_thread.daemon = True
+            asyncio_thread.start()
+        while asyncio_thread.loop is None:
+            puff.sleep_ms(1)
+    return asyncio_thread.loop
+
+
+@benchmark(ops=ROUND_TRIPS)
+def wrap_async_asyncio(_):
+    loop = asyncio_loop()
+
+    async def round_trips():
+        for _ in range(ROUND_TRIPS):
+            await puff.wrap_async_asyncio(stub_rust_call)
+
+    def run():
+        asyncio.run_coroutine_threadsafe(round_trips(), loop).result()
+
+    return run
+
+
+@benchmark(params=(10, 1_000, 100_000))
+def spawn_join_all(n):
+    def run():
+        puff.join_all([puff.spawn(noop) for _ in range(n)])
+
+    return run
+
+
+@benchmark(params=(10, 1_000))
+def spawn_join_iter(n):
+    def run():
+        for _ in puff.join_iter([puff.spawn(noop) for _ in range(n)]):
+            pass
+
+    return run
@@ -0,0 +1,78 @@
+"""
+Microbenchmark for `wrap_async` round trips on a MainThread against a stub Rust call.
+
+The stub resolves the handle as soon as it is called, so each round trip measures the Python side only:
+creating the handle, queueing the result, parking the greenlet and waking it up again.
+
+    python -m benchmarks.wrap_async_alloc [--ops 100000] [--samples 2000]
+"""
+import argparse
+import queue
+import time
+import tracemalloc
+
+import puff
+
+
+def stub_rust_call(rr):
+    rr(None, None)
+
+
+def time_round_trips(ops):
+    start = time.perf_counter_ns()
+    for _ in range(ops):
+        puff.wrap_async(stub_rust_call)
+    return (time.perf_counter_ns() - start) / ops
+
+
+def peak_bytes_per_round_trip(samples):
+    puff.wrap_async(stub_rust_call)
+    total = 0
+    tracemalloc.start()
+    try:
+        for _ in range(samples):
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            puff.wrap_async(stub_rust_call)
+            _, peak = tracemalloc.get_traced_memory()
+            total += peak - current
+    finally:
+        tracemalloc.stop()
+    return total / samples
+
+
+def run(ops, samples):
+    return {
+        "ns_per_op": time_round_trips(ops),
+        "peak_bytes_per_op": peak_bytes_per_round_trip(samples),
+    }
+
+
+def run_in_loop(f, *args):
+    done = queue.Queue()
+    thread = puff.start_event_loop()
+    thread.spawn(f, args, {}, lambda r, e: done.put((r, e)))
+    try:
+        result, exception = done.get()
+    finally:
+        thread.start_shutdown()
+    if exception is not None:
+        raise exception
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--ops", type=int, default=100_000)
+    parser.add_argument("--samples", type=int, default=2_000)
+    options = parser.parse_args()
+
+    result = run_in_loop(run, options.ops, options.samples)
+    print(
+        f"{result['ns_per_op']:>8.0f} ns/op "
+        f"{result['peak_bytes_per_op']:>6.0f} peak bytes/op"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,6 @@
+from puff.postgres import execute_batch, execute_values  # NOQA
+
+
 class Inet:
     pass
 
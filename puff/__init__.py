@@ -1,6 +1,8 @@
-import queue
+import collections
+import os
 import sys
 import threading
+import time
 import traceback
 import contextvars
 import dataclasses
@@ -101,14 +103,6 @@ class Task:
         new_greenlet.switch(self.args, self.kwargs, self.ret_func)
 
 
-@dataclasses.dataclass(frozen=True, slots=True)
-class Result:
-    greenlet: Any
-
-    def process(self):
-        self.greenlet.switch()
-
-
 @dataclasses.dataclass(frozen=True, slots=True)
 class Kill:
     thread: Any
@@ -125,6 +119,56 @@ class StartShutdown:
         self.thread.do_shutdown()
 
 
+class EventQueue:
+    """
+    A multi-producer, single-consumer queue of events for a MainThread.
+    """
+
+    def __init__(self):
+        self.events = collections.deque()
+        self.sleeping = False
+        if hasattr(os, "eventfd"):
+            self.read_fd = self.write_fd = os.eventfd(0, os.EFD_CLOEXEC)
+        else:
+            self.read_fd, self.write_fd = os.pipe()
+
+    def put(self, event):
+        self.events.append(event)
+        if self.sleeping:
+            self.sleeping = False
+            os.write(self.write_fd, b"\x01\x00\x00\x00\x00\x00\x00\x00")
+
+    def wait(self):
+        events = self.events
+        while not events:
+            self.sleeping = True
+            # A producer may have appended before it could see the flag.
+            if events:
+                self.sleeping = False
+                return
+            os.read(self.read_fd, 8)
+
+    def get(self):
+        """
+        Block until an event is available and return it.
+        """
+        self.wait()
+        return self.events.popleft()
+
+    def get_batch(self):
+        """
+        Block until at least one event is available and return all events queued so far.
+        """
+        self.wait()
+        events = self.events
+        return [events.popleft() for _ in range(len(events))]
+
+    def close(self):
+        os.close(self.read_fd)
+        if self.write_fd != self.read_fd:
+            os.close(self.write_fd)
+
+
 class MainThread(Thread):
     def __init__(self, event_queue, on_thread_start=None):
         self.event_queue = event_queue
@@ -134,6 +178,12 @@ class MainThread(Thread):
         self.event_loop_processor = None
         self.read_from_queue_processor = None
         self.greenlets = set()
+        # Greenlets that are ready to be resumed because something they were
+        # waiting on has finished. Only touched from this thread.
+        self.ready = collections.deque()
+        # Set on BlockingPool workers.
+        self.blocking_pool = None
+        self.overflow = False
         super().__init__()
 
     def run(self):
@@ -148,6 +198,9 @@ class MainThread(Thread):
         while self.read_from_queue_processor.switch():
             pass
 
+        if isinstance(self.event_queue, EventQueue):
+            self.event_queue.close()
+
     def spawn(self, task_function, args, kwargs, ret_func):
         task_function_wrapped = self.generate_spawner(task_function)
         task = Task(
@@ -158,17 +211,19 @@ class MainThread(Thread):
         )
         self.event_queue.put(task)
 
-    def new_greenlet(self):
-        greenlet = Greenlet(thread=self)
+    def new_greenlet(self, wrap_return=None):
+        greenlet = Greenlet(thread=self, wrap_return=wrap_return)
         self.greenlets.add(greenlet)
         return greenlet
 
     def complete_greenlet(self, greenlet):
         self.greenlets.remove(greenlet)
 
-    def return_result(self, greenlet):
-        result_event = Result(greenlet=greenlet)
-        self.event_queue.put(result_event)
+    def wake(self, waiting_greenlet):
+        """
+        Schedule a greenlet on this thread to be resumed by the event loop.
+        """
+        self.ready.append(waiting_greenlet)
 
     def generate_spawner(self, func):
         def override_spawner(args, kwargs, ret_func):
@@ -185,15 +240,23 @@ class MainThread(Thread):
         return override_spawner
 
     def loop_commands(self):
+        ready = self.ready
         while True:
-            event = self.read_next_event()
-            event.process()
+            while ready:
+                ready.popleft().switch()
+            for event in self.read_next_events():
+                event.process()
 
     def read_from_queue(self):
         parent_thread.set(self)
+        event_queue = self.event_queue
+        get_batch = getattr(event_queue, "get_batch", None)
         while not self.has_shutdown():
-            event = self.event_queue.get()
-            self.event_loop_processor.switch(event)
+            if get_batch is None:
+                events = (event_queue.get(),)
+            else:
+                events = get_batch()
+            self.event_loop_processor.switch(events)
         self.kill_now()
 
     def kill(self):
@@ -211,42 +274,86 @@ class MainThread(Thread):
     def has_shutdown(self):
         return self.shutdown_started and not self.greenlets
 
-    def read_next_event(self):
+    def read_next_events(self):
         return self.main_greenlet.switch(True)
 
 
 def start_event_loop(q=None, on_thread_start=None):
     if q is None:
-        q = queue.Queue()
+        q = EventQueue()
     loop_thread = MainThread(q, on_thread_start=on_thread_start)
     loop_thread.start()
 
     return loop_thread
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(slots=True, eq=False)
 class Greenlet:
+    """
+    A handle to the result of a Puff async call or a spawned greenlet.
+    """
+
     thread: Any
     result: Any = None
     exception: Any = None
     finished: bool = False
+    wrap_return: Any = dataclasses.field(default=None, repr=False)
+    waiter: Any = dataclasses.field(default=None, repr=False)
+    callbacks: Any = dataclasses.field(default=None, repr=False)
+
+    def __call__(self, result, exception):
+        if exception is None and self.wrap_return is not None:
+            try:
+                result = self.wrap_return(result)
+            except Exception as e:
+                result, exception = None, e
+        self.result = result
+        self.exception = exception
+        self.thread.event_queue.put(self)
+
+    def process(self):
+        self.set_result(self.result, self.exception)
 
     def join(self):
-        while not self.finished:
-            self.thread.event_loop_processor.switch()
+        if not self.finished:
+            thread = self.thread
+            waiting_greenlet = greenlet.getcurrent()
+            if self.waiter is None:
+                self.waiter = waiting_greenlet
+            else:
+                self.add_done_callback(lambda _: thread.wake(waiting_greenlet))
+            while not self.finished:
+                thread.event_loop_processor.switch()
         if self.exception:
             raise self.exception
         else:
             return self.result
 
+    def add_done_callback(self, fn):
+        """
+        Call `fn(self)` on the owning thread once the result is set.
+        """
+        if self.finished:
+            fn(self)
+        elif self.callbacks is None:
+            self.callbacks = [fn]
+        else:
+            self.callbacks.append(fn)
+
     def set_result(self, result, exception):
         self.result = result
         self.exception = exception
         self.finished = True
         self.thread.complete_greenlet(self)
-
-    def __hash__(self):
-        return id(self)
+        waiter = self.waiter
+        if waiter is not None:
+            self.waiter = None
+            self.thread.wake(waiter)
+        callbacks = self.callbacks
+        if callbacks is not None:
+            self.callbacks = None
+            for fn in callbacks:
+                fn(self)
 
 
 Bytelike = Union[str, bytes]
@@ -260,7 +367,10 @@ def wrap_async_asyncio(f, wrap_return=None):
 
     def wrapped_ret(val, e):
         if e is None and wrap_return is not None:
-            val = wrap_return(val)
+            try:
+                val = wrap_return(val)
+            except Exception as wrap_error:
+                val, e = None, wrap_error
         if e is None:
             loop.call_soon_threadsafe(future.set_result, val)
         else:
@@ -283,18 +393,10 @@ def wrap_async(f, join=True, wrap_return=None):
 
 
 def wrap_async_greenlet(f, join=True, wrap_return=None):
-    this_greenlet = greenlet.getcurrent()
     thread = parent_thread.get()
 
-    greenlet_obj = thread.new_greenlet()
-
-    def return_result(r, e):
-        if e is None and wrap_return is not None:
-            r = wrap_return(r)
-        greenlet_obj.set_result(r, e)
-        thread.return_result(this_greenlet)
-
-    f(return_result)
+    greenlet_obj = thread.new_greenlet(wrap_return)
+    f(greenlet_obj)
     if join:
         return greenlet_obj.join()
     else:
@@ -320,14 +422,9 @@ def spawn_from_asyncio(f, *args, **kwargs):
 
 def spawn_from_greenlet(f, *args, **kwargs):
     thread = parent_thread.get()
-    this_greenlet = greenlet.getcurrent()
     greenlet_obj = thread.new_greenlet()
 
-    def return_result(val, e):
-        greenlet_obj.set_result(val, e)
-        thread.return_result(this_greenlet)
-
-    thread.spawn(f, args, kwargs, return_result)
+    thread.spawn(f, args, kwargs, greenlet_obj.set_result)
 
     # yield the thread to start other greenlet
     sleep_ms(0)
@@ -342,29 +439,49 @@ def join_all(greenlets):
     if not greenlets:
         return []
     thread = greenlets[0].thread
-    while not all(g.finished for g in greenlets):
-        thread.event_loop_processor.switch()
+    pending = [g for g in greenlets if not g.finished]
+    if pending:
+        waiting_greenlet = greenlet.getcurrent()
+        remaining = len(pending)
+
+        def on_done(_):
+            nonlocal remaining
+            remaining -= 1
+            if not remaining:
+                thread.wake(waiting_greenlet)
+
+        for g in pending:
+            g.add_done_callback(on_done)
+        while remaining:
+            thread.event_loop_processor.switch()
     return [g.result for g in greenlets]
 
 
 def join_iter(greenlets):
     """
-    Wait for all greenlets to finish, yielding results as they become available.
+    Wait for all greenlets to finish, yielding results in the order they finish.
     """
     if not greenlets:
         return None
 
     thread = greenlets[0].thread
-    pending = set(greenlets)
+    done = collections.deque()
+    parked = []
+
+    def on_done(g):
+        done.append(g)
+        if parked:
+            thread.wake(parked.pop())
 
-    while pending:
-        thread.event_loop_processor.switch()
-        remove = set()
-        for x in pending:
-            if x.finished:
-                yield x.result
-                remove.add(x)
-        pending = pending - remove
+    for g in greenlets:
+        g.add_done_callback(on_done)
+
+    for _ in range(len(greenlets)):
+        if not done:
+            parked.append(greenlet.getcurrent())
+            while not done:
+                thread.event_loop_processor.switch()
+        yield done.popleft().result
 
 
 def sleep_ms(time_to_sleep_ms: int):
@@ -374,36 +491,292 @@ def sleep_ms(time_to_sleep_ms: int):
     return wrap_async(lambda rr: rust_objects.sleep_ms(rr, time_to_sleep_ms), join=True)
 
 
+DEFAULT_BLOCKING_MAX_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+DEFAULT_BLOCKING_MAX_QUEUED = 1024
+DEFAULT_BLOCKING_QUEUE_TIMEOUT = 10 * 1000
+DEFAULT_BLOCKING_IDLE_TIMEOUT = 60 * 1000
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class BlockingPoolStats:
+    workers: int
+    idle: int
+    busy: int
+    queued: int
+    submitted: int
+    completed: int
+    rejected: int
+    total_wait_ms: float
+    max_wait_ms: float
+
+    @property
+    def average_wait_ms(self) -> float:
+        dispatched = self.submitted - self.queued - self.rejected
+        return self.total_wait_ms / dispatched if dispatched else 0.0
+
+
+class BlockingPool:
+    """
+    A bounded pool of warm MainThreads used to run blocking functions.
+    """
+
+    def __init__(
+        self,
+        on_thread_start=None,
+        max_workers=DEFAULT_BLOCKING_MAX_WORKERS,
+        max_queued=DEFAULT_BLOCKING_MAX_QUEUED,
+        queue_timeout_ms=DEFAULT_BLOCKING_QUEUE_TIMEOUT,
+        idle_timeout_ms=DEFAULT_BLOCKING_IDLE_TIMEOUT,
+    ):
+        if max_workers < 1:
+            raise ValueError("max_workers must be at least 1")
+        self.on_thread_start = on_thread_start
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.queue_timeout_ms = queue_timeout_ms
+        self.idle_timeout_ms = idle_timeout_ms
+        self.condition = threading.Condition()
+        self.idle = collections.deque()
+        self.pending = collections.deque()
+        self.num_workers = 0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self.closed = threading.Event()
+        self.reaper = None
+        # (deadline, handle) pairs for greenlets parked by `submit_from_greenlet`.
+        self.waiters = collections.deque()
+        self.waiter_timer = None
+
+    def submit(self, f, args, kwargs, return_result, waiter=None, deadline=None):
+        """
+        Run `f` on a worker. Returns False if `waiter` was parked on a full queue.
+        """
+        nested = getattr(parent_thread.get(None), "blocking_pool", None) is self
+        with self.condition:
+            if self.closed.is_set():
+                raise RuntimeError("Blocking pool has been shut down")
+            if self.idle:
+                worker, _ = self.idle.pop()
+            elif self.num_workers < self.max_workers:
+                worker = self.start_worker()
+            elif nested:
+                worker = self.start_worker(overflow=True)
+            elif not self.max_queued or len(self.pending) < self.max_queued:
+                self.submitted += 1
+                self.pending.append((f, args, kwargs, return_result, time.monotonic()))
+                return True
+            elif waiter is not None:
+                self.waiters.append((deadline, waiter))
+                self.start_waiter_timer()
+                self.condition.notify_all()
+                return False
+            else:
+                self.reject()
+                raise RuntimeError(
+                    f"Blocking pool saturated: {len(self.pending)} jobs queued"
+                )
+            self.submitted += 1
+            self.record_wait(0.0)
+        self.run_job(worker, f, args, kwargs, return_result)
+        return True
+
+    def submit_from_greenlet(self, f, args, kwargs, return_result):
+        """
+        Like `submit`, but on a full queue only the calling greenlet waits for a slot.
+        """
+        thread = parent_thread.get()
+        deadline = time.monotonic() + self.queue_timeout_ms / 1000
+        while True:
+            waiter = thread.new_greenlet()
+            if self.submit(f, args, kwargs, return_result, waiter, deadline):
+                thread.complete_greenlet(waiter)
+                return
+            if not waiter.join():
+                with self.condition:
+                    self.reject()
+                timeout = self.queue_timeout_ms
+                raise RuntimeError(
+                    f"Blocking pool saturated: waited {timeout}ms for a slot"
+                )
+
+    def reject(self):
+        self.submitted += 1
+        self.rejected += 1
+
+    def start_waiter_timer(self):
+        if self.waiter_timer is None:
+            self.waiter_timer = Thread(target=self.expire_waiters, daemon=True)
+            self.waiter_timer.start()
+
+    def expire_waiters(self):
+        with self.condition:
+            while not self.closed.is_set():
+                now = time.monotonic()
+                waiting = collections.deque()
+                for deadline, waiter in self.waiters:
+                    if deadline <= now:
+                        waiter(False, None)
+                    else:
+                        waiting.append((deadline, waiter))
+                self.waiters = waiting
+                timeout = min((d for d, _ in waiting), default=None)
+                self.condition.wait(None if timeout is None else timeout - now)
+
+    def wake_waiter(self):
+        # Called with the condition held, after a slot freed up.
+        if self.waiters:
+            _, waiter = self.waiters.popleft()
+            waiter(True, None)
+
+    def start_worker(self, overflow=False):
+        worker = MainThread(EventQueue(), on_thread_start=self.on_thread_start)
+        worker.daemon = True
+        worker.blocking_pool = self
+        # Overflow workers run a single nested job and are not counted in `max_workers`.
+        worker.overflow = overflow
+        worker.start()
+        if overflow:
+            return worker
+        self.num_workers += 1
+        if self.reaper is None and self.idle_timeout_ms:
+            self.reaper = Thread(target=self.reap_forever, daemon=True)
+            self.reaper.start()
+        return worker
+
+    def run_job(self, worker, f, args, kwargs, return_result):
+        def wrap_return_result(val, e):
+            try:
+                return_result(val, e)
+            finally:
+                self.release(worker)
+
+        worker.spawn(f, args, kwargs, wrap_return_result)
+
+    def release(self, worker):
+        with self.condition:
+            self.completed += 1
+            if worker.overflow:
+                worker.start_shutdown()
+                return
+            if self.pending:
+                f, args, kwargs, return_result, queued_at = self.pending.popleft()
+                self.record_wait((time.monotonic() - queued_at) * 1000)
+                self.wake_waiter()
+            elif self.closed.is_set():
+                self.num_workers -= 1
+                worker.start_shutdown()
+                return
+            else:
+                self.idle.append((worker, time.monotonic()))
+                self.wake_waiter()
+                return
+        self.run_job(worker, f, args, kwargs, return_result)
+
+    def record_wait(self, wait_ms):
+        self.total_wait_ms += wait_ms
+        if wait_ms > self.max_wait_ms:
+            self.max_wait_ms = wait_ms
+
+    def reap(self):
+        """
+        Shut down workers that have been idle for longer than `idle_timeout_ms`.
+        """
+        cutoff = time.monotonic() - self.idle_timeout_ms / 1000
+        with self.condition:
+            while self.idle and self.idle[0][1] <= cutoff:
+                worker, _ = self.idle.popleft()
+                self.num_workers -= 1
+                worker.start_shutdown()
+
+    def reap_forever(self):
+        interval = self.idle_timeout_ms / 2000
+        while not self.closed.wait(interval):
+            self.reap()
+
+    def shutdown(self):
+        """
+        Stop accepting jobs and shut down workers once they are idle.
+        """
+        with self.condition:
+            self.closed.set()
+            while self.idle:
+                worker, _ = self.idle.popleft()
+                self.num_workers -= 1
+                worker.start_shutdown()
+            # Parked greenlets retry and see that the pool is shut down.
+            while self.waiters:
+                self.wake_waiter()
+            self.condition.notify_all()
+
+    def stats(self) -> BlockingPoolStats:
+        with self.condition:
+            idle = len(self.idle)
+            return BlockingPoolStats(
+                workers=self.num_workers,
+                idle=idle,
+                busy=self.num_workers - idle,
+                queued=len(self.pending),
+                submitted=self.submitted,
+                completed=self.completed,
+                rejected=self.rejected,
+                total_wait_ms=self.total_wait_ms,
+                max_wait_ms=self.max_wait_ms,
+            )
+
+
+blocking_pools = {}
+blocking_pool_options = {}
+blocking_pools_lock = threading.Lock()
+
+
+def configure_blocking_pool(**options):
+    """
+    Set the BlockingPool options used by pools created after this call.
+    """
+    blocking_pool_options.update(options)
+
+
+def get_blocking_pool(on_thread_start=None) -> BlockingPool:
+    """
+    Get the shared BlockingPool whose workers were started with `on_thread_start`.
+    """
+    pool = blocking_pools.get(on_thread_start)
+    if pool is None:
+        with blocking_pools_lock:
+            pool = blocking_pools.get(on_thread_start)
+            if pool is None:
+                pool = BlockingPool(
+                    on_thread_start=on_thread_start, **blocking_pool_options
+                )
+                blocking_pools[on_thread_start] = pool
+    return pool
+
+
 def spawn_blocking(f, *args, **kwargs):
     """
-    Spawn a function on a new thread.
+    Spawn a function on a worker thread from the blocking pool.
     """
     if not is_greenlet():
         raise RuntimeError("Blocking functions can only be spawned from a greenlet")
 
     thread = parent_thread.get()
-    child_thread = start_event_loop(on_thread_start=thread.on_thread_start)
-    this_greenlet = greenlet.getcurrent()
     greenlet_obj = thread.new_greenlet()
 
-    def return_result(val, e):
-        greenlet_obj.set_result(val, e)
-        thread.return_result(this_greenlet)
-        child_thread.start_shutdown()
-
-    child_thread.spawn(f, args, kwargs, return_result)
+    try:
+        get_blocking_pool(thread.on_thread_start).submit_from_greenlet(
+            f, args, kwargs, greenlet_obj
+        )
+    except Exception as e:
+        greenlet_obj.set_result(None, e)
 
     return greenlet_obj
 
 
 def spawn_blocking_from_rust(on_thread_start, f, args, kwargs, return_result):
-    child_thread = start_event_loop(on_thread_start=on_thread_start)
-
-    def wrap_return_result(val, e):
-        return_result(val, e)
-        child_thread.start_shutdown()
-
-    child_thread.spawn(f, args, kwargs, wrap_return_result)
+    get_blocking_pool(on_thread_start).submit(f, args, kwargs, return_result)
 
 
 def cached_import(module_path, class_name):
@@ -2,6 +2,12 @@ from django.db.backends.postgresql.operations import (
     DatabaseOperations as PGDatabaseOperations,
 )
 
+from puff.postgres import MAX_QUERY_PARAMS
+
 
 class DatabaseOperations(PGDatabaseOperations):
-    pass
+    def bulk_batch_size(self, fields, objs):
+        # Parameters are bound on the server, which takes at most MAX_QUERY_PARAMS per statement.
+        if fields:
+            return max(1, MAX_QUERY_PARAMS // len(fields))
+        return len(objs)
@@ -1,6 +1,7 @@
 from django.core.cache.backends.redis import RedisCacheClient, RedisCache
 
 from puff.redis import global_redis as redis_client
+from puff.serializers import COMPRESSORS, Codec, resolve
 
 
 class PuffRedisCacheClient(RedisCacheClient):
@@ -8,8 +9,45 @@ class PuffRedisCacheClient(RedisCacheClient):
         return redis_client
 
 
+class PuffCacheSerializer:
+    """
+    Django's cache serializer interface over a `puff.serializers.Codec`. Integers are stored as they are, like
+    Django's `RedisSerializer`, so `incr` and `decr` keep working.
+    """
+
+    def __init__(self, codec: Codec):
+        self.codec = codec
+
+    def dumps(self, obj):
+        if type(obj) is int:
+            return obj
+        return self.codec.encode(obj)
+
+    def loads(self, data):
+        try:
+            return int(data)
+        except ValueError:
+            return self.codec.decode(data)
+
+
 class PuffRedisCache(RedisCache):
+    """
+    Accepts puff's `serializer` ("pickle", "json", "msgpack" or a path to a class), `compressor` ("zlib", "zstd",
+    "lz4" or a path to a class) and `compress_min_size` in OPTIONS.
+
+    Without a `serializer` or `compressor` Django's own serializer is used, so existing cache entries stay readable.
+    """
+
     def __init__(self, server, params):
         super().__init__(server, params)
         self._class = PuffRedisCacheClient
-        self._options = params.get("OPTIONS", {})
+        self._options = dict(params.get("OPTIONS", {}))
+        if "serializer" not in self._options and "compressor" not in self._options:
+            self._options.pop("compress_min_size", None)
+            return
+        serializer = self._options.pop("serializer", "pickle")
+        compressor = self._options.pop("compressor", None)
+        min_size = self._options.pop("compress_min_size", None)
+        if min_size is not None:
+            compressor = resolve(compressor, COMPRESSORS, min_size=min_size)
+        self._options["serializer"] = PuffCacheSerializer(Codec(serializer, compressor))
@@ -2,6 +2,7 @@ import asyncio
 import collections.abc
 import functools
 import inspect
+import re
 from dataclasses import dataclass, fields, is_dataclass
 from functools import wraps
 from typing import (
@@ -20,8 +21,14 @@ from typing import (
     Iterator,
 )
 
-from . import wrap_async, rust_objects
-from .postgres import set_connection_override, PostgresConnection
+from . import is_greenlet, wrap_async, rust_objects
+from .postgres import (
+    set_connection_override,
+    PostgresConnection,
+    get_client,
+    release_client,
+    replica_router,
+)
 
 
 @dataclass
@@ -629,10 +636,17 @@ class GraphqlSubscription:
         )
 
 
+# Operations that may write. A false positive, like a field called `mutation` on its own line, only costs a trip to
+# the primary.
+GRAPHQL_WRITE_RE = re.compile(r"(?:^|\})\s*(?:mutation|subscription)\b", re.M)
+
+
 class GraphqlClient:
-    def __init__(self, client=None, client_fn=None):
+    def __init__(self, client=None, client_fn=None, replicas=None):
         self.gql = client
         self.client_fn = client_fn or rust_objects.global_gql_getter
+        # A `ReplicaRouter` or replica pool names. Queries without a connection then run on a replica.
+        self.replicas = replica_router(replicas=replicas) if replicas else None
 
     def client(self):
         gql = self.gql
@@ -653,12 +667,24 @@ class GraphqlClient:
         Query the configured GraphQL schema.
 
         Provide an optional connection object to use as the DB connection to query SQL.
-        If no connection is specified, a new connection will be used.
+        If no connection is specified, a new connection will be used, on a replica if the client has replicas and
+        the document has no mutations. Only greenlets use replicas, under asyncio the query is still running when
+        this returns so the replica connection could not be given back.
         """
-        return wrap_async(
-            lambda rr: self.client().query(rr, query, variables, conn, auth_token),
-            join=True,
-        )
+        replica = None
+        if conn is None and self.replicas is not None and is_greenlet():
+            if GRAPHQL_WRITE_RE.search(query) is None:
+                replica = self.replicas.choose()
+        if replica is not None:
+            conn = get_client(replica)
+        try:
+            return wrap_async(
+                lambda rr: self.client().query(rr, query, variables, conn, auth_token),
+                join=True,
+            )
+        finally:
+            if replica is not None:
+                release_client(replica, conn)
 
     def subscribe(
         self,
@@ -684,5 +710,8 @@ class GraphqlClient:
 global_graphql = GraphqlClient()
 
 
-def named_client(name: str = "default"):
-    return GraphqlClient(client_fn=lambda: rust_objects.global_gql_getter.by_name(name))
+def named_client(name: str = "default", replicas=None):
+    return GraphqlClient(
+        client_fn=lambda: rust_objects.global_gql_getter.by_name(name),
+        replicas=replicas,
+    )
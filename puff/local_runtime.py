@@ -0,0 +1,1810 @@
+"""
+A pure-Python, in-process stand-in for the objects Puff's Rust runtime provides.
+
+`install()` fills `puff.rust_objects` with local backends so that `puff.redis`, `puff.postgres`, `puff.pubsub`,
+`puff.task_queue` and `puff.http` run on a plain Python interpreter. It is meant for tests and offline
+benchmarks of the Python layer, not for production. GraphQL needs the Rust engine and is not available.
+
+Every backend has a `latency_ms` attribute. When it is above zero, results are delivered from a scheduler thread
+after that many milliseconds to simulate a network round trip.
+
+    from puff import local_runtime
+
+    local_runtime.install(latency_ms=0.5)
+    local_runtime.run(my_main)
+"""
+import asyncio
+import bisect
+import hashlib
+import heapq
+import itertools
+import json
+import queue
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from http.cookies import SimpleCookie
+from io import BytesIO
+from typing import Any, Optional
+from urllib.parse import urlencode, urlsplit
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import puff
+from puff import RustObjects, rust_objects
+
+
+class Scheduler:
+    """
+    Run callbacks after a delay on a single background thread.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.heap = []
+        self.counter = itertools.count()
+        self.thread = None
+
+    def call_later(self, delay_ms, fn, *args):
+        """
+        Call `fn(*args)` after `delay_ms`. Returns an entry that can be passed to `cancel`.
+        """
+        entry = [time.monotonic() + delay_ms / 1000, next(self.counter), fn, args]
+        with self.condition:
+            heapq.heappush(self.heap, entry)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+            self.condition.notify()
+        return entry
+
+    def cancel(self, entry):
+        entry[2] = None
+
+    def run(self):
+        heap = self.heap
+        while True:
+            with self.condition:
+                while not heap:
+                    self.condition.wait()
+                delay = heap[0][0] - time.monotonic()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                _, _, fn, args = heapq.heappop(heap)
+            if fn is not None:
+                fn(*args)
+
+
+scheduler = Scheduler()
+
+
+def respond(rr, latency_ms, result, exception=None):
+    """
+    Deliver a result to a Puff callback, after `latency_ms` if it is positive.
+    """
+    if latency_ms > 0:
+        scheduler.call_later(latency_ms, rr, result, exception)
+    else:
+        rr(result, exception)
+
+
+def reply(rr, latency_ms, fn, *args):
+    """
+    Call `fn(*args)` now and deliver its result or exception to `rr`.
+    """
+    try:
+        result = fn(*args)
+    except Exception as e:
+        respond(rr, latency_ms, None, e)
+    else:
+        respond(rr, latency_ms, result)
+
+
+class Getter:
+    """
+    Mimics the Rust global getters: call it for the default client or use `by_name`.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+
+    def __call__(self):
+        return self.factory("default")
+
+    def by_name(self, name):
+        return self.factory(name)
+
+
+def to_bytes(value) -> bytes:
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode("utf8")
+    if isinstance(value, (bytearray, memoryview)):
+        return bytes(value)
+    if isinstance(value, bool):
+        return b"1" if value else b"0"
+    return str(value).encode("utf8")
+
+
+class RedisError(Exception):
+    pass
+
+
+WRONG_TYPE = "WRONGTYPE Operation against a key holding the wrong kind of value"
+
+
+script_emulations = {}
+
+
+def emulate_script(source: str, fn):
+    """
+    Run `fn(redis, keys, args)` whenever the local Redis is asked to run the Lua script `source`.
+
+    `redis` is the `LocalRedis`, so `fn` can use its `do_*` commands. It runs under the Redis lock, which makes it
+    atomic like a real script.
+    """
+    script_emulations[source] = fn
+
+
+class LocalRedis:
+    """
+    An in-memory Redis server with the same methods as the Rust Redis client.
+    """
+
+    def __init__(self, latency_ms=0):
+        self.latency_ms = latency_ms
+        self.lock = threading.RLock()
+        self.data = {}
+        self.expires = {}
+        self.blocked = {}
+        self.trackers = []
+        self.stream_readers = []
+        self.scripts = {}
+
+    # Storage helpers
+
+    def lookup(self, key, kind=None):
+        expires_at = self.expires.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.expires[key]
+            del self.data[key]
+            self.invalidate(key)
+            return None
+        value = self.data.get(key)
+        if value is not None and kind is not None and not isinstance(value, kind):
+            raise RedisError(WRONG_TYPE)
+        return value
+
+    def store(self, key, value, keep_ttl=False):
+        self.data[key] = value
+        if not keep_ttl:
+            self.expires.pop(key, None)
+        self.invalidate(key)
+
+    def remove(self, key):
+        existed = self.lookup(key) is not None
+        self.data.pop(key, None)
+        self.expires.pop(key, None)
+        if existed:
+            self.invalidate(key)
+        return existed
+
+    def invalidate(self, key):
+        # Emulates the push messages Redis sends to connections with CLIENT TRACKING on.
+        for prefixes, on_invalidate in self.trackers:
+            if not prefixes or key.startswith(prefixes):
+                on_invalidate([key])
+
+    def list_for(self, key, create=False):
+        value = self.lookup(key, deque)
+        if value is None and create:
+            value = deque()
+            self.store(key, value)
+        return value
+
+    def drop_if_empty(self, key, value):
+        if not value:
+            self.remove(key)
+
+    # Commands
+
+    def do_get(self, key):
+        return self.lookup(to_bytes(key), bytes)
+
+    def do_set(self, key, value, ex=None, nx=None, px=None, xx=None, keep_ttl=False):
+        key = to_bytes(key)
+        exists = self.lookup(key) is not None
+        if (nx and exists) or (xx and not exists):
+            return None
+        self.store(key, to_bytes(value), keep_ttl=keep_ttl)
+        if ex:
+            self.expires[key] = time.monotonic() + ex
+        elif px:
+            self.expires[key] = time.monotonic() + px / 1000
+        return True
+
+    def do_mset(self, values, nx=None):
+        values = [(to_bytes(k), to_bytes(v)) for k, v in values]
+        if nx and any(self.lookup(k) is not None for k, _ in values):
+            return False
+        for k, v in values:
+            self.store(k, v)
+        return True
+
+    def do_mget(self, keys):
+        return [self.lookup(to_bytes(k), bytes) for k in keys]
+
+    def do_persist(self, key):
+        key = to_bytes(key)
+        return self.lookup(key) is not None and self.expires.pop(key, None) is not None
+
+    def do_expire(self, key, seconds):
+        return self.do_pexpire(key, int(seconds) * 1000)
+
+    def do_pexpire(self, key, milliseconds):
+        key = to_bytes(key)
+        if self.lookup(key) is None:
+            return False
+        self.expires[key] = time.monotonic() + int(milliseconds) / 1000
+        return True
+
+    def do_pttl(self, key):
+        key = to_bytes(key)
+        if self.lookup(key) is None:
+            return -2
+        expires_at = self.expires.get(key)
+        if expires_at is None:
+            return -1
+        return max(0, round((expires_at - time.monotonic()) * 1000))
+
+    def do_ttl(self, key):
+        pttl = self.do_pttl(key)
+        return pttl if pttl < 0 else round(pttl / 1000)
+
+    def do_delete(self, *keys):
+        return sum(self.remove(to_bytes(k)) for k in keys)
+
+    def do_exists(self, *keys):
+        return sum(self.lookup(to_bytes(k)) is not None for k in keys)
+
+    def do_incr(self, key, delta=1):
+        key = to_bytes(key)
+        current = self.lookup(key, bytes)
+        try:
+            value = int(current or 0) + int(delta)
+        except ValueError:
+            raise RedisError("ERR value is not an integer or out of range")
+        self.store(key, str(value).encode("utf8"), keep_ttl=True)
+        return value
+
+    def do_decr(self, key, delta=1):
+        return self.do_incr(key, -int(delta))
+
+    def pop(self, key, count, left):
+        items = self.list_for(to_bytes(key))
+        if items is None:
+            return None
+        popper = items.popleft if left else items.pop
+        if count is None:
+            value = popper()
+        else:
+            value = [popper() for _ in range(min(count, len(items)))]
+        self.drop_if_empty(to_bytes(key), items)
+        return value
+
+    def do_lpop(self, key, count=None):
+        return self.pop(key, count, True)
+
+    def do_rpop(self, key, count=None):
+        return self.pop(key, count, False)
+
+    def push(self, key, values, left):
+        key = to_bytes(key)
+        items = self.list_for(key, create=True)
+        for value in values:
+            if left:
+                items.appendleft(to_bytes(value))
+            else:
+                items.append(to_bytes(value))
+        length = len(items)
+        self.serve_blocked(key)
+        return length
+
+    def do_lpush(self, key, *values):
+        return self.push(key, values, True)
+
+    def do_rpush(self, key, *values):
+        return self.push(key, values, False)
+
+    def do_rpoplpush(self, key, destination):
+        value = self.pop(key, None, False)
+        if value is not None:
+            self.push(destination, [value], True)
+        return value
+
+    def do_lrange(self, key, start, stop):
+        items = self.list_for(to_bytes(key))
+        if items is None:
+            return []
+        return slice_range(list(items), int(start), int(stop))
+
+    def do_llen(self, key):
+        items = self.list_for(to_bytes(key))
+        return 0 if items is None else len(items)
+
+    def hash_for(self, key, create=False):
+        value = self.lookup(key, dict)
+        if value is None and create:
+            value = {}
+            self.store(key, value)
+        return value
+
+    def do_hset(self, key, *field_values):
+        mapping = self.hash_for(to_bytes(key), create=True)
+        added = 0
+        for field, value in zip(field_values[::2], field_values[1::2]):
+            field = to_bytes(field)
+            added += field not in mapping
+            mapping[field] = to_bytes(value)
+        return added
+
+    def do_hget(self, key, field):
+        mapping = self.hash_for(to_bytes(key))
+        return None if mapping is None else mapping.get(to_bytes(field))
+
+    def do_hmget(self, key, *fields):
+        mapping = self.hash_for(to_bytes(key)) or {}
+        return [mapping.get(to_bytes(f)) for f in fields]
+
+    def do_hgetall(self, key):
+        mapping = self.hash_for(to_bytes(key)) or {}
+        return [x for item in mapping.items() for x in item]
+
+    def do_hdel(self, key, *fields):
+        key = to_bytes(key)
+        mapping = self.hash_for(key)
+        if mapping is None:
+            return 0
+        removed = sum(mapping.pop(to_bytes(f), None) is not None for f in fields)
+        self.drop_if_empty(key, mapping)
+        return removed
+
+    def do_hincrby(self, key, field, delta):
+        mapping = self.hash_for(to_bytes(key), create=True)
+        field = to_bytes(field)
+        value = int(mapping.get(field, 0)) + int(delta)
+        mapping[field] = str(value).encode("utf8")
+        return value
+
+    def do_hlen(self, key):
+        return len(self.hash_for(to_bytes(key)) or {})
+
+    def set_for(self, key, create=False):
+        value = self.lookup(key, set)
+        if value is None and create:
+            value = set()
+            self.store(key, value)
+        return value
+
+    def do_sadd(self, key, *members):
+        members_set = self.set_for(to_bytes(key), create=True)
+        before = len(members_set)
+        members_set.update(to_bytes(m) for m in members)
+        return len(members_set) - before
+
+    def do_srem(self, key, *members):
+        key = to_bytes(key)
+        members_set = self.set_for(key)
+        if members_set is None:
+            return 0
+        before = len(members_set)
+        members_set.difference_update(to_bytes(m) for m in members)
+        removed = before - len(members_set)
+        self.drop_if_empty(key, members_set)
+        return removed
+
+    def do_smembers(self, key):
+        return sorted(self.set_for(to_bytes(key)) or ())
+
+    def do_sismember(self, key, member):
+        return int(to_bytes(member) in (self.set_for(to_bytes(key)) or ()))
+
+    def do_scard(self, key):
+        return len(self.set_for(to_bytes(key)) or ())
+
+    def do_keys(self, pattern=b"*"):
+        matcher = glob_matcher(pattern)
+        return [k for k in list(self.data) if matcher(k) and self.lookup(k) is not None]
+
+    def do_dbsize(self):
+        return len(self.do_keys())
+
+    def do_scan(self, cursor, *options):
+        options = scan_options(options)
+        kind = SCAN_TYPES.get(options.pop("type", b"").lower())
+        keys = sorted(self.do_keys())
+        if kind is not None:
+            keys = [k for k in keys if isinstance(self.data[k], kind)]
+        return scan_page(keys, cursor, options)
+
+    def do_hscan(self, key, cursor, *options):
+        mapping = self.hash_for(to_bytes(key)) or {}
+        page = scan_page(sorted(mapping), cursor, scan_options(options))
+        return [page[0], [v for f in page[1] for v in (f, mapping[f])]]
+
+    def do_sscan(self, key, cursor, *options):
+        members = sorted(self.set_for(to_bytes(key)) or ())
+        return scan_page(members, cursor, scan_options(options))
+
+    def do_flushdb(self):
+        self.data.clear()
+        self.expires.clear()
+        for _, on_invalidate in self.trackers:
+            on_invalidate(None)
+        return "OK"
+
+    def do_ping(self, message=None):
+        return "PONG" if message is None else to_bytes(message)
+
+    # Scripts
+
+    def do_script(self, subcommand, *args):
+        subcommand = to_bytes(subcommand).upper()
+        if subcommand == b"LOAD":
+            return self.load_script(args[0])
+        if subcommand == b"EXISTS":
+            return [int(to_bytes(sha).decode("ascii") in self.scripts) for sha in args]
+        if subcommand == b"FLUSH":
+            self.scripts.clear()
+            return "OK"
+        raise RedisError("ERR unknown SCRIPT subcommand")
+
+    def load_script(self, source):
+        source = to_bytes(source).decode("utf8")
+        sha = hashlib.sha1(source.encode("utf8")).hexdigest()
+        self.scripts[sha] = source
+        return sha
+
+    def do_eval(self, source, numkeys, *keys_and_args):
+        sha = self.load_script(source)
+        return self.do_evalsha(sha, numkeys, *keys_and_args)
+
+    def do_evalsha(self, sha, numkeys, *keys_and_args):
+        source = self.scripts.get(to_bytes(sha).decode("ascii"))
+        if source is None:
+            raise RedisError("NOSCRIPT No matching script. Please use EVAL.")
+        emulation = script_emulations.get(source)
+        if emulation is None:
+            raise RedisError(
+                "ERR Lua is not available in the local runtime, see local_runtime.emulate_script"
+            )
+        numkeys = int(numkeys)
+        return emulation(self, keys_and_args[:numkeys], keys_and_args[numkeys:])
+
+    # Streams
+
+    def stream_for(self, key, create=False):
+        value = self.lookup(key, LocalStream)
+        if value is None and create:
+            value = LocalStream()
+            self.store(key, value)
+        return value
+
+    def do_xadd(self, key, *args):
+        key = to_bytes(key)
+        args = [to_bytes(a) for a in args]
+        maxlen = None
+        if args[0].upper() == b"MAXLEN":
+            args.pop(0)
+            if args[0] in (b"~", b"="):
+                args.pop(0)
+            maxlen = int(args.pop(0))
+        id, *fields = args
+        stream = self.stream_for(key, create=True)
+        id = stream.add(id, fields)
+        if maxlen is not None:
+            stream.trim(maxlen)
+        self.serve_stream_readers(key)
+        return id
+
+    def do_xlen(self, key):
+        stream = self.stream_for(to_bytes(key))
+        return 0 if stream is None else len(stream.entries)
+
+    def do_xgroup(self, subcommand, key, group, id=b"$", *options):
+        if to_bytes(subcommand).upper() != b"CREATE":
+            raise RedisError("ERR only XGROUP CREATE is supported")
+        mkstream = any(to_bytes(o).upper() == b"MKSTREAM" for o in options)
+        stream = self.stream_for(to_bytes(key), create=mkstream)
+        if stream is None:
+            raise RedisError("ERR The XGROUP subcommand requires the key to exist")
+        group = to_bytes(group)
+        if group in stream.groups:
+            raise RedisError("BUSYGROUP Consumer Group name already exists")
+        id = to_bytes(id)
+        stream.groups[group] = LocalStreamGroup(
+            stream.last_id if id == b"$" else parse_stream_id(id)
+        )
+        return "OK"
+
+    def do_xreadgroup(self, *args):
+        request = parse_xreadgroup(args)
+        result = []
+        for key, id in request["streams"]:
+            stream = self.stream_for(key)
+            group = None if stream is None else stream.groups.get(request["group"])
+            if group is None:
+                raise RedisError(f"NOGROUP No such key '{key.decode()}' or consumer group")
+            entries = group.read(stream, request["consumer"], id, request["count"])
+            if entries or id != b">":
+                result.append([key, entries])
+        return result or None
+
+    def do_xack(self, key, group, *ids):
+        stream = self.stream_for(to_bytes(key))
+        group = None if stream is None else stream.groups.get(to_bytes(group))
+        if group is None:
+            return 0
+        return sum(group.pending.pop(parse_stream_id(id), None) is not None for id in ids)
+
+    def do_xautoclaim(self, key, group, consumer, min_idle_ms, start, *options):
+        stream = self.stream_for(to_bytes(key))
+        group = None if stream is None else stream.groups.get(to_bytes(group))
+        if group is None:
+            raise RedisError("NOGROUP No such key or consumer group")
+        count = int(scan_options(options).get("count", 100))
+        return group.autoclaim(stream, to_bytes(consumer), int(min_idle_ms), parse_stream_id(start), count)
+
+    def read_group_blocking(self, rr, args):
+        with self.lock:
+            try:
+                result = self.do_xreadgroup(*args)
+            except RedisError as e:
+                return respond(rr, self.latency_ms, None, e)
+            block_ms = parse_xreadgroup(args)["block"]
+            if result is not None or block_ms is None:
+                return respond(rr, self.latency_ms, result)
+            waiter = [rr, args, None]
+            if block_ms:
+                waiter[2] = scheduler.call_later(block_ms, self.stream_read_timeout, waiter)
+            self.stream_readers.append(waiter)
+
+    def serve_stream_readers(self, key):
+        for waiter in list(self.stream_readers):
+            rr, args, timer = waiter
+            result = self.do_xreadgroup(*args)
+            if result is not None:
+                self.stream_readers.remove(waiter)
+                if timer is not None:
+                    scheduler.cancel(timer)
+                respond(rr, self.latency_ms, result)
+
+    def stream_read_timeout(self, waiter):
+        with self.lock:
+            if waiter not in self.stream_readers:
+                return
+            self.stream_readers.remove(waiter)
+        waiter[0](None, None)
+
+    # Blocking pops
+
+    def serve_blocked(self, key):
+        waiters = self.blocked.get(key)
+        while waiters:
+            items = self.list_for(key)
+            if not items:
+                break
+            rr, left, timer = waiters.popleft()
+            if timer is not None:
+                scheduler.cancel(timer)
+            value = items.popleft() if left else items.pop()
+            self.drop_if_empty(key, items)
+            respond(rr, self.latency_ms, (key, value))
+        if waiters is not None and not waiters:
+            self.blocked.pop(key, None)
+
+    def block_pop(self, rr, key, timeout, left):
+        key = to_bytes(key)
+        with self.lock:
+            items = self.list_for(key)
+            if items:
+                value = items.popleft() if left else items.pop()
+                self.drop_if_empty(key, items)
+                respond(rr, self.latency_ms, (key, value))
+                return
+            waiter = [rr, left, None]
+            if timeout:
+                waiter[2] = scheduler.call_later(
+                    timeout * 1000, self.block_timeout, key, waiter
+                )
+            self.blocked.setdefault(key, deque()).append(waiter)
+
+    def block_timeout(self, key, waiter):
+        with self.lock:
+            waiters = self.blocked.get(key)
+            if waiters is None or waiter not in waiters:
+                return
+            waiters.remove(waiter)
+        waiter[0](None, None)
+
+    # Interface used by puff.redis.RedisClient
+
+    def call(self, rr, fn, *args):
+        with self.lock:
+            reply(rr, self.latency_ms, fn, *args)
+
+    def get(self, rr, key):
+        self.call(rr, self.do_get, key)
+
+    def set(self, rr, key, value, ex=None, nx=None):
+        self.call(rr, self.do_set, key, value, ex, nx)
+
+    def mset(self, rr, values, nx=None):
+        self.call(rr, self.do_mset, values, nx)
+
+    def mget(self, rr, keys):
+        self.call(rr, self.do_mget, keys)
+
+    def persist(self, rr, key):
+        self.call(rr, self.do_persist, key)
+
+    def expire(self, rr, key, seconds):
+        self.call(rr, self.do_expire, key, seconds)
+
+    def delete(self, rr, key):
+        self.call(rr, lambda: bool(self.do_delete(key)))
+
+    def incr(self, rr, key, delta):
+        self.call(rr, self.do_incr, key, delta)
+
+    def decr(self, rr, key, delta):
+        self.call(rr, self.do_decr, key, delta)
+
+    def lpop(self, rr, key, count=1):
+        self.call(rr, self.do_lpop, key, None if count == 1 else count)
+
+    def rpop(self, rr, key, count=1):
+        self.call(rr, self.do_rpop, key, None if count == 1 else count)
+
+    def blpop(self, rr, key, timeout):
+        self.block_pop(rr, key, timeout, True)
+
+    def brpop(self, rr, key, timeout):
+        self.block_pop(rr, key, timeout, False)
+
+    def lpush(self, rr, key, value):
+        self.call(rr, self.do_lpush, key, value)
+
+    def rpush(self, rr, key, value):
+        self.call(rr, self.do_rpush, key, value)
+
+    def rpoplpush(self, rr, key, destination):
+        self.call(rr, self.do_rpoplpush, key, destination)
+
+    def command(self, rr, command):
+        if command and to_bytes(command[0]).lower() == b"xreadgroup":
+            return self.read_group_blocking(rr, command[1:])
+        self.call(rr, self.execute_command, command)
+
+    def enable_tracking(self, rr, prefixes, on_invalidate):
+        prefixes = tuple(to_bytes(p) for p in prefixes)
+        self.call(rr, self.trackers.append, (prefixes, on_invalidate))
+
+    def pipeline(self, rr, commands, transaction=False):
+        # The lock already makes the whole batch atomic, so MULTI/EXEC needs no extra work.
+        self.call(rr, lambda: [self.try_command(command) for command in commands])
+
+    def try_command(self, command):
+        try:
+            return self.execute_command(command)
+        except RedisError as e:
+            return e
+
+    def execute_command(self, command):
+        if not command:
+            raise RedisError("ERR empty command")
+        name, *args = command
+        name = to_bytes(name).decode("utf8").lower()
+        parser = COMMAND_PARSERS.get(name)
+        if parser is not None:
+            return parser(self, args)
+        fn = getattr(self, "do_" + name, None)
+        if fn is None:
+            raise RedisError(f"ERR unknown command '{name}'")
+        return fn(*args)
+
+
+def slice_range(items, start, stop):
+    length = len(items)
+    if start < 0:
+        start = max(length + start, 0)
+    if stop < 0:
+        stop = length + stop
+    return items[start : stop + 1]
+
+
+def parse_stream_id(id):
+    id = to_bytes(id)
+    if id == b"-":
+        return (0, 0)
+    ms, _, seq = id.partition(b"-")
+    return (int(ms), int(seq or 0))
+
+
+def format_stream_id(id):
+    return b"%d-%d" % id
+
+
+def parse_xreadgroup(args):
+    args = [to_bytes(a) for a in args]
+    request = {"count": None, "block": None}
+    ix = 0
+    while ix < len(args):
+        option = args[ix].upper()
+        if option == b"GROUP":
+            request["group"], request["consumer"] = args[ix + 1], args[ix + 2]
+            ix += 3
+        elif option in (b"COUNT", b"BLOCK"):
+            request[option.decode().lower()] = int(args[ix + 1])
+            ix += 2
+        elif option == b"NOACK":
+            ix += 1
+        elif option == b"STREAMS":
+            rest = args[ix + 1 :]
+            half = len(rest) // 2
+            request["streams"] = list(zip(rest[:half], rest[half:]))
+            break
+        else:
+            raise RedisError("ERR syntax error")
+    return request
+
+
+class LocalStreamGroup:
+    def __init__(self, last_id):
+        self.last_id = last_id
+        # Maps entry id to [consumer, delivered at, delivery count], ordered by id.
+        self.pending = {}
+
+    def read(self, stream, consumer, id, count):
+        if id != b">":
+            after = parse_stream_id(id)
+            ids = sorted(i for i, p in self.pending.items() if p[0] == consumer and i > after)
+            return [[format_stream_id(i), stream.fields(i)] for i in ids[:count]]
+        entries = []
+        for entry_id, fields in stream.entries_after(self.last_id):
+            if count is not None and len(entries) >= count:
+                break
+            self.last_id = entry_id
+            self.pending[entry_id] = [consumer, time.monotonic(), 1]
+            entries.append([format_stream_id(entry_id), list(fields)])
+        return entries
+
+    def autoclaim(self, stream, consumer, min_idle_ms, start, count):
+        now = time.monotonic()
+        claimed = []
+        deleted = []
+        ids = sorted(i for i in self.pending if i >= start)
+        for ix, entry_id in enumerate(ids):
+            if len(claimed) + len(deleted) >= count:
+                return [format_stream_id(entry_id), claimed, deleted]
+            pending = self.pending[entry_id]
+            if (now - pending[1]) * 1000 < min_idle_ms:
+                continue
+            fields = stream.fields(entry_id)
+            if fields is None:
+                del self.pending[entry_id]
+                deleted.append(format_stream_id(entry_id))
+                continue
+            self.pending[entry_id] = [consumer, now, pending[2] + 1]
+            claimed.append([format_stream_id(entry_id), fields])
+        return [b"0-0", claimed, deleted]
+
+
+class LocalStream:
+    def __init__(self):
+        self.entries = {}
+        self.last_id = (0, 0)
+        self.groups = {}
+
+    def add(self, id, fields):
+        if id == b"*":
+            ms = int(time.time() * 1000)
+            if ms <= self.last_id[0]:
+                entry_id = (self.last_id[0], self.last_id[1] + 1)
+            else:
+                entry_id = (ms, 0)
+        else:
+            entry_id = parse_stream_id(id)
+            if entry_id <= self.last_id:
+                raise RedisError(
+                    "ERR The ID specified in XADD is equal or smaller than the target stream top item"
+                )
+        self.entries[entry_id] = fields
+        self.last_id = entry_id
+        return format_stream_id(entry_id)
+
+    def entries_after(self, after):
+        return [(i, f) for i, f in self.entries.items() if i > after]
+
+    def fields(self, entry_id):
+        fields = self.entries.get(entry_id)
+        return None if fields is None else list(fields)
+
+    def trim(self, maxlen):
+        while len(self.entries) > maxlen:
+            del self.entries[next(iter(self.entries))]
+
+
+SCAN_TYPES = {
+    b"string": bytes,
+    b"list": deque,
+    b"hash": dict,
+    b"set": set,
+    b"stream": LocalStream,
+}
+
+
+def scan_options(options):
+    options = iter(options)
+    return {to_bytes(k).decode("utf8").lower(): to_bytes(v) for k, v in zip(options, options)}
+
+
+scan_cursors = {}
+scan_cursor_ids = itertools.count(1)
+
+
+def scan_page(items, cursor, options):
+    """
+    One page of a SCAN style reply over sorted `items`.
+
+    Cursors remember the last item returned, so like Redis, items that exist for the whole scan are returned even if
+    others are deleted in between.
+    """
+    cursor = int(cursor)
+    start = 0 if cursor == 0 else bisect.bisect_right(items, scan_cursors.pop(cursor))
+    end = start + int(options.get("count", 10))
+    page = items[start:end]
+    next_cursor = 0
+    if end < len(items):
+        next_cursor = next(scan_cursor_ids)
+        scan_cursors[next_cursor] = page[-1]
+    match = options.get("match")
+    if match is not None:
+        matcher = glob_matcher(match)
+        page = [item for item in page if matcher(item)]
+    return [str(next_cursor).encode("utf8"), page]
+
+
+def glob_matcher(pattern):
+    pattern = to_bytes(pattern)
+    regex = re.escape(pattern).replace(rb"\*", rb".*").replace(rb"\?", rb".")
+    return re.compile(regex + rb"\Z", re.DOTALL).match
+
+
+def parse_set(redis, args):
+    key, value, *options = args
+    kwargs = {}
+    options = iter(options)
+    for option in options:
+        option = to_bytes(option).upper()
+        if option == b"EX":
+            kwargs["ex"] = int(next(options))
+        elif option == b"PX":
+            kwargs["px"] = int(next(options))
+        elif option == b"NX":
+            kwargs["nx"] = True
+        elif option == b"XX":
+            kwargs["xx"] = True
+        elif option == b"KEEPTTL":
+            kwargs["keep_ttl"] = True
+        else:
+            raise RedisError("ERR syntax error")
+    return "OK" if redis.do_set(key, value, **kwargs) else None
+
+
+COMMAND_PARSERS = {
+    "set": parse_set,
+    "del": lambda redis, args: redis.do_delete(*args),
+    "unlink": lambda redis, args: redis.do_delete(*args),
+    "incrby": lambda redis, args: redis.do_incr(*args),
+    "decrby": lambda redis, args: redis.do_decr(*args),
+    "mset": lambda redis, args: "OK"
+    if redis.do_mset(zip(args[::2], args[1::2]))
+    else None,
+    "msetnx": lambda redis, args: int(
+        redis.do_mset(zip(args[::2], args[1::2]), nx=True)
+    ),
+    "mget": lambda redis, args: redis.do_mget(args),
+    "lpop": lambda redis, args: redis.do_lpop(args[0], int(args[1]) if args[1:] else None),
+    "rpop": lambda redis, args: redis.do_rpop(args[0], int(args[1]) if args[1:] else None),
+}
+
+
+class LocalPostgresCursor:
+    """
+    A SQLite cursor with the interface of the Rust Postgres cursor. Queries use `$N` placeholders.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.cursor = client.connection.cursor()
+        self.arraysize = 1
+        # Rows returned by the last `FETCH` from a server side cursor.
+        self.fetched = None
+
+    def call(self, r, fn, *args):
+        reply(r, self.client.latency_ms, fn, *args)
+
+    def do_execute(self, q, params):
+        self.fetched = None
+        self.client.begin()
+        if portal_statement(q):
+            return self.do_portal_statement(q, params)
+        self.cursor.execute(to_sqlite_query(q), to_sqlite_params(params))
+
+    def do_portal_statement(self, q, params):
+        portals = self.client.portals
+        m = DECLARE_RE.match(q)
+        if m is not None:
+            name, hold, query = m.groups()
+            if name in portals:
+                raise sqlite3.OperationalError(f'cursor "{name}" already exists')
+            portals[name] = LocalPortal(
+                self.client.connection.cursor(),
+                to_sqlite_query(query),
+                to_sqlite_params(params),
+                withhold=hold.upper() == "WITH",
+            )
+            return
+        m = FETCH_RE.match(q)
+        if m is not None:
+            count, name = m.groups()
+            portal = portals.get(name)
+            if portal is None:
+                raise sqlite3.OperationalError(f'cursor "{name}" does not exist')
+            self.fetched = portal.fetch(None if count.upper() == "ALL" else int(count))
+            return
+        m = CLOSE_RE.match(q)
+        if portals.pop(m.group(1), None) is None:
+            raise sqlite3.OperationalError(f'cursor "{m.group(1)}" does not exist')
+
+    def do_executemany(self, q, seq_of_params):
+        self.client.begin()
+        self.cursor.executemany(
+            to_sqlite_query(q), (to_sqlite_params(p) for p in seq_of_params)
+        )
+
+    def execute(self, r, q, params=None):
+        self.call(r, self.do_execute, q, params)
+
+    def copy_in(self, r, q):
+        self.call(r, self.do_copy, q, "FROM")
+
+    def copy_out(self, r, q):
+        self.call(r, self.do_copy, q, "TO")
+
+    def do_copy(self, q, direction):
+        m = COPY_RE.match(q)
+        if m is None or m.group(3).upper() != direction:
+            raise sqlite3.OperationalError(f"unsupported COPY statement: {q}")
+        target, columns, _, options = m.groups()
+        options = dict(
+            (k.lower(), v.strip("'").replace("''", "'"))
+            for k, v in COPY_OPTION_RE.findall(options or "")
+        )
+        if options.get("format", "text").lower() != "text":
+            raise sqlite3.NotSupportedError("the local runtime only supports COPY in text format")
+        sep = options.get("delimiter", "\t")
+        null = options.get("null", "\\N")
+        self.fetched = None
+        self.client.begin()
+        if direction == "FROM":
+            return LocalCopyIn(self, target, columns, sep, null)
+        if target.startswith("("):
+            query = target[1:-1]
+        else:
+            query = f"SELECT {columns or '*'} FROM {target}"
+        cursor = self.client.connection.cursor()
+        cursor.execute(to_sqlite_query(query))
+        return LocalCopyOut(self, cursor, sep, null)
+
+    def execute_prepared(self, r, statement, params=None):
+        self.call(r, self.do_execute, statement.query, params)
+
+    def executemany(self, r, q, seq_of_params):
+        self.call(r, self.do_executemany, q, seq_of_params)
+
+    def do_get_rowcount(self, r):
+        if self.fetched is not None:
+            return self.call(r, lambda: self.fetched.rowcount)
+        self.call(r, lambda: self.cursor.rowcount)
+
+    def description(self, r):
+        if self.fetched is not None:
+            return self.call(r, lambda: self.fetched.description)
+        self.call(r, lambda: self.cursor.description)
+
+    def fetchone(self, r):
+        if self.fetched is not None:
+            return self.call(r, self.fetched.fetchone)
+        self.call(r, self.cursor.fetchone)
+
+    def fetchmany(self, r, rowcount=None):
+        if self.fetched is not None:
+            return self.call(r, self.fetched.fetchmany, rowcount or self.arraysize)
+        self.call(r, self.cursor.fetchmany, rowcount or self.arraysize)
+
+    def fetchall(self, r):
+        if self.fetched is not None:
+            return self.call(r, self.fetched.fetchall)
+        self.call(r, self.cursor.fetchall)
+
+    def close(self):
+        try:
+            self.cursor.close()
+        except sqlite3.ProgrammingError:
+            # The connection was closed first.
+            pass
+
+
+PLACEHOLDER_RE = re.compile(r"\$(\d+)")
+QUOTED_NAME = r'"((?:[^"]|"")*)"'
+PORTAL_STATEMENT_RE = re.compile(r"\s*(DECLARE|FETCH|CLOSE)\s", re.I)
+DECLARE_RE = re.compile(
+    rf"\s*DECLARE\s+{QUOTED_NAME}\s+(?:NO\s+)?(?:SCROLL\s+)?CURSOR\s+(WITH|WITHOUT)\s+HOLD\s+FOR\s+(.*)",
+    re.I | re.S,
+)
+FETCH_RE = re.compile(rf"\s*FETCH\s+FORWARD\s+(\d+|ALL)\s+FROM\s+{QUOTED_NAME}\s*$", re.I)
+CLOSE_RE = re.compile(rf"\s*CLOSE\s+{QUOTED_NAME}\s*$", re.I)
+
+
+def portal_statement(q):
+    return PORTAL_STATEMENT_RE.match(q) is not None
+
+
+class LocalFetchedRows:
+    """
+    The result of a `FETCH`, read back with the usual cursor methods.
+    """
+
+    def __init__(self, rows, description, rowcount=None):
+        self.rows = deque(rows)
+        self.rowcount = len(self.rows) if rowcount is None else rowcount
+        self.description = description
+
+    def fetchone(self):
+        return self.rows.popleft() if self.rows else None
+
+    def fetchmany(self, rowcount):
+        rows = self.rows
+        return [rows.popleft() for _ in range(min(rowcount, len(rows)))]
+
+    def fetchall(self):
+        rows = list(self.rows)
+        self.rows.clear()
+        return rows
+
+
+COPY_RE = re.compile(
+    r"\s*COPY\s+(\(.*\)|[^\s(]+)\s*(?:\(([^)]*)\))?\s+(FROM|TO)\s+(?:STDIN|STDOUT)(?:\s+(?:WITH\s*)?\((.*)\))?\s*$",
+    re.I | re.S,
+)
+COPY_OPTION_RE = re.compile(r"(\w+)\s+('(?:[^']|'')*'|\w+)")
+COPY_ESCAPES = {"b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t", "v": "\v"}
+
+
+def split_copy_line(line, sep, null):
+    """
+    Splits one line of COPY text format into values, undoing backslash escapes.
+    """
+    values = []
+    field = []
+    raw = []
+    chars = iter(line)
+    for c in chars:
+        if c == "\\":
+            escaped = next(chars, "")
+            raw.append(c + escaped)
+            field.append(COPY_ESCAPES.get(escaped, escaped))
+        elif c == sep:
+            values.append(None if "".join(raw) == null else "".join(field))
+            field.clear()
+            raw.clear()
+        else:
+            raw.append(c)
+            field.append(c)
+    values.append(None if "".join(raw) == null else "".join(field))
+    return values
+
+
+def format_copy_value(value, sep, null):
+    if value is None:
+        return null
+    if isinstance(value, bytes):
+        return "\\\\x" + value.hex()
+    value = str(value).replace("\\", "\\\\")
+    for escape, c in COPY_ESCAPES.items():
+        value = value.replace(c, "\\" + escape)
+    return value.replace(sep, "\\" + sep)
+
+
+class LocalCopyIn:
+    """
+    Receives `COPY ... FROM STDIN` data in chunks and inserts every complete line as it arrives.
+    """
+
+    def __init__(self, cursor, table, columns, sep, null):
+        self.cursor = cursor
+        self.table = table
+        self.columns = columns
+        self.sep = sep
+        self.null = null
+        self.pending = b""
+        self.rowcount = 0
+
+    def insert(self, lines):
+        rows = [
+            split_copy_line(line.decode("utf8"), self.sep, self.null)
+            for line in lines
+            if line != b"\\."
+        ]
+        if not rows:
+            return
+        columns = f" ({self.columns})" if self.columns else ""
+        placeholders = ", ".join("?" * len(rows[0]))
+        self.cursor.cursor.executemany(
+            f"INSERT INTO {self.table}{columns} VALUES ({placeholders})", rows
+        )
+        self.rowcount += len(rows)
+
+    def do_write(self, data):
+        lines = (self.pending + bytes(data)).split(b"\n")
+        self.pending = lines.pop()
+        self.insert(lines)
+
+    def do_finish(self):
+        if self.pending:
+            self.insert([self.pending])
+            self.pending = b""
+        self.cursor.fetched = LocalFetchedRows((), None, rowcount=self.rowcount)
+
+    def write(self, r, data):
+        self.cursor.call(r, self.do_write, data)
+
+    def finish(self, r):
+        self.cursor.call(r, self.do_finish)
+
+    def abort(self, r, message):
+        self.pending = b""
+        self.cursor.call(r, lambda: None)
+
+
+class LocalCopyOut:
+    """
+    Streams the rows of `COPY ... TO STDOUT` back in chunks.
+    """
+
+    def __init__(self, cursor, source, sep, null, batch_size=1000):
+        self.cursor = cursor
+        self.source = source
+        self.sep = sep
+        self.null = null
+        self.batch_size = batch_size
+
+    def do_read(self):
+        rows = self.source.fetchmany(self.batch_size)
+        if not rows:
+            return None
+        sep, null = self.sep, self.null
+        return "".join(
+            sep.join(format_copy_value(v, sep, null) for v in row) + "\n"
+            for row in rows
+        ).encode("utf8")
+
+    def read(self, r):
+        self.cursor.call(r, self.do_read)
+
+
+class LocalPortal:
+    """
+    Emulates a Postgres server side cursor with a SQLite cursor that is read lazily.
+
+    Cursors declared `WITH HOLD` outlive their transaction, so their rows are read up front.
+    """
+
+    def __init__(self, cursor, query, params, withhold=False):
+        self.cursor = cursor
+        self.withhold = withhold
+        cursor.execute(query, params)
+        self.description = cursor.description
+        self.held = deque(cursor.fetchall()) if withhold else None
+
+    def fetch(self, count):
+        if self.held is not None:
+            held = self.held
+            if count is None:
+                count = len(held)
+            rows = [held.popleft() for _ in range(min(count, len(held)))]
+        elif count is None:
+            rows = self.cursor.fetchall()
+        else:
+            rows = self.cursor.fetchmany(count)
+        return LocalFetchedRows(rows, self.description)
+
+
+def to_sqlite_query(q):
+    return PLACEHOLDER_RE.sub(r"?\1", q)
+
+
+def to_sqlite_params(params):
+    if params is None:
+        return ()
+    return [adapt_sqlite_param(p) for p in params]
+
+
+def adapt_sqlite_param(value):
+    if value is None or isinstance(value, (int, float, str, bytes)):
+        return value
+    if isinstance(value, (bytearray, memoryview)):
+        return bytes(value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+class LocalPreparedStatement:
+    """
+    SQLite keeps its own statement cache, so a prepared statement only needs to remember its query.
+    """
+
+    def __init__(self, query):
+        self.query = query
+
+
+class LocalPostgresClient:
+    """
+    A connection to a local SQLite database, standing in for a pooled Postgres connection.
+    """
+
+    def __init__(self, database, latency_ms=0):
+        self.latency_ms = latency_ms
+        self.connection = sqlite3.connect(
+            database, uri=True, isolation_level=None, check_same_thread=False
+        )
+        self.auto_commit = False
+        self.portals = {}
+
+    def begin(self):
+        if not self.auto_commit and not self.connection.in_transaction:
+            self.connection.execute("BEGIN")
+
+    def end(self, statement):
+        # Cursors declared `WITHOUT HOLD` close with their transaction.
+        self.portals = {k: v for k, v in self.portals.items() if v.withhold}
+        if self.connection.in_transaction:
+            self.connection.execute(statement)
+
+    def cursor(self):
+        return LocalPostgresCursor(self)
+
+    def prepare(self, rr, q):
+        respond(rr, self.latency_ms, LocalPreparedStatement(q))
+
+    def set_auto_commit(self, rr, value):
+        def do_set_auto_commit():
+            self.auto_commit = value
+            if value:
+                self.end("COMMIT")
+
+        reply(rr, self.latency_ms, do_set_auto_commit)
+
+    def commit(self, rr):
+        reply(rr, self.latency_ms, self.end, "COMMIT")
+
+    def rollback(self, rr):
+        reply(rr, self.latency_ms, self.end, "ROLLBACK")
+
+    def close(self):
+        self.connection.close()
+
+
+class LocalPostgres:
+    """
+    Hands out connections to one shared SQLite database.
+
+    The default database is a shared in-memory database that lives as long as this object.
+    """
+
+    def __init__(self, name, database=None, latency_ms=0):
+        self.latency_ms = latency_ms
+        if database is None:
+            database = f"file:puff-local-{name}-{uuid.uuid4().hex}?mode=memory&cache=shared"
+        self.database = database
+        # Keeps a shared in-memory database alive while connections come and go.
+        self.anchor = sqlite3.connect(database, uri=True, check_same_thread=False)
+
+    def __call__(self):
+        return LocalPostgresClient(self.database, latency_ms=self.latency_ms)
+
+
+class LocalPubSubMessage:
+    def __init__(self, from_connection_id: str, body: bytes):
+        self.from_connection_id = from_connection_id
+        self.body = body
+
+    @property
+    def text(self) -> Optional[str]:
+        try:
+            return self.body.decode("utf8")
+        except UnicodeDecodeError:
+            return None
+
+    def json(self) -> Any:
+        return json.loads(self.body)
+
+
+class LocalPubSubConnection:
+    def __init__(self, pubsub, connection_id):
+        self.pubsub = pubsub
+        self.connection_id = connection_id
+        self.channels = set()
+        self.inbox = deque()
+        self.waiting = None
+
+    def who_am_i(self) -> str:
+        return self.connection_id
+
+    def deliver(self, message):
+        rr = self.waiting
+        if rr is None:
+            self.inbox.append(message)
+        else:
+            self.waiting = None
+            respond(rr, self.pubsub.latency_ms, message)
+
+    def receive(self, rr):
+        with self.pubsub.lock:
+            if self.inbox:
+                respond(rr, self.pubsub.latency_ms, self.inbox.popleft())
+            else:
+                self.waiting = rr
+
+    def subscribe(self, rr, channel):
+        with self.pubsub.lock:
+            self.channels.add(channel)
+            self.pubsub.channels.setdefault(channel, set()).add(self)
+        respond(rr, self.pubsub.latency_ms, True)
+
+    def unsubscribe(self, rr, channel):
+        with self.pubsub.lock:
+            self.channels.discard(channel)
+            self.pubsub.channels.get(channel, set()).discard(self)
+        respond(rr, self.pubsub.latency_ms, True)
+
+    def publish(self, rr, channel, message):
+        self.pubsub.publish_as(rr, self.connection_id, channel, message)
+
+    def publish_bytes(self, rr, channel, message):
+        self.pubsub.publish_bytes_as(rr, self.connection_id, channel, message)
+
+    def publish_json(self, rr, channel, message):
+        self.pubsub.publish_json_as(rr, self.connection_id, channel, message)
+
+
+class LocalPubSub:
+    """
+    In-process pub/sub with the interface of the Rust PubSub client.
+    """
+
+    def __init__(self, latency_ms=0):
+        self.latency_ms = latency_ms
+        self.lock = threading.Lock()
+        self.channels = {}
+
+    def new_connection_id(self) -> str:
+        return uuid.uuid4().hex
+
+    def connection(self):
+        return self.connection_with_id(self.new_connection_id())
+
+    def connection_with_id(self, connection_id):
+        return LocalPubSubConnection(self, connection_id)
+
+    def publish_bytes_as(self, rr, connection_id, channel, message):
+        message = LocalPubSubMessage(connection_id, to_bytes(message))
+        with self.lock:
+            for connection in list(self.channels.get(channel, ())):
+                connection.deliver(message)
+        respond(rr, self.latency_ms, True)
+
+    def publish_as(self, rr, connection_id, channel, message):
+        self.publish_bytes_as(rr, connection_id, channel, message)
+
+    def publish_json_as(self, rr, connection_id, channel, message):
+        self.publish_bytes_as(rr, connection_id, channel, json.dumps(message))
+
+
+class LocalTaskQueue:
+    """
+    Runs scheduled tasks in this process on the blocking pool (or the asyncio loop for async functions).
+    """
+
+    def __init__(self, latency_ms=0):
+        self.latency_ms = latency_ms
+        self.lock = threading.Lock()
+        self.results = {}
+        self.waiters = {}
+
+    def add_task(
+        self,
+        r,
+        func_path,
+        param,
+        unix_time_ms,
+        timeout_ms,
+        keep_results_for_ms,
+        async_fn,
+        trigger,
+    ):
+        task_id = uuid.uuid4().bytes
+        delay_ms = max(0, unix_time_ms - time.time() * 1000)
+        scheduler.call_later(
+            delay_ms, self.run_task, task_id, func_path, param, async_fn, keep_results_for_ms
+        )
+        respond(r, self.latency_ms, task_id)
+
+    def run_task(self, task_id, func_path, param, async_fn, keep_results_for_ms):
+        def store_result(val, e):
+            self.store_result(task_id, None if e is not None else val, keep_results_for_ms)
+
+        try:
+            func = puff.import_string(func_path)
+            if async_fn:
+                loop = rust_objects.asyncio_loop
+                if loop is None:
+                    raise RuntimeError("AsyncIO not configured in Puff RuntimeConfig")
+                future = asyncio.run_coroutine_threadsafe(func(param), loop)
+                future.add_done_callback(
+                    lambda f: store_result(
+                        None if f.exception() else f.result(), f.exception()
+                    )
+                )
+            else:
+                puff.get_blocking_pool().submit(func, (param,), {}, store_result)
+        except Exception as e:
+            store_result(None, e)
+
+    def store_result(self, task_id, result, keep_results_for_ms):
+        with self.lock:
+            self.results[task_id] = result
+            waiters = self.waiters.pop(task_id, ())
+        for rr, timer in waiters:
+            scheduler.cancel(timer)
+            respond(rr, self.latency_ms, result)
+        scheduler.call_later(keep_results_for_ms, self.results.pop, task_id, None)
+
+    def task_result(self, r, task_id):
+        respond(r, self.latency_ms, self.results.get(task_id))
+
+    def wait_for_task_result(self, r, task_id, poll_interval_ms, timeout_ms):
+        with self.lock:
+            if task_id in self.results:
+                result = self.results[task_id]
+            else:
+                waiter = [r, None]
+                waiter[1] = scheduler.call_later(
+                    timeout_ms, self.wait_timeout, task_id, waiter
+                )
+                self.waiters.setdefault(task_id, []).append(waiter)
+                return
+        respond(r, self.latency_ms, result)
+
+    def wait_timeout(self, task_id, waiter):
+        with self.lock:
+            waiters = self.waiters.get(task_id, [])
+            if waiter not in waiters:
+                return
+            waiters.remove(waiter)
+        waiter[0](None, None)
+
+
+class LocalHttpResponse:
+    def __init__(self, status, headers, body, latency_ms=0):
+        self._status = status
+        self._headers = headers
+        self._body = body
+        self.latency_ms = latency_ms
+
+    def status(self) -> int:
+        return self._status
+
+    def headers(self):
+        return dict(self._headers)
+
+    def header(self, header_name):
+        header_name = header_name.lower()
+        for name, value in self._headers:
+            if name.lower() == header_name:
+                return value
+        return None
+
+    def cookies(self):
+        cookie = SimpleCookie()
+        for name, value in self._headers:
+            if name.lower() == "set-cookie":
+                cookie.load(value.decode("latin1"))
+        return {k: v.value for k, v in cookie.items()}
+
+    def json(self, r):
+        reply(r, self.latency_ms, json.loads, self._body)
+
+    def body(self, r):
+        respond(r, self.latency_ms, self._body)
+
+    def body_text(self, r):
+        reply(r, self.latency_ms, self._body.decode, "utf8")
+
+
+class LocalHttpClient:
+    """
+    An HTTP client that sends requests to an in-process WSGI app when one is set (loopback), and over the
+    network from the blocking pool otherwise.
+    """
+
+    def __init__(self, app=None, latency_ms=0):
+        self.app = app
+        self.latency_ms = latency_ms
+
+    def request(self, r, method, url, headers, body, data, files, timeout_ms):
+        if files:
+            respond(r, 0, None, NotImplementedError("Local HTTP client can't upload files"))
+            return
+        headers = dict(headers or {})
+        if data is not None:
+            body = urlencode(data).encode("utf8")
+            headers.setdefault("Content-Type", "application/x-www-form-urlencoded")
+        self.send(r, method, url, headers, body, timeout_ms)
+
+    def request_json(self, r, method, url, headers, json_body, timeout_ms):
+        headers = dict(headers or {})
+        headers.setdefault("Content-Type", "application/json")
+        self.send(r, method, url, headers, json.dumps(json_body).encode("utf8"), timeout_ms)
+
+    def send(self, r, method, url, headers, body, timeout_ms):
+        if self.app is not None:
+            reply(r, self.latency_ms, self.call_app, method, url, headers, body)
+        else:
+            puff.get_blocking_pool().submit(
+                self.call_network, (method, url, headers, body, timeout_ms), {}, r
+            )
+
+    def call_app(self, method, url, headers, body):
+        parts = urlsplit(url)
+        body = to_bytes(body or b"")
+        environ = {
+            "REQUEST_METHOD": method.upper(),
+            "SCRIPT_NAME": "",
+            "PATH_INFO": parts.path or "/",
+            "QUERY_STRING": parts.query,
+            "SERVER_NAME": parts.hostname or "localhost",
+            "SERVER_PORT": str(parts.port or (443 if parts.scheme == "https" else 80)),
+            "SERVER_PROTOCOL": "HTTP/1.1",
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": parts.scheme or "http",
+            "wsgi.input": BytesIO(body),
+            "wsgi.errors": BytesIO(),
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for name, value in headers.items():
+            key = name.upper().replace("-", "_")
+            if key not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+                key = "HTTP_" + key
+            environ[key] = value.decode("latin1") if isinstance(value, bytes) else value
+        started = []
+
+        def start_response(status, response_headers, exc_info=None):
+            started[:] = [status, response_headers]
+
+        chunks = self.app(environ, start_response)
+        try:
+            response_body = b"".join(chunks)
+        finally:
+            if hasattr(chunks, "close"):
+                chunks.close()
+        status, response_headers = started
+        return LocalHttpResponse(
+            int(status.split(" ", 1)[0]),
+            [(k, to_bytes(v)) for k, v in response_headers],
+            response_body,
+            self.latency_ms,
+        )
+
+    def call_network(self, method, url, headers, body, timeout_ms):
+        request = Request(url, data=body, headers=headers, method=method.upper())
+        try:
+            response = urlopen(request, timeout=timeout_ms / 1000)
+        except HTTPError as e:
+            response = e
+        with response:
+            return LocalHttpResponse(
+                response.status,
+                [(k, to_bytes(v)) for k, v in response.headers.items()],
+                response.read(),
+            )
+
+
+class LocalRustObjects(RustObjects):
+    """
+    RustObjects backed by the local, in-process backends.
+    """
+
+    is_puff: bool = True
+
+    def __init__(self, latency_ms=0, database=None, http_app=None):
+        self.latency_ms = latency_ms
+        self.database = database
+        self.redis = {}
+        self.postgres = {}
+        self.pubsub = {}
+        self.task_queues = {}
+        self.http_clients = {}
+        self.http_app = http_app
+        self.greenlet_thread = None
+        self.lock = threading.Lock()
+
+    def named(self, registry, name, factory):
+        backend = registry.get(name)
+        if backend is None:
+            with self.lock:
+                backend = registry.get(name)
+                if backend is None:
+                    backend = registry[name] = factory(name)
+        return backend
+
+    def redis_by_name(self, name) -> LocalRedis:
+        return self.named(self.redis, name, lambda _: LocalRedis(self.latency_ms))
+
+    def postgres_by_name(self, name) -> LocalPostgres:
+        return self.named(
+            self.postgres,
+            name,
+            lambda n: LocalPostgres(n, self.database, latency_ms=self.latency_ms),
+        )
+
+    def pubsub_by_name(self, name) -> LocalPubSub:
+        return self.named(self.pubsub, name, lambda _: LocalPubSub(self.latency_ms))
+
+    def task_queue_by_name(self, name) -> LocalTaskQueue:
+        return self.named(
+            self.task_queues, name, lambda _: LocalTaskQueue(self.latency_ms)
+        )
+
+    def http_client_by_name(self, name) -> LocalHttpClient:
+        return self.named(
+            self.http_clients,
+            name,
+            lambda _: LocalHttpClient(self.http_app, self.latency_ms),
+        )
+
+    def install_getters(self):
+        self.global_redis_getter = Getter(self.redis_by_name)
+        self.global_postgres_getter = Getter(lambda n: self.postgres_by_name(n)())
+        self.global_pubsub_getter = Getter(self.pubsub_by_name)
+        self.global_task_queue_getter = Getter(self.task_queue_by_name)
+        self.global_http_client_getter = Getter(self.http_client_by_name)
+
+    def greenlet_loop(self):
+        with self.lock:
+            if self.greenlet_thread is None:
+                self.greenlet_thread = puff.start_event_loop()
+            return self.greenlet_thread
+
+    def dispatch_greenlet(self, ret, f):
+        self.greenlet_loop().spawn(f, (), {}, ret)
+
+    def dispatch_asyncio(self, ret, f):
+        self.dispatch_asyncio_coro(ret, f())
+
+    def dispatch_asyncio_coro(self, ret, f):
+        loop = rust_objects.asyncio_loop
+        if loop is None:
+            raise RuntimeError("AsyncIO not configured in Puff RuntimeConfig")
+        future = asyncio.run_coroutine_threadsafe(f, loop)
+        future.add_done_callback(
+            lambda fut: ret(None, fut.exception())
+            if fut.exception()
+            else ret(fut.result(), None)
+        )
+
+    def read_file_bytes(self, rr, fn):
+        def do_read():
+            with open(fn, "rb") as f:
+                return f.read()
+
+        reply(rr, self.latency_ms, do_read)
+
+    def sleep_ms(self, rr, time_to_sleep_ms):
+        respond(rr, time_to_sleep_ms, None)
+
+
+def install(latency_ms=0, database=None, http_app=None) -> LocalRustObjects:
+    """
+    Point `puff.rust_objects` and the module level clients at a new set of local backends.
+
+    `database` is a SQLite database (path or URI) used for every Postgres pool, the default is a shared in-memory
+    database per pool. `http_app` is a WSGI app that receives every request made with `puff.http`.
+    """
+    from puff import redis, pubsub, task_queue, http
+
+    local_objects = LocalRustObjects(
+        latency_ms=latency_ms, database=database, http_app=http_app
+    )
+    local_objects.install_getters()
+    for attr in (
+        "is_puff",
+        "global_redis_getter",
+        "global_postgres_getter",
+        "global_pubsub_getter",
+        "global_task_queue_getter",
+        "global_http_client_getter",
+        "dispatch_greenlet",
+        "dispatch_asyncio",
+        "dispatch_asyncio_coro",
+        "read_file_bytes",
+        "sleep_ms",
+    ):
+        setattr(rust_objects, attr, getattr(local_objects, attr))
+
+    redis.global_redis.redis = None
+    redis.global_redis.client_fn = rust_objects.global_redis_getter
+    pubsub.global_pubsub.conn = None
+    pubsub.global_pubsub.client_fn = rust_objects.global_pubsub_getter
+    task_queue.global_task_queue.tq = None
+    task_queue.global_task_queue.client_fn = rust_objects.global_task_queue_getter
+    http.global_http_client.rust_http = None
+    http.global_http_client.client_fn = rust_objects.global_http_client_getter
+    return local_objects
+
+
+def run(f, *args, **kwargs):
+    """
+    Run `f(*args, **kwargs)` on a new greenlet event loop, wait for it and return its result.
+    """
+    done = queue.Queue()
+    thread = puff.start_event_loop()
+    thread.spawn(f, args, kwargs, lambda val, e: done.put((val, e)))
+    try:
+        result, exception = done.get()
+    finally:
+        thread.start_shutdown()
+    if exception is not None:
+        raise exception
+    return result
+
+
+def run_async(f, *args, **kwargs):
+    """
+    Run the coroutine function `f(*args, **kwargs)` on a new asyncio loop thread, wait for it and return its result.
+    """
+    from puff import asyncio_support
+
+    thread = asyncio_support.start_event_loop()
+    while thread.loop is None or not thread.loop.is_running():
+        time.sleep(0.001)
+    loop = thread.loop
+    try:
+        return asyncio.run_coroutine_threadsafe(f(*args, **kwargs), loop).result()
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        rust_objects.asyncio_loop = None
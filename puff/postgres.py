@@ -1,11 +1,25 @@
+import array
+import asyncio
+import codecs
 import contextvars
+import dataclasses
 import datetime
 import functools
+import io
+import logging
+import os
+import random
+import re
+import threading
 import time
 import sys
+import weakref
+from bisect import bisect_left
+from collections import OrderedDict, deque, namedtuple
+from itertools import chain, islice
+from typing import Any, Dict, List, Optional
 
-from puff import wrap_async, rust_objects
-
+from puff import wrap_async, wrap_async_asyncio, rust_objects, is_greenlet
 
 threadsafety = 3
 apilevel = "2.0"
@@ -20,6 +34,49 @@ ISOLATION_LEVEL_SERIALIZABLE = 3
 ISOLATION_LEVEL_DEFAULT = None
 
 
+"""DB-API exceptions."""
+
+
+class Warning(Exception):
+    pass
+
+
+class Error(Exception):
+    pass
+
+
+class InterfaceError(Error):
+    pass
+
+
+class DatabaseError(Error):
+    pass
+
+
+class DataError(DatabaseError):
+    pass
+
+
+class OperationalError(DatabaseError):
+    pass
+
+
+class IntegrityError(DatabaseError):
+    pass
+
+
+class InternalError(DatabaseError):
+    pass
+
+
+class ProgrammingError(DatabaseError):
+    pass
+
+
+class NotSupportedError(DatabaseError):
+    pass
+
+
 @functools.total_ordering
 class TypeObject(object):
     def __init__(self, *value_names):
@@ -79,12 +136,310 @@ def TimeFromTicks(ticks):
     return time.gmtime(round(ticks))
 
 
+PLACEHOLDER_CACHE_SIZE = 1024
+
+# Quoted strings and identifiers are matched whole to skip placeholders inside them.
+PLACEHOLDER_RE = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|%%|%s")
+
+
+@functools.lru_cache(maxsize=PLACEHOLDER_CACHE_SIZE)
+def convert_placeholders(q: str) -> str:
+    """
+    Rewrite psycopg2 style `%s` placeholders to Postgres `$1, $2, ...` in one pass.
+    """
+    ix = 0
+
+    def replace(match):
+        nonlocal ix
+        token = match.group()
+        if token == "%s":
+            ix += 1
+            return f"${ix}"
+        if token == "%%":
+            return "%"
+        return token.replace("%%", "%")
+
+    return PLACEHOLDER_RE.sub(replace, q)
+
+
+STATEMENT_CACHE_SIZE = 256
+
+# How many bytes COPY sends to the server per round trip.
+COPY_BUFFER_SIZE = 64 * 1024
+COPY_DIRECTION_RE = re.compile(r"\b(FROM)\s+STDIN\b|\bTO\s+STDOUT\b", re.I)
+
+
+def is_preparable(q: str, params) -> bool:
+    """
+    True if the query has parameters and is a single statement.
+    """
+    return params is not None and ";" not in q.strip().rstrip(";")
+
+
+def is_stale_statement_error(e) -> bool:
+    """
+    True if the error means a cached prepared statement can no longer be used.
+    """
+    message = str(e)
+    return "cached plan must not change result type" in message or (
+        "prepared statement" in message and "does not exist" in message
+    )
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class StatementCacheStats:
+    size: int
+    max_size: int
+    hits: int
+    misses: int
+    evictions: int
+    invalidations: int
+
+
+class StatementCache:
+    """
+    An LRU cache of server side prepared statements for one connection, keyed by SQL.
+    """
+
+    def __init__(self, max_size=STATEMENT_CACHE_SIZE):
+        self.max_size = max_size
+        self.statements = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, q):
+        statement = self.statements.get(q)
+        if statement is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.statements.move_to_end(q)
+        return statement
+
+    def put(self, q, statement):
+        self.statements[q] = statement
+        if len(self.statements) > self.max_size:
+            self.statements.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self):
+        self.statements.clear()
+        self.invalidations += 1
+
+    def stats(self) -> StatementCacheStats:
+        return StatementCacheStats(
+            size=len(self.statements),
+            max_size=self.max_size,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            invalidations=self.invalidations,
+        )
+
+
+# Literals, placeholders and numbers become `?` so queries differing in values match.
+NORMALIZE_RE = re.compile(
+    r"'(?:[^']|'')*'|(\"(?:[^\"]|\"\")*\")|%s|\$\d+|\b\d+(?:\.\d+)?\b|\s+"
+)
+NORMALIZE_LIST_RE = re.compile(r"\(\?(?:, \?)+\)")
+RETURNING_RE = re.compile(r"\bRETURNING\b", re.I)
+
+
+@functools.lru_cache(maxsize=PLACEHOLDER_CACHE_SIZE)
+def normalize_query(q: str) -> str:
+    """
+    Replace literals, numbers and placeholders with `?` and collapse whitespace.
+    """
+
+    def replace(match):
+        token = match.group()
+        if match.group(1) is not None:
+            return token
+        if token.isspace():
+            return " "
+        return "?"
+
+    return NORMALIZE_LIST_RE.sub("(?)", NORMALIZE_RE.sub(replace, q).strip())
+
+
+@dataclasses.dataclass(slots=True)
+class QueryEvent:
+    """
+    One query, passed to `QueryHook`s. Times are in milliseconds.
+    """
+
+    sql: str
+    param_count: int
+    dbname: Optional[str] = None
+    replica: Optional[str] = None
+    wait_ms: float = 0.0
+    execute_ms: float = 0.0
+    fetch_ms: float = 0.0
+    rows: Optional[int] = None
+    error: Optional[BaseException] = None
+
+    @property
+    def duration_ms(self) -> float:
+        return self.wait_ms + self.execute_ms + self.fetch_ms
+
+
+class QueryHook:
+    """
+    Base class for query hooks, see `add_query_hook`. Only greenlet queries are seen.
+    """
+
+    def on_query_start(self, event: QueryEvent):
+        pass
+
+    def on_query_end(self, event: QueryEvent):
+        pass
+
+
+query_hooks: List[QueryHook] = []
+
+
+def add_query_hook(hook: QueryHook) -> QueryHook:
+    query_hooks.append(hook)
+    return hook
+
+
+def remove_query_hook(hook: QueryHook):
+    query_hooks.remove(hook)
+
+
+SLOW_QUERY_MS = 500
+
+
+class SlowQueryLog(QueryHook):
+    """
+    Logs queries slower than `threshold_ms` to the `puff.postgres` logger as warnings.
+    """
+
+    def __init__(self, threshold_ms: float = SLOW_QUERY_MS, logger=None):
+        self.threshold_ms = threshold_ms
+        self.logger = logger or logging.getLogger(__name__)
+
+    def on_query_end(self, event: QueryEvent):
+        if event.duration_ms < self.threshold_ms:
+            return
+        self.logger.warning(
+            "Slow query (%.1fms: wait %.1fms, execute %.1fms, fetch %.1fms, "
+            "%s rows, %s params%s): %s",
+            event.duration_ms,
+            event.wait_ms,
+            event.execute_ms,
+            event.fetch_ms,
+            event.rows,
+            event.param_count,
+            f", replica {event.replica}" if event.replica else "",
+            event.sql,
+        )
+
+
+QUERY_HISTOGRAM_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+QUERY_PHASES = ("wait", "execute", "fetch", "total")
+
+
+class QueryHistogram(QueryHook):
+    """
+    Aggregates sampled query times per phase into a histogram for `prometheus_text`.
+    """
+
+    def __init__(
+        self,
+        buckets=QUERY_HISTOGRAM_BUCKETS,
+        sample_rate: float = 1.0,
+        name: str = "puff_postgres_query",
+    ):
+        self.buckets = tuple(buckets)
+        self.sample_rate = sample_rate
+        self.name = name
+        self.lock = threading.Lock()
+        self.counts = {phase: [0] * (len(self.buckets) + 1) for phase in QUERY_PHASES}
+        self.sums = dict.fromkeys(QUERY_PHASES, 0.0)
+        self.rows = 0
+        self.errors = 0
+
+    def on_query_end(self, event: QueryEvent):
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        durations = (event.wait_ms, event.execute_ms, event.fetch_ms, event.duration_ms)
+        with self.lock:
+            for phase, ms in zip(QUERY_PHASES, durations):
+                seconds = ms / 1000
+                self.counts[phase][bisect_left(self.buckets, seconds)] += 1
+                self.sums[phase] += seconds
+            self.rows += event.rows or 0
+            self.errors += event.error is not None
+
+    def prometheus_text(self) -> str:
+        name = self.name
+        lines = [
+            f"# HELP {name}_duration_seconds Sampled Postgres query time by phase.",
+            f"# TYPE {name}_duration_seconds histogram",
+        ]
+        with self.lock:
+            for phase in QUERY_PHASES:
+                total = 0
+                counts = self.counts[phase]
+                bucket = f'{name}_duration_seconds_bucket{{phase="{phase}"'
+                for bound, count in zip(self.buckets, counts):
+                    total += count
+                    lines.append(f'{bucket},le="{bound}"}} {total}')
+                total += counts[-1]
+                lines.append(f'{bucket},le="+Inf"}} {total}')
+                lines.append(
+                    f'{name}_duration_seconds_sum{{phase="{phase}"}} {self.sums[phase]}'
+                )
+                lines.append(
+                    f'{name}_duration_seconds_count{{phase="{phase}"}} {total}'
+                )
+            lines += [
+                f"# HELP {name}_rows_total Rows returned by sampled Postgres queries.",
+                f"# TYPE {name}_rows_total counter",
+                f"{name}_rows_total {self.rows}",
+                f"# HELP {name}_errors_total Sampled Postgres queries that failed.",
+                f"# TYPE {name}_errors_total counter",
+                f"{name}_errors_total {self.errors}",
+            ]
+        return "\n".join(lines) + "\n"
+
+
+def elapsed_ms(start: float) -> float:
+    return (time.perf_counter() - start) * 1000
+
+
 class PostgresCursor:
+    # How many rows iterating over the cursor fetches per round trip.
+    itersize = 2000
+    # Builds rows from tuples, see `dict_row`. None returns the tuples as they are.
+    row_factory = None
+
     def __init__(self, cursor, connection):
         self.cursor = cursor
         self.last_query = None
         self.connection = connection
         self._description = None
+        self._rows = None
+        # The query whose rows are still being fetched, while query hooks are installed.
+        self._event = None
+        self._row_maker = None
 
     @property
     def rowcount(self):
@@ -112,35 +467,318 @@ class PostgresCursor:
         pass
 
     def execute(self, q, params=None):
+        self._row_maker = None
+        if params is not None:
+            params = list(params)
+        if not query_hooks and self._event is None:
+            return self._execute(q, params)
+        has_rows = is_read_query(q) or RETURNING_RE.search(q) is not None
+        return self.observe(q, params, has_rows, self._execute, q, params)
+
+    def observe(self, q, params, has_rows, run, *args):
+        """
+        Run `run(*args)` and report it to the query hooks as `q`.
+        """
+        self.finish_query()
+        if not query_hooks or not is_greenlet():
+            return run(*args)
+        connection = self.connection
+        event = QueryEvent(
+            normalize_query(q),
+            0 if params is None else len(params),
+            dbname=connection.dbname,
+            wait_ms=connection.take_wait_ms(),
+        )
+        for hook in query_hooks:
+            hook.on_query_start(event)
+        self._event = event
+        wait_ms = event.wait_ms
+        start = time.perf_counter()
+        try:
+            ret = run(*args)
+        except Exception as e:
+            event.error = e
+            raise
+        finally:
+            # Connections opened while running, like replicas, count as waiting.
+            event.execute_ms = elapsed_ms(start) - (event.wait_ms - wait_ms)
+            if has_rows and event.error is None:
+                event.rows = 0
+            else:
+                self.finish_query()
+        return ret
+
+    def observe_fetch(self, fetch, *args):
+        event = self._event
+        start = time.perf_counter()
+        try:
+            result = fetch(*args)
+        except Exception as e:
+            event.error = e
+            self.finish_query()
+            raise
+        event.fetch_ms += elapsed_ms(start)
+        if isinstance(result, list):
+            event.rows += len(result)
+        elif result is not None:
+            event.rows += 1
+        return result
+
+    def end_query(self, event):
+        for hook in query_hooks:
+            hook.on_query_end(event)
+
+    def finish_query(self):
+        event = self._event
+        if event is not None:
+            self._event = None
+            self.end_query(event)
+
+    def _execute(self, q, params):
         self.last_query = q.encode("utf8")
         self._description = None
-        ix = 1
-        params = list(params) if params is not None else None
-        while "%s" in q:
-            q = q.replace("%s", f"${ix}", 1)
-            ix += 1
+        self._rows = None
+        if params is not None:
+            q = convert_placeholders(q)
+        statement_cache = getattr(self.connection, "statement_cache", None)
+        # Only greenlets cache statements, under asyncio `wrap_async` returns a future.
+        if statement_cache is not None and is_greenlet() and is_preparable(q, params):
+            return self.execute_prepared(statement_cache, q, params)
         ret = wrap_async(lambda r: self.cursor.execute(r, q, params))
         return ret
 
+    def execute_prepared(self, statement_cache, q, params):
+        statement = statement_cache.get(q)
+        if statement is None:
+            client = self.connection.postgres_client
+            statement = wrap_async(lambda r: client.prepare(r, q))
+            statement_cache.put(q, statement)
+        try:
+            return wrap_async(
+                lambda r: self.cursor.execute_prepared(r, statement, params)
+            )
+        except Exception as e:
+            if not is_stale_statement_error(e):
+                raise
+            statement_cache.invalidate()
+            # A failed statement aborts the open transaction, only retry in autocommit.
+            if not self.connection.autocommit:
+                raise
+            return wrap_async(lambda r: self.cursor.execute(r, q, params))
+
     def executemany(self, q, seq_of_params=None):
+        if not query_hooks and self._event is None:
+            return self._executemany(q, seq_of_params)
+        # Peek at the first parameter set without consuming a lazy `seq_of_params`.
+        params = None
+        if seq_of_params is not None:
+            seq_of_params = iter(seq_of_params)
+            params = next(seq_of_params, None)
+            if params is not None:
+                seq_of_params = chain([params], seq_of_params)
+        return self.observe(q, params, False, self._executemany, q, seq_of_params)
+
+    def _executemany(self, q, seq_of_params):
         self._description = None
-        ix = 1
-        while "%s" in q:
-            q = q.replace("%s", f"${ix}", 1)
-            ix += 1
+        self._rows = None
+        q = convert_placeholders(q)
         ret = wrap_async(lambda r: self.cursor.executemany(r, q, seq_of_params))
         return ret
 
+    def copy_expert(self, sql, file, size=COPY_BUFFER_SIZE):
+        """
+        Run a `COPY ... FROM STDIN` or `COPY ... TO STDOUT` statement in chunks.
+        """
+        self.last_query = sql.encode("utf8")
+        self._description = None
+        self._rows = None
+        direction = COPY_DIRECTION_RE.search(sql)
+        if direction is None:
+            raise ProgrammingError(
+                "copy_expert needs COPY ... FROM STDIN or COPY ... TO STDOUT"
+            )
+        if direction.group(1) is not None:
+            return self.copy_in(sql, file, size)
+        return self.copy_out(sql, file)
+
+    def copy_from(
+        self, file, table, sep="\t", null="\\N", size=COPY_BUFFER_SIZE, columns=None
+    ):
+        sql = (
+            f"COPY {table}{copy_columns(columns)} FROM STDIN {copy_options(sep, null)}"
+        )
+        return self.copy_expert(sql, file, size)
+
+    def copy_to(self, file, table, sep="\t", null="\\N", columns=None):
+        sql = f"COPY {table}{copy_columns(columns)} TO STDOUT {copy_options(sep, null)}"
+        return self.copy_expert(sql, file)
+
+    def copy_in(self, sql, file, size):
+        if not hasattr(self.cursor, "copy_in"):
+            raise NotSupportedError("COPY FROM STDIN is not supported by this client")
+        sink = wrap_async(lambda r: self.cursor.copy_in(r, sql))
+        try:
+            for chunk in copy_chunks(file, size):
+                wrap_async(lambda r: sink.write(r, chunk))
+        except BaseException as e:
+            wrap_async(lambda r: sink.abort(r, str(e) or type(e).__name__))
+            raise
+        wrap_async(lambda r: sink.finish(r))
+
+    def copy_out(self, sql, file):
+        if not hasattr(self.cursor, "copy_out"):
+            raise NotSupportedError("COPY TO STDOUT is not supported by this client")
+        source = wrap_async(lambda r: self.cursor.copy_out(r, sql))
+        # Chunks can end in the middle of a multibyte character.
+        decoder = None
+        if isinstance(file, io.TextIOBase):
+            decoder = codecs.getincrementaldecoder("utf8")()
+        while (chunk := wrap_async(lambda r: source.read(r))) is not None:
+            file.write(chunk if decoder is None else decoder.decode(chunk))
+        if decoder is not None:
+            file.write(decoder.decode(b"", final=True))
+
     def fetchone(self):
-        return wrap_async(lambda r: self.cursor.fetchone(r))
+        row = self.fetch_one_row()
+        if row is None or self.row_factory is None:
+            return row
+        return self.row_maker()(row)
 
     def fetchmany(self, rowcount=None):
-        return wrap_async(lambda r: self.cursor.fetchmany(r, rowcount))
+        rows = self.fetch_many_rows(rowcount)
+        if self.row_factory is None:
+            return rows
+        return list(map(self.row_maker(), rows))
 
     def fetchall(self):
+        rows = self.fetch_all_rows()
+        if self.row_factory is None:
+            return rows
+        return list(map(self.row_maker(), rows))
+
+    def row_maker(self):
+        """
+        The function that turns tuples into rows for the current query.
+        """
+        factory = self.row_factory
+        cached = self._row_maker
+        if cached is not None and cached[0] is factory:
+            return cached[1]
+        make_row = factory(self)
+        self._row_maker = (factory, make_row)
+        return make_row
+
+    def fetch_one_row(self):
+        rows = self._rows
+        if rows:
+            return rows.popleft()
+        if self._event is None:
+            return self._fetchone()
+        row = self.observe_fetch(self._fetchone)
+        if row is None:
+            self.finish_query()
+        return row
+
+    def fetch_many_rows(self, rowcount):
+        rows = self._rows
+        if not rows:
+            return self.fetch_rows(rowcount)
+        if rowcount is None:
+            rowcount = self.arraysize
+        result = [rows.popleft() for _ in range(min(rowcount, len(rows)))]
+        if len(result) < rowcount:
+            result.extend(self.fetch_rows(rowcount - len(result)))
+        return result
+
+    def fetch_rows(self, rowcount):
+        if self._event is None:
+            return self._fetchmany(rowcount)
+        result = self.observe_fetch(self._fetchmany, rowcount)
+        if len(result) < (self.arraysize if rowcount is None else rowcount):
+            self.finish_query()
+        return result
+
+    def fetch_all_rows(self):
+        rows = self._rows
+        self._rows = None
+        if self._event is None:
+            result = self._fetchall()
+        else:
+            result = self.observe_fetch(self._fetchall)
+            self.finish_query()
+        if not rows:
+            return result
+        return list(rows) + result
+
+    def fetch_columns(self, numpy=False) -> Dict[str, Any]:
+        """
+        Fetch the remaining rows as columns, keyed by column name.
+        """
+        names = [column[0] for column in self.description]
+        columns = None
+        if not self._rows and self._event is None:
+            columns = self._fetch_columns()
+        if columns is None:
+            buffers = [ColumnBuffer(column[1]) for column in self.description]
+
+            def add(batch):
+                for buffer, values in zip(buffers, zip(*batch)):
+                    buffer.extend(values)
+
+            if self._rows:
+                add(self._rows)
+                self._rows = None
+            while len(batch := self.fetch_rows(self.itersize)) == self.itersize:
+                add(batch)
+            add(batch)
+            columns = [buffer.values() for buffer in buffers]
+        if numpy:
+            columns = [to_numpy(column) for column in columns]
+        return dict(zip(names, columns))
+
+    def _fetch_columns(self):
+        if not hasattr(self.cursor, "fetch_columns"):
+            return None
+        return wrap_async(lambda r: self.cursor.fetch_columns(r))
+
+    def fetch_arrow(self):
+        """
+        Fetch the remaining rows as a `pyarrow.RecordBatch`.
+        """
+        import pyarrow
+
+        columns = self.fetch_columns()
+        arrays = []
+        for column in columns.values():
+            if isinstance(column, array.array):
+                arrow_type = getattr(pyarrow, ARROW_TYPES[column.typecode])()
+                buffer = pyarrow.py_buffer(column)
+                column = pyarrow.Array.from_buffers(
+                    arrow_type, len(column), [None, buffer]
+                )
+            else:
+                column = pyarrow.array(column)
+            arrays.append(column)
+        return pyarrow.RecordBatch.from_arrays(arrays, names=list(columns))
+
+    def _fetchone(self):
+        return wrap_async(lambda r: self.cursor.fetchone(r))
+
+    def _fetchmany(self, rowcount):
+        return wrap_async(lambda r: self.cursor.fetchmany(r, rowcount))
+
+    def _fetchall(self):
         return wrap_async(lambda r: self.cursor.fetchall(r))
 
+    def detach(self):
+        # The connection gave its client back, the next use takes a new one.
+        self.cursor = DetachedCursor(self)
+
+    def attach(self, cursor):
+        self.cursor = cursor
+
     def close(self):
+        self.finish_query()
         return self.cursor.close()
 
     def __del__(self):
@@ -150,7 +788,15 @@ class PostgresCursor:
         return self
 
     def __next__(self):
-        return self.fetchone()
+        rows = self._rows
+        if not rows:
+            batch = self.fetch_rows(self.itersize)
+            if not batch:
+                raise StopIteration
+            self._rows = rows = deque(batch)
+        if self.row_factory is None:
+            return rows.popleft()
+        return self.row_maker()(rows.popleft())
 
     def __enter__(self):
         return self
@@ -163,26 +809,737 @@ class PostgresCursor:
         return self.last_query
 
 
+def column_names(cursor) -> List[str]:
+    return [column[0] for column in cursor.description]
+
+
+def dict_row(cursor):
+    """
+    A row factory building dicts keyed by column name.
+    """
+    names = column_names(cursor)
+    return lambda row: dict(zip(names, row))
+
+
+@functools.lru_cache(maxsize=PLACEHOLDER_CACHE_SIZE)
+def row_namedtuple(names):
+    return namedtuple("Row", names, rename=True)
+
+
+def namedtuple_row(cursor):
+    """
+    A row factory building namedtuples.
+    """
+    return row_namedtuple(tuple(column_names(cursor)))._make
+
+
+def class_row(cls):
+    """
+    A row factory building `cls(**columns)`.
+    """
+
+    def factory(cursor):
+        names = column_names(cursor)
+        if dataclasses.is_dataclass(cls):
+            fields = [field.name for field in dataclasses.fields(cls) if field.init]
+            if fields == names:
+                return lambda row: cls(*row)
+        return lambda row: cls(**dict(zip(names, row)))
+
+    return factory
+
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def quote_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def copy_columns(columns) -> str:
+    if not columns:
+        return ""
+    return "(" + ",".join(columns) + ")"
+
+
+def copy_options(sep, null) -> str:
+    sep, null = quote_literal(sep), quote_literal(null)
+    return f"WITH (FORMAT text, DELIMITER {sep}, NULL {null})"
+
+
+# array.array type codes for Postgres types whose values fit in a fixed size buffer.
+COLUMN_TYPECODES = {
+    "INT2": "h",
+    "INT4": "i",
+    "INT8": "q",
+    "FLOAT4": "f",
+    "FLOAT8": "d",
+}
+ARROW_TYPES = {
+    "h": "int16",
+    "i": "int32",
+    "q": "int64",
+    "f": "float32",
+    "d": "float64",
+}
+
+
+class ColumnBuffer:
+    """
+    Collects one result column, in an `array.array` while the values fit.
+    """
+
+    def __init__(self, type_code=None):
+        typecode = COLUMN_TYPECODES.get(type_code)
+        self.array = None if typecode is None else array.array(typecode)
+        self.list = []
+        # Without a type code, guess the type from the first value that isn't NULL.
+        self.guess = type_code is None
+
+    def extend(self, values):
+        if self.guess:
+            first = next((value for value in values if value is not None), None)
+            if first is None:
+                self.list.extend(values)
+                return
+            self.guess = False
+            if not self.list and type(first) in (int, float):
+                self.array = array.array("q" if type(first) is int else "d")
+        if self.array is not None:
+            size = len(self.array)
+            try:
+                self.array.extend(values)
+                return
+            except (TypeError, OverflowError):
+                del self.array[size:]
+                self.list = self.array.tolist()
+                self.array = None
+        self.list.extend(values)
+
+    def values(self):
+        return self.list if self.array is None else self.array
+
+
+def to_numpy(column):
+    import numpy
+
+    if isinstance(column, array.array):
+        return numpy.frombuffer(column, dtype=column.typecode)
+    return numpy.array(column)
+
+
+def copy_chunks(file, size):
+    """
+    Yields `bytes` chunks of about `size` from a file-like object or an iterable.
+    """
+    if hasattr(file, "read"):
+        while chunk := file.read(size):
+            yield _binary(chunk)
+        return
+    buffer = []
+    buffered = 0
+    for chunk in file:
+        chunk = _binary(chunk)
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= size:
+            yield b"".join(buffer)
+            buffer.clear()
+            buffered = 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+class NamedPostgresCursor(PostgresCursor):
+    """
+    A server side cursor, declared with `DECLARE name CURSOR FOR query`.
+    """
+
+    def __init__(self, cursor, connection, name, scrollable=None, withhold=False):
+        super().__init__(cursor, connection)
+        self.name = name
+        self.scrollable = scrollable
+        self.withhold = withhold
+        self.declared = False
+
+    def _execute(self, q, params):
+        if self.declared:
+            raise Exception("can't call .execute() on named cursors more than once")
+        scroll = ""
+        if self.scrollable is not None:
+            scroll = "SCROLL " if self.scrollable else "NO SCROLL "
+        hold = "WITH HOLD" if self.withhold else "WITHOUT HOLD"
+        self.last_query = q.encode("utf8")
+        if params is not None:
+            params = list(params)
+            q = convert_placeholders(q)
+        declare = f"DECLARE {quote_identifier(self.name)} {scroll}CURSOR {hold} FOR {q}"
+        wrap_async(lambda r: self.cursor.execute(r, declare, params))
+        self.declared = True
+
+    def executemany(self, q, seq_of_params=None):
+        raise Exception("can't call .executemany() on named cursors")
+
+    def fetch_forward(self, count):
+        fetch = f"FETCH FORWARD {count} FROM {quote_identifier(self.name)}"
+        wrap_async(lambda r: self.cursor.execute(r, fetch, None))
+        self._description = None
+        return wrap_async(lambda r: self.cursor.fetchall(r))
+
+    def _fetchone(self):
+        rows = self.fetch_forward(1)
+        return rows[0] if rows else None
+
+    def _fetchmany(self, rowcount):
+        return self.fetch_forward(self.arraysize if rowcount is None else rowcount)
+
+    def _fetchall(self):
+        return self.fetch_forward("ALL")
+
+    def _fetch_columns(self):
+        # The rows live in the portal, so they have to come through FETCH.
+        return None
+
+    def close(self):
+        self.finish_query()
+        if self.declared:
+            self.declared = False
+            close = f"CLOSE {quote_identifier(self.name)}"
+            try:
+                wrap_async(lambda r: self.cursor.execute(r, close, None))
+            except Exception:
+                # The cursor is already gone if its transaction ended.
+                pass
+        return self.cursor.close()
+
+    def __del__(self):
+        return self.cursor.close()
+
+
+# Upper bounds, in milliseconds, of the buckets of the pool acquire time histogram.
+POOL_ACQUIRE_BUCKETS_MS = (0.1, 0.5, 1.0, 5.0, 10.0, 50.0, 100.0, 500.0, 1000.0, 5000.0)
+POOL_SAMPLE_INTERVAL_MS = 10 * 1000
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class PoolStats:
+    """
+    A snapshot of one named pool.
+    """
+
+    name: str
+    size: Optional[int]
+    idle: Optional[int]
+    in_use: int
+    waiters: int
+    acquired: int
+    released: int
+    acquire_errors: int
+    total_acquire_ms: float
+    max_acquire_ms: float
+    acquire_buckets_ms: tuple
+    acquire_counts: tuple
+
+    @property
+    def average_acquire_ms(self) -> float:
+        return self.total_acquire_ms / self.acquired if self.acquired else 0.0
+
+
+class PoolMetrics:
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.in_use = 0
+        self.waiters = 0
+        self.acquired = 0
+        self.released = 0
+        self.acquire_errors = 0
+        self.total_acquire_ms = 0.0
+        self.max_acquire_ms = 0.0
+        self.acquire_counts = [0] * (len(POOL_ACQUIRE_BUCKETS_MS) + 1)
+
+    def acquire(self, getter):
+        with self.lock:
+            self.waiters += 1
+        start = time.perf_counter()
+        try:
+            client = getter()
+        except Exception:
+            with self.lock:
+                self.waiters -= 1
+                self.acquire_errors += 1
+            raise
+        wait_ms = elapsed_ms(start)
+        with self.lock:
+            self.waiters -= 1
+            self.in_use += 1
+            self.acquired += 1
+            self.total_acquire_ms += wait_ms
+            self.max_acquire_ms = max(self.max_acquire_ms, wait_ms)
+            self.acquire_counts[bisect_left(POOL_ACQUIRE_BUCKETS_MS, wait_ms)] += 1
+        return client
+
+    def release(self):
+        with self.lock:
+            self.in_use -= 1
+            self.released += 1
+
+    def stats(self) -> PoolStats:
+        size = idle = None
+        status = getattr(rust_objects.global_postgres_getter, "pool_status", None)
+        if status is not None:
+            status = status(self.name)
+            size, idle = status.get("size"), status.get("idle")
+        with self.lock:
+            return PoolStats(
+                name=self.name,
+                size=size,
+                idle=idle,
+                in_use=self.in_use,
+                waiters=self.waiters,
+                acquired=self.acquired,
+                released=self.released,
+                acquire_errors=self.acquire_errors,
+                total_acquire_ms=self.total_acquire_ms,
+                max_acquire_ms=self.max_acquire_ms,
+                acquire_buckets_ms=POOL_ACQUIRE_BUCKETS_MS,
+                acquire_counts=tuple(self.acquire_counts),
+            )
+
+
+pool_metrics = {}
+
+
+def metrics_for(dbname) -> PoolMetrics:
+    name = dbname or "default"
+    metrics = pool_metrics.get(name)
+    if metrics is None:
+        metrics = pool_metrics.setdefault(name, PoolMetrics(name))
+    return metrics
+
+
 def get_client(dbname):
+    getter = rust_objects.global_postgres_getter
     if dbname is None:
-        return rust_objects.global_postgres_getter()
-    return rust_objects.global_postgres_getter.by_name(dbname)
+        return metrics_for(dbname).acquire(getter)
+    return metrics_for(dbname).acquire(lambda: getter.by_name(dbname))
+
+
+def release_client(dbname, client):
+    """
+    Give a client from `get_client` back to its pool.
+    """
+    client.close()
+    metrics_for(dbname).release()
+
+
+def pool_stats(dbname=None) -> PoolStats:
+    return metrics_for(dbname).stats()
+
+
+def all_pool_stats() -> List[PoolStats]:
+    return [metrics.stats() for metrics in list(pool_metrics.values())]
+
+
+def pool_prometheus_text(stats: List[PoolStats], prefix="puff_postgres_pool") -> str:
+    """
+    Format pool snapshots in the Prometheus text format.
+    """
+    lines = []
+    gauges = [
+        ("size", "Connections open in the pool."),
+        ("idle", "Idle connections in the pool."),
+        ("in_use", "Connections taken from the pool and not given back."),
+        ("waiters", "Callers waiting for a connection."),
+    ]
+    for field, help_text in gauges:
+        lines += [
+            f"# HELP {prefix}_{field} {help_text}",
+            f"# TYPE {prefix}_{field} gauge",
+        ]
+        for pool in stats:
+            value = getattr(pool, field)
+            if value is not None:
+                lines.append(f'{prefix}_{field}{{pool="{pool.name}"}} {value}')
+    counters = [
+        ("acquired", "Connections taken from the pool."),
+        ("released", "Connections given back to the pool."),
+        ("acquire_errors", "Failed attempts to take a connection from the pool."),
+    ]
+    for field, help_text in counters:
+        lines += [
+            f"# HELP {prefix}_{field}_total {help_text}",
+            f"# TYPE {prefix}_{field}_total counter",
+        ]
+        for pool in stats:
+            lines.append(
+                f'{prefix}_{field}_total{{pool="{pool.name}"}} {getattr(pool, field)}'
+            )
+    name = f"{prefix}_acquire_seconds"
+    lines += [
+        f"# HELP {name} Time taken to get a connection from the pool.",
+        f"# TYPE {name} histogram",
+    ]
+    for pool in stats:
+        total = 0
+        for bound, count in zip(pool.acquire_buckets_ms, pool.acquire_counts):
+            total += count
+            lines.append(
+                f'{name}_bucket{{pool="{pool.name}",le="{bound / 1000}"}} {total}'
+            )
+        total += pool.acquire_counts[-1]
+        lines.append(f'{name}_bucket{{pool="{pool.name}",le="+Inf"}} {total}')
+        lines.append(f'{name}_sum{{pool="{pool.name}"}} {pool.total_acquire_ms / 1000}')
+        lines.append(f'{name}_count{{pool="{pool.name}"}} {total}')
+    return "\n".join(lines) + "\n"
+
+
+class PoolSampler:
+    """
+    Samples `all_pool_stats` every `interval_ms` on a daemon thread.
+    """
+
+    def __init__(self, interval_ms=POOL_SAMPLE_INTERVAL_MS, callback=None):
+        self.interval_ms = interval_ms
+        self.callback = callback
+        self.latest = []
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self) -> "PoolSampler":
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.sample_forever, daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def sample(self) -> List[PoolStats]:
+        self.latest = stats = all_pool_stats()
+        if self.callback is not None:
+            self.callback(stats)
+        return stats
+
+    def sample_forever(self):
+        while not self.stopped.wait(self.interval_ms / 1000):
+            self.sample()
+
+    def prometheus_text(self) -> str:
+        return pool_prometheus_text(self.latest)
+
+
+ROUND_ROBIN = "round_robin"
+LEAST_LATENCY = "least_latency"
+REPLICA_LAG_CHECK_INTERVAL = 5.0
+# Weight of the newest sample in the moving average of replica latency.
+REPLICA_LATENCY_WEIGHT = 0.2
+REPLICA_LAG_QUERY = (
+    "SELECT CASE WHEN pg_is_in_recovery() THEN "
+    "COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) "
+    "ELSE 0 END"
+)
+READ_QUERY_RE = re.compile(r"\s*(?:SELECT|WITH|VALUES|TABLE|SHOW)\b", re.I)
+# Anything that might write or lock is kept on the primary.
+WRITE_QUERY_RE = re.compile(
+    r"\b(?:INSERT|UPDATE|DELETE|MERGE|INTO|NEXTVAL|SETVAL|PG_ADVISORY_\w*"
+    r"|FOR\s+(?:NO\s+KEY\s+)?(?:UPDATE|SHARE)|FOR\s+KEY\s+SHARE)\b",
+    re.I,
+)
+
+
+@functools.lru_cache(maxsize=PLACEHOLDER_CACHE_SIZE)
+def is_read_query(q: str) -> bool:
+    """
+    True if `q` is a single statement that only reads, so it can run on a replica.
+    """
+    return (
+        READ_QUERY_RE.match(q) is not None
+        and WRITE_QUERY_RE.search(q) is None
+        and ";" not in q.rstrip().rstrip(";")
+    )
+
+
+@dataclasses.dataclass(slots=True)
+class ReplicaState:
+    name: str
+    latency: float = 0.0
+    lag: float = 0.0
+    lag_checked_at: float = None
+    queries: int = 0
+
+
+class ReplicaRouter:
+    """
+    Picks a replica pool, by name, for read only work.
+    """
+
+    def __init__(
+        self,
+        replicas,
+        strategy=ROUND_ROBIN,
+        max_lag_seconds=None,
+        lag_check_interval=REPLICA_LAG_CHECK_INTERVAL,
+    ):
+        if strategy not in (ROUND_ROBIN, LEAST_LATENCY):
+            raise Exception(f"Unknown replica strategy {strategy!r}.")
+        self.replicas = [ReplicaState(name) for name in replicas]
+        self.strategy = strategy
+        self.max_lag_seconds = max_lag_seconds
+        self.lag_check_interval = lag_check_interval
+        self.next_ix = 0
+
+    def usable(self):
+        if self.max_lag_seconds is None:
+            return self.replicas
+        now = time.monotonic()
+        usable = []
+        for replica in self.replicas:
+            checked_at = replica.lag_checked_at
+            if checked_at is None or now - checked_at >= self.lag_check_interval:
+                replica.lag_checked_at = now
+                try:
+                    replica.lag = self.measure_lag(replica.name)
+                except Exception:
+                    replica.lag = float("inf")
+            if replica.lag <= self.max_lag_seconds:
+                usable.append(replica)
+        return usable
+
+    def measure_lag(self, name) -> float:
+        client = get_client(name)
+        try:
+            cursor = client.cursor()
+            wrap_async(lambda r: cursor.execute(r, REPLICA_LAG_QUERY, None))
+            (lag,) = wrap_async(lambda r: cursor.fetchone(r))
+            return float(lag or 0)
+        finally:
+            release_client(name, client)
+
+    def choose(self):
+        replicas = self.usable()
+        if not replicas:
+            return None
+        if self.strategy == LEAST_LATENCY:
+            return min(replicas, key=lambda replica: replica.latency).name
+        self.next_ix += 1
+        return replicas[self.next_ix % len(replicas)].name
+
+    def record(self, name, seconds):
+        for replica in self.replicas:
+            if replica.name == name:
+                replica.queries += 1
+                if replica.queries == 1:
+                    replica.latency = seconds
+                else:
+                    replica.latency += REPLICA_LATENCY_WEIGHT * (
+                        seconds - replica.latency
+                    )
+                return
+
+
+replica_routers = {}
+
+
+def replica_router(
+    dbname=None, replicas=None, strategy=None, max_lag_seconds=None
+) -> "ReplicaRouter":
+    """
+    The shared `ReplicaRouter` for a database, or None without replicas.
+    """
+    if isinstance(replicas, ReplicaRouter):
+        return replicas
+    if replicas is None:
+        prefix = f"PUFF_{(dbname or 'default').upper()}_POSTGRES_REPLICA"
+        replicas = [n for n in os.environ.get(f"{prefix}S", "").split(",") if n]
+        strategy = strategy or os.environ.get(f"{prefix}_STRATEGY")
+        max_lag_ms = os.environ.get(f"{prefix}_MAX_LAG_MS")
+        if max_lag_seconds is None and max_lag_ms:
+            max_lag_seconds = int(max_lag_ms) / 1000
+    if isinstance(replicas, str):
+        replicas = [replicas]
+    if not replicas:
+        return None
+    key = (tuple(replicas), strategy or ROUND_ROBIN, max_lag_seconds)
+    router = replica_routers.get(key)
+    if router is None:
+        router = replica_routers[key] = ReplicaRouter(
+            replicas, strategy or ROUND_ROBIN, max_lag_seconds
+        )
+    return router
+
+
+class ReplicaRoutingCursor(PostgresCursor):
+    """
+    Runs read only autocommit queries on a replica and everything else on the primary.
+    """
+
+    def __init__(self, cursor, connection):
+        super().__init__(cursor, connection)
+        self.primary_cursor = cursor
+        self.replica_cursors = {}
+
+    def _execute(self, q, params):
+        connection = self.connection
+        replica = None
+        # Only greenlets are routed, under asyncio `wrap_async` returns a future.
+        if (
+            is_greenlet()
+            and connection.autocommit
+            and connection.use_replicas
+            and is_read_query(q)
+        ):
+            replica = connection.replicas.choose()
+        if replica is None:
+            self.cursor = self.primary_cursor
+            return super()._execute(q, params)
+        cursor = self.replica_cursors.get(replica)
+        if cursor is None:
+            cursor = connection.replica_client(replica).cursor()
+            self.replica_cursors[replica] = cursor
+        event = self._event
+        if event is not None:
+            event.replica = replica
+            event.wait_ms += connection.take_wait_ms()
+        self.cursor = cursor
+        self.last_query = q.encode("utf8")
+        self._description = None
+        self._rows = None
+        if params is not None:
+            q = convert_placeholders(q)
+        start = time.monotonic()
+        ret = wrap_async(lambda r: cursor.execute(r, q, params))
+        connection.replicas.record(replica, time.monotonic() - start)
+        return ret
+
+    def executemany(self, q, seq_of_params=None):
+        self.cursor = self.primary_cursor
+        return super().executemany(q, seq_of_params)
+
+    def copy_expert(self, sql, file, size=COPY_BUFFER_SIZE):
+        self.cursor = self.primary_cursor
+        return super().copy_expert(sql, file, size)
+
+    def detach(self):
+        # Replica clients stay with the connection until it is closed.
+        detached = DetachedCursor(self)
+        if self.cursor is self.primary_cursor:
+            self.cursor = detached
+        self.primary_cursor = detached
+
+    def attach(self, cursor):
+        if self.cursor is self.primary_cursor:
+            self.cursor = cursor
+        self.primary_cursor = cursor
+
+    def close(self):
+        self.finish_query()
+        for cursor in self.replica_cursors.values():
+            cursor.close()
+        return self.primary_cursor.close()
+
+
+class DetachedCursor:
+    """
+    Stands in for the Rust cursor of a `PostgresCursor` whose connection was released.
+    """
+
+    def __init__(self, owner):
+        self.owner = owner
+
+    def __getattr__(self, name):
+        cursor = self.owner.connection.postgres_client.cursor()
+        self.owner.attach(cursor)
+        return getattr(cursor, name)
+
+    def close(self):
+        pass
 
 
 class PostgresConnection:
     isolation_level = ISOLATION_LEVEL_DEFAULT
     server_version = 140000
-
-    def __init__(self, client=None, autocommit=False, dbname=None):
+    # The default `row_factory` of new cursors.
+    row_factory = None
+
+    def __init__(
+        self,
+        client=None,
+        autocommit=False,
+        dbname=None,
+        statement_cache_size=STATEMENT_CACHE_SIZE,
+        replicas=None,
+    ):
         self._autocommit = autocommit
-        self.postgres_client = client or get_client(dbname)
+        self.dbname = dbname
+        # Time spent getting the connection, reported with the first query.
+        self.wait_ms = 0.0
+        # Clients taken from the pool by this connection can be given back.
+        self.owns_client = client is None
+        self._client = client
+        self.released = False
+        self.transaction_depth = 0
+        # Cursors are moved to the next client after `release`.
+        self.cursors = weakref.WeakSet()
+        # Set `use_replicas` to False to keep reads with side effects on the primary.
+        self.replicas = replica_router(dbname, replicas) if replicas else None
+        self.use_replicas = True
+        self.replica_clients = {}
+        # Created with the first client, if it supports prepared statements.
+        self.statement_cache_size = statement_cache_size
+        self.statement_cache = None
+        if client is not None:
+            self.init_statement_cache(client)
 
     def __enter__(self):
         return self
 
-    def __exit__(self):
+    def __exit__(self, *args):
         self.close()
 
+    def init_statement_cache(self, client):
+        if (
+            self.statement_cache is None
+            and self.statement_cache_size
+            and hasattr(client, "prepare")
+        ):
+            self.statement_cache = StatementCache(self.statement_cache_size)
+
+    @property
+    def postgres_client(self):
+        client = self._client
+        if client is None:
+            start = time.perf_counter()
+            client = self._client = get_client(self.dbname)
+            self.wait_ms += elapsed_ms(start)
+            self.init_statement_cache(client)
+            if self.released and self._autocommit:
+                wrap_async(lambda rr: client.set_auto_commit(rr, True))
+        return client
+
+    def release(self):
+        """
+        Give the pooled connection back to the pool.
+        """
+        client = self._client
+        if client is None or not self.owns_client:
+            return
+        self._client = None
+        self.released = True
+        for cursor in list(self.cursors):
+            cursor.detach()
+        if self.statement_cache is not None:
+            # Prepared statements belong to the connection that was given back.
+            self.statement_cache.invalidate()
+        release_client(self.dbname, client)
+
+    def transaction(self, release=True) -> "Transaction":
+        """
+        A context manager that commits on success and rolls back on error.
+        """
+        return Transaction(self, release)
+
     @property
     def Warning(self):
         return sys.modules[__name__].Warning
@@ -240,11 +1597,59 @@ class PostgresConnection:
     def set_autocommit(self, autocommit):
         self.autocommit = autocommit
 
-    def cursor(self, *args, **kwargs) -> PostgresCursor:
-        return PostgresCursor(self.postgres_client.cursor(), self)
+    def cursor(
+        self,
+        name=None,
+        *args,
+        scrollable=None,
+        withhold=False,
+        row_factory=None,
+        **kwargs,
+    ) -> PostgresCursor:
+        if name is not None:
+            cursor = NamedPostgresCursor(
+                self.postgres_client.cursor(),
+                self,
+                name,
+                scrollable=scrollable,
+                withhold=withhold,
+            )
+        elif self.replicas is not None:
+            cursor = ReplicaRoutingCursor(self.postgres_client.cursor(), self)
+        else:
+            cursor = PostgresCursor(self.postgres_client.cursor(), self)
+        row_factory = row_factory or self.row_factory
+        if row_factory is not None:
+            cursor.row_factory = row_factory
+        self.cursors.add(cursor)
+        return cursor
+
+    def replica_client(self, name):
+        client = self.replica_clients.get(name)
+        if client is None:
+            start = time.perf_counter()
+            client = get_client(name)
+            wrap_async(lambda rr: client.set_auto_commit(rr, True))
+            self.wait_ms += elapsed_ms(start)
+            self.replica_clients[name] = client
+        return client
+
+    def take_wait_ms(self) -> float:
+        wait_ms = self.wait_ms
+        self.wait_ms = 0.0
+        return wait_ms
 
     def close(self):
-        self.postgres_client.close()
+        for name, client in self.replica_clients.items():
+            release_client(name, client)
+        self.replica_clients = {}
+        client = self._client
+        if client is not None:
+            self._client = None
+            if self.owns_client:
+                release_client(self.dbname, client)
+            else:
+                client.close()
 
     def commit(self):
         return wrap_async(lambda r: self.postgres_client.commit(r))
@@ -253,6 +1658,322 @@ class PostgresConnection:
         return wrap_async(lambda r: self.postgres_client.rollback(r))
 
 
+class BaseTransaction:
+    """
+    Savepoint and nesting bookkeeping shared by `Transaction` and `AsyncTransaction`.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.savepoint = None
+        self.restore_autocommit = False
+
+    def begin(self) -> Optional[str]:
+        """
+        Enter the transaction. Returns the SAVEPOINT statement to run when nested.
+        """
+        connection = self.connection
+        q = None
+        if connection.transaction_depth:
+            self.savepoint = f"puff_savepoint_{connection.transaction_depth}"
+            q = f"SAVEPOINT {self.savepoint}"
+        elif connection.autocommit:
+            self.restore_autocommit = True
+        connection.transaction_depth += 1
+        return q
+
+    def end(self, exc_type) -> Optional[str]:
+        """
+        Leave the transaction. Returns the statement that ends a savepoint, if any.
+        """
+        self.connection.transaction_depth -= 1
+        if self.savepoint is None:
+            return None
+        if exc_type is None:
+            return f"RELEASE SAVEPOINT {self.savepoint}"
+        return f"ROLLBACK TO SAVEPOINT {self.savepoint}"
+
+
+class Transaction(BaseTransaction):
+    """
+    See `PostgresConnection.transaction`.
+    """
+
+    def __init__(self, connection, release=True):
+        super().__init__(connection)
+        self.release = release
+
+    def run(self, q):
+        with self.connection.cursor() as cursor:
+            cursor.execute(q)
+
+    def __enter__(self):
+        connection = self.connection
+        q = self.begin()
+        if q is not None:
+            self.run(q)
+        elif self.restore_autocommit:
+            connection.autocommit = False
+        return connection
+
+    def __exit__(self, exc_type, exc, tb):
+        connection = self.connection
+        q = self.end(exc_type)
+        if q is not None:
+            self.run(q)
+            return
+        try:
+            if exc_type is None:
+                connection.commit()
+            else:
+                connection.rollback()
+        finally:
+            if self.restore_autocommit:
+                connection.autocommit = True
+            if self.release:
+                connection.release()
+
+
+class AsyncCursor:
+    """
+    A cursor for code running on the asyncio loop.
+    """
+
+    itersize = 2000
+
+    def __init__(self, cursor, connection):
+        self.cursor = cursor
+        self.connection = connection
+        self.last_query = None
+        self.arraysize = 1
+        self._rows = None
+        self._prefetch = None
+        self._exhausted = False
+
+    async def reset(self):
+        prefetch = self._prefetch
+        self._prefetch = None
+        self._rows = None
+        self._exhausted = False
+        if prefetch is not None:
+            try:
+                await prefetch
+            except Exception:
+                pass
+
+    async def execute(self, q, params=None) -> "AsyncCursor":
+        await self.reset()
+        self.last_query = q.encode("utf8")
+        if params is not None:
+            params = list(params)
+            q = convert_placeholders(q)
+        cursor = self.cursor
+        statement_cache = self.connection.statement_cache
+        if statement_cache is None or not is_preparable(q, params):
+            await wrap_async_asyncio(lambda r: cursor.execute(r, q, params))
+            return self
+        statement = statement_cache.get(q)
+        if statement is None:
+            client = self.connection.postgres_client
+            statement = await wrap_async_asyncio(lambda r: client.prepare(r, q))
+            statement_cache.put(q, statement)
+        try:
+            await wrap_async_asyncio(
+                lambda r: cursor.execute_prepared(r, statement, params)
+            )
+        except Exception as e:
+            if not is_stale_statement_error(e):
+                raise
+            statement_cache.invalidate()
+            if not self.connection.autocommit:
+                raise
+            await wrap_async_asyncio(lambda r: cursor.execute(r, q, params))
+        return self
+
+    async def executemany(self, q, seq_of_params=None):
+        await self.reset()
+        self.last_query = q.encode("utf8")
+        q = convert_placeholders(q)
+        await wrap_async_asyncio(lambda r: self.cursor.executemany(r, q, seq_of_params))
+
+    async def describe(self):
+        """
+        The DB-API `description` of the last query.
+        """
+        return await wrap_async_asyncio(lambda r: self.cursor.description(r))
+
+    async def rowcount(self) -> int:
+        return await wrap_async_asyncio(lambda r: self.cursor.do_get_rowcount(r))
+
+    def fetch_batch(self, rowcount):
+        return wrap_async_asyncio(lambda r: self.cursor.fetchmany(r, rowcount))
+
+    async def fetchone(self):
+        row = await self.fetchmany(1)
+        return row[0] if row else None
+
+    async def fetchmany(self, rowcount=None):
+        if rowcount is None:
+            rowcount = self.arraysize
+        rows = self._rows
+        result = []
+        if rows:
+            result = [rows.popleft() for _ in range(min(rowcount, len(rows)))]
+        if len(result) < rowcount and self._prefetch is not None:
+            self._rows = rows = deque(await self.take_prefetch())
+            result += [
+                rows.popleft() for _ in range(min(rowcount - len(result), len(rows)))
+            ]
+        if len(result) < rowcount and not self._exhausted:
+            result += await self.fetch_batch(rowcount - len(result))
+        return result
+
+    async def fetchall(self):
+        result = list(self._rows or ())
+        self._rows = None
+        if self._prefetch is not None:
+            result += await self.take_prefetch()
+        if not self._exhausted:
+            result += await wrap_async_asyncio(lambda r: self.cursor.fetchall(r))
+            self._exhausted = True
+        return result
+
+    async def take_prefetch(self):
+        prefetch = self._prefetch
+        self._prefetch = None
+        batch = await prefetch
+        if len(batch) < self.itersize:
+            self._exhausted = True
+        return batch
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        rows = self._rows
+        if not rows:
+            if self._prefetch is not None:
+                batch = await self.take_prefetch()
+            elif self._exhausted:
+                raise StopAsyncIteration
+            else:
+                batch = await self.fetch_batch(self.itersize)
+                self._exhausted = len(batch) < self.itersize
+            if not batch:
+                raise StopAsyncIteration
+            self._rows = rows = deque(batch)
+            if not self._exhausted:
+                self._prefetch = asyncio.ensure_future(self.fetch_batch(self.itersize))
+        return rows.popleft()
+
+    async def close(self):
+        await self.reset()
+        self.cursor.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
+class AsyncTransaction(BaseTransaction):
+    """
+    An async context manager that commits on success and rolls back on error.
+    """
+
+    async def __aenter__(self):
+        connection = self.connection
+        q = self.begin()
+        if q is not None:
+            await connection.run(q)
+        elif self.restore_autocommit:
+            await connection.set_autocommit(False)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        connection = self.connection
+        q = self.end(exc_type)
+        if q is not None:
+            await connection.run(q)
+            return
+        try:
+            if exc_type is None:
+                await connection.commit()
+            else:
+                await connection.rollback()
+        finally:
+            if self.restore_autocommit:
+                await connection.set_autocommit(True)
+
+
+class AsyncPostgresConnection:
+    """
+    A Postgres connection for code running on the asyncio loop, see `async_connect`.
+    """
+
+    def __init__(
+        self,
+        client=None,
+        autocommit=False,
+        dbname=None,
+        statement_cache_size=STATEMENT_CACHE_SIZE,
+    ):
+        self.autocommit = autocommit
+        self.dbname = dbname
+        self.owns_client = client is None
+        self.postgres_client = client or get_client(dbname)
+        self.statement_cache = None
+        if statement_cache_size and hasattr(self.postgres_client, "prepare"):
+            self.statement_cache = StatementCache(statement_cache_size)
+        self.transaction_depth = 0
+
+    def cursor(self) -> AsyncCursor:
+        return AsyncCursor(self.postgres_client.cursor(), self)
+
+    async def execute(self, q, params=None) -> AsyncCursor:
+        """
+        Run a query on a new cursor and return the cursor to fetch from.
+        """
+        return await self.cursor().execute(q, params)
+
+    async def run(self, q, params=None):
+        async with self.cursor() as cursor:
+            await cursor.execute(q, params)
+
+    async def set_autocommit(self, value):
+        self.autocommit = value
+        client = self.postgres_client
+        await wrap_async_asyncio(lambda rr: client.set_auto_commit(rr, value))
+
+    def transaction(self) -> AsyncTransaction:
+        return AsyncTransaction(self)
+
+    async def commit(self):
+        client = self.postgres_client
+        await wrap_async_asyncio(lambda r: client.commit(r))
+
+    async def rollback(self):
+        client = self.postgres_client
+        await wrap_async_asyncio(lambda r: client.rollback(r))
+
+    def close(self):
+        client = self.postgres_client
+        if client is None:
+            return
+        self.postgres_client = None
+        if self.owns_client:
+            release_client(self.dbname, client)
+        else:
+            client.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+
 connection_override = contextvars.ContextVar("connection_override")
 
 
@@ -266,9 +1987,118 @@ def connect(*parameters, **kwargs) -> PostgresConnection:
     if this_connection_override is not None:
         real_kwargs["client"] = this_connection_override
 
-    valid_params = ["autocommit", "dbname"]
+    valid_params = ["autocommit", "dbname", "statement_cache_size"]
     for param in valid_params:
         if param in kwargs:
             real_kwargs[param] = kwargs[param]
+    real_kwargs["replicas"] = replica_router(
+        kwargs.get("dbname"),
+        kwargs.get("replicas"),
+        kwargs.get("replica_strategy"),
+        kwargs.get("replica_max_lag"),
+    )
     conn = PostgresConnection(**real_kwargs)
     return conn
+
+
+# Postgres takes at most this many bind parameters in one statement.
+MAX_QUERY_PARAMS = 65535
+EXECUTE_PAGE_SIZE = 100
+TEMPLATE_RE = re.compile(r"%\((\w+)\)s|%s|%%")
+
+
+def pages(iterable, size):
+    iterator = iter(iterable)
+    while page := list(islice(iterator, size)):
+        yield page
+
+
+def execute_batch(cur, sql, argslist, page_size=EXECUTE_PAGE_SIZE, progress=None):
+    """
+    Run `sql` for every parameter set in `argslist`, `page_size` sets at a time.
+    """
+    done = 0
+    for page in pages(argslist, page_size):
+        cur.executemany(sql, page)
+        done += len(page)
+        if progress is not None:
+            progress(done)
+
+
+def split_values(sql):
+    """
+    Split `sql` around its single `%s` placeholder.
+    """
+    placeholders = [m for m in PLACEHOLDER_RE.finditer(sql) if m.group() == "%s"]
+    if len(placeholders) != 1:
+        raise Exception("the query must contain exactly one '%s' placeholder")
+    (placeholder,) = placeholders
+    return sql[: placeholder.start()], sql[placeholder.end() :]
+
+
+def compile_template(template, row):
+    """
+    Turn a row template into one with `%s` placeholders and the keys it reads.
+    """
+    if template is None:
+        return "(" + ", ".join(["%s"] * len(row)) + ")", None
+    names = []
+
+    def replace(match):
+        if match.group(1) is not None:
+            names.append(match.group(1))
+            return "%s"
+        return match.group()
+
+    template = TEMPLATE_RE.sub(replace, template)
+    return template, names or None
+
+
+def execute_values(
+    cur,
+    sql,
+    argslist,
+    template=None,
+    page_size=EXECUTE_PAGE_SIZE,
+    fetch=False,
+    progress=None,
+):
+    """
+    Run `sql` with its `%s` replaced by a `VALUES` list of `page_size` rows at a time.
+    """
+    before, after = split_values(sql)
+    argslist = iter(argslist)
+    first = next(argslist, None)
+    if first is None:
+        return [] if fetch else None
+    row_template, names = compile_template(template, first)
+    row_params = row_template.count("%s") or 1
+    page_size = max(1, min(page_size, MAX_QUERY_PARAMS // row_params))
+    result = []
+    done = 0
+    for page in pages(chain([first], argslist), page_size):
+        params = []
+        for row in page:
+            params.extend(row if names is None else [row[name] for name in names])
+        values = ", ".join([row_template] * len(page))
+        cur.execute(before + values + after, params)
+        if fetch:
+            result.extend(cur.fetchall())
+        done += len(page)
+        if progress is not None:
+            progress(done)
+    return result if fetch else None
+
+
+def async_connect(**kwargs) -> AsyncPostgresConnection:
+    """
+    Connect for use from the asyncio loop. Takes the same arguments as `connect`.
+    """
+    this_connection_override = connection_override.get(None)
+    real_kwargs = {}
+    if this_connection_override is not None:
+        real_kwargs["client"] = this_connection_override
+    for param in ["autocommit", "dbname", "statement_cache_size"]:
+        if param in kwargs:
+            real_kwargs[param] = kwargs[param]
+    return AsyncPostgresConnection(**real_kwargs)
@@ -1,11 +1,240 @@
-from typing import Optional, Dict, List, Tuple, Any
-from . import Bytelike, rust_objects, wrap_async
+import dataclasses
+import hashlib
+import os
+import re
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from itertools import islice
+from typing import Optional, Dict, Iterable, Iterator, List, Tuple, Any
+from . import (
+    Bytelike,
+    EventQueue,
+    MainThread,
+    is_greenlet,
+    join_all,
+    parent_thread,
+    rust_objects,
+    wrap_async,
+)
+from .serializers import Codec, make_codec
+
+NEAR_CACHE_SIZE = 10000
+NEAR_CACHE_TTL_MS = 60 * 1000
+NEAR_CACHE_CHANNEL = "puff:near-cache:invalidate"
+BULK_BATCH_SIZE = 1000
+
+
+def key_bytes(key: Bytelike) -> bytes:
+    return key.encode("utf8") if isinstance(key, str) else bytes(key)
+
+
+@dataclasses.dataclass(slots=True)
+class NearCacheStats:
+    hits: int
+    misses: int
+    invalidations: int
+    evictions: int
+    size: int
+
+
+class NearCache:
+    """
+    An in-process LRU cache of Redis values, invalidated by CLIENT TRACKING or pub/sub.
+    """
+
+    def __init__(
+        self,
+        max_size: int = NEAR_CACHE_SIZE,
+        ttl_ms: Optional[int] = NEAR_CACHE_TTL_MS,
+        prefixes: Tuple[Bytelike, ...] = (),
+        channel: str = NEAR_CACHE_CHANNEL,
+        pubsub_client=None,
+    ):
+        self.max_size = max_size
+        self.ttl_ms = ttl_ms
+        self.prefixes = tuple(key_bytes(p) for p in prefixes)
+        self.channel = channel
+        self.pubsub_client = pubsub_client
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        # Bumped on every invalidation so a read that raced with a write is not cached.
+        self.epoch = 0
+        self.tracking = None
+        # Set under `lock` by the first reader, so concurrent reads start one listener.
+        self.listening = False
+        self.listener = None
+        self.connection = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def cacheable(self, key: bytes) -> bool:
+        return not self.prefixes or key.startswith(self.prefixes)
+
+    def lookup(self, key: bytes):
+        """
+        Return `(True, value)` on a hit and `(False, epoch)` on a miss.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self.entries[key]
+            self.misses += 1
+            return False, self.epoch
+
+    def put(self, key: bytes, value, epoch: int):
+        with self.lock:
+            if epoch != self.epoch:
+                return
+            expires_at = None
+            if self.ttl_ms is not None:
+                expires_at = time.monotonic() + self.ttl_ms / 1000
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, keys=None):
+        """
+        Forget `keys`, or everything if `keys` is None.
+        """
+        with self.lock:
+            self.epoch += 1
+            self.invalidations += 1
+            if keys is None:
+                self.entries.clear()
+                return
+            for key in keys:
+                self.entries.pop(key_bytes(key), None)
+
+    def start(self, client):
+        """
+        Subscribe to invalidations before the first cached read.
+        """
+        if self.tracking is None:
+            self.tracking = client is not None and hasattr(client, "enable_tracking")
+            if self.tracking:
+                prefixes = list(self.prefixes)
+                wrap_async(
+                    lambda rr: client.enable_tracking(rr, prefixes, self.invalidate)
+                )
+        if self.tracking:
+            return
+        with self.lock:
+            if self.listening:
+                return
+            self.listening = True
+        try:
+            connection = self.pubsub().connection()
+            connection.subscribe(self.channel)
+            # Receive on a thread of our own so the caller's event loop can drain.
+            listener = MainThread(
+                EventQueue(), on_thread_start=parent_thread.get().on_thread_start
+            )
+            listener.daemon = True
+            listener.start()
+        except Exception:
+            self.listening = False
+            raise
+        self.listener = listener
+        self.connection = connection
+        listener.spawn(self.listen, (connection,), {}, lambda val, e: None)
+
+    def stop(self):
+        """
+        Unsubscribe, stop the listener thread and forget every entry.
+        """
+        listener, connection = self.listener, self.connection
+        if listener is not None:
+            self.listener = self.connection = None
+            self.listening = False
+            listener.spawn(
+                connection.unsubscribe,
+                (self.channel,),
+                {},
+                lambda val, e: listener.kill(),
+            )
+        self.invalidate()
+
+    def pubsub(self):
+        if self.pubsub_client is None:
+            from .pubsub import global_pubsub
+
+            self.pubsub_client = global_pubsub
+        return self.pubsub_client
+
+    def listen(self, connection):
+        thread = parent_thread.get()
+        try:
+            while (message := connection.receive()) is not None:
+                self.invalidate(
+                    [bytes.fromhex(k.decode("ascii")) for k in message.body.split()]
+                    or None
+                )
+        finally:
+            # Without a listener nothing would invalidate the cache any more.
+            if self.listener is thread:
+                self.listener = self.connection = None
+                self.listening = False
+            self.invalidate()
+            thread.start_shutdown()
+
+    def broadcast(self, keys: List[bytes]):
+        """
+        Invalidate `keys` here and, without tracking, in every other process.
+        """
+        keys = [key for key in keys if self.cacheable(key)]
+        if not keys:
+            return
+        self.invalidate(keys)
+        if not self.tracking:
+            body = b" ".join(key.hex().encode("ascii") for key in keys)
+            pubsub = self.pubsub()
+            pubsub.publish_bytes_as(pubsub.new_connection_id(), self.channel, body)
+
+    def stats(self) -> NearCacheStats:
+        with self.lock:
+            return NearCacheStats(
+                hits=self.hits,
+                misses=self.misses,
+                invalidations=self.invalidations,
+                evictions=self.evictions,
+                size=len(self.entries),
+            )
 
 
 class RedisClient:
-    def __init__(self, client=None, client_fn=None):
+    """
+    A client for a Puff Redis pool, with an optional serializer and compressor.
+    """
+
+    def __init__(
+        self,
+        client=None,
+        client_fn=None,
+        near_cache: NearCache = None,
+        serializer=None,
+        compressor=None,
+    ):
         self.redis = None
         self.client_fn = client_fn or rust_objects.global_redis_getter
+        self.near_cache = near_cache
+        self.codec = make_codec(serializer, compressor)
+        # Run on the thread that receives replies, None without a codec.
+        self.decode = self.codec and self.codec.decode
+        self.decode_many = self.codec and self.codec.decode_many
+        # SHA1s of scripts this client has already sent with EVAL.
+        self.loaded_scripts = set()
 
     def client(self):
         rc = self.redis
@@ -14,19 +243,103 @@ class RedisClient:
         return rc
 
     def get(self, key: Bytelike) -> Optional[bytes]:
-        return wrap_async(lambda rr: self.client().get(rr, key))
+        near_cache = self.near_cache
+        if near_cache is None or not is_greenlet():
+            return self.fetch(key)
+        cache_key = key_bytes(key)
+        if not near_cache.cacheable(cache_key):
+            return self.fetch(key)
+        near_cache.start(self.tracking_client())
+        found, value = near_cache.lookup(cache_key)
+        if found:
+            return self.decode_cached(value)
+        epoch = value
+        value = self.fetch(key, raw=True)
+        near_cache.put(cache_key, value, epoch)
+        return self.decode_cached(value)
+
+    def fetch(self, key: Bytelike, raw=False) -> Optional[bytes]:
+        return wrap_async(
+            lambda rr: self.client().get(rr, key),
+            wrap_return=None if raw else self.decode,
+        )
+
+    def fetch_many(self, keys: List[Bytelike], raw=False) -> List[bytes]:
+        return wrap_async(
+            lambda rr: self.client().mget(rr, keys),
+            wrap_return=None if raw else self.decode_many,
+        )
+
+    def decode_cached(self, value):
+        # The near cache keeps encoded values so every hit gets its own object.
+        return value if self.codec is None else self.codec.decode(value)
+
+    def encode(self, value):
+        codec = self.codec
+        return value if codec is None else codec.encode(value)
+
+    def decode_pop(self, count: int):
+        return self.decode if count == 1 else self.decode_many
+
+    def decode_pair(self, pair):
+        if pair is None:
+            return None
+        key, value = pair
+        return key, value if self.codec is None else self.codec.decode(value)
+
+    def tracking_client(self):
+        """
+        The connection to track near cache keys on, or None to use pub/sub.
+        """
+        return self.client()
 
     def set(self, key: Bytelike, value: Bytelike, nx=None, ex=None):
-        return wrap_async(lambda rr: self.client().set(rr, key, value, ex, nx))
+        if self.codec is not None:
+            value = self.codec.encode(value)
+        ret = wrap_async(lambda rr: self.client().set(rr, key, value, ex, nx))
+        self.invalidate_near_cache([key])
+        return ret
 
     def mset(self, values: Dict[Bytelike, Bytelike], nx=None):
         if isinstance(values, dict):
             values = values.items()
-        return wrap_async(lambda rr: self.client().mset(rr, values, nx))
+        if self.codec is None:
+            values = list(values)
+        else:
+            values = [(key, self.codec.encode(value)) for key, value in values]
+        ret = wrap_async(lambda rr: self.client().mset(rr, values, nx))
+        self.invalidate_near_cache([key for key, _ in values])
+        return ret
 
     def mget(self, keys: List[Bytelike]) -> List[bytes]:
         keys = [key for key in keys]
-        return wrap_async(lambda rr: self.client().mget(rr, keys))
+        near_cache = self.near_cache
+        if near_cache is None or not is_greenlet():
+            return self.fetch_many(keys)
+        near_cache.start(self.tracking_client())
+        results = []
+        missing = []
+        for ix, key in enumerate(keys):
+            cache_key = key_bytes(key)
+            found, value = (
+                near_cache.lookup(cache_key)
+                if near_cache.cacheable(cache_key)
+                else (False, None)
+            )
+            results.append(self.decode_cached(value) if found else None)
+            if not found:
+                missing.append((ix, cache_key, value))
+        if missing:
+            values = self.fetch_many([keys[ix] for ix, _, _ in missing], raw=True)
+            for (ix, cache_key, epoch), value in zip(missing, values):
+                results[ix] = self.decode_cached(value)
+                if epoch is not None:
+                    near_cache.put(cache_key, value, epoch)
+        return results
+
+    def invalidate_near_cache(self, keys: List[Bytelike]):
+        if self.near_cache is not None:
+            self.near_cache.broadcast([key_bytes(key) for key in keys])
 
     def persist(self, key: Bytelike) -> bool:
         return wrap_async(lambda rr: self.client().persist(rr, key))
@@ -34,48 +347,925 @@ class RedisClient:
     def expire(self, key: Bytelike, seconds: int) -> bool:
         return wrap_async(lambda rr: self.client().expire(rr, key, seconds))
 
-    def delete(self, key: Bytelike) -> bool:
-        return wrap_async(lambda rr: self.client().delete(rr, key))
+    def delete(self, *keys: Bytelike):
+        """
+        Delete one key and return whether it existed, or several and count them.
+        """
+        if len(keys) != 1:
+            return self.delete_many(keys)
+        key = keys[0]
+        ret = wrap_async(lambda rr: self.client().delete(rr, key))
+        self.invalidate_near_cache([key])
+        return ret
 
     def incr(self, key: Bytelike, delta: int) -> int:
-        return wrap_async(lambda rr: self.client().incr(rr, key, delta))
+        ret = wrap_async(lambda rr: self.client().incr(rr, key, delta))
+        self.invalidate_near_cache([key])
+        return ret
 
     def decr(self, key: Bytelike, delta: int) -> int:
-        return wrap_async(lambda rr: self.client().decr(rr, key, delta))
+        ret = wrap_async(lambda rr: self.client().decr(rr, key, delta))
+        self.invalidate_near_cache([key])
+        return ret
 
     def lpop(self, key: Bytelike, count: int = 1) -> Optional[bytes]:
-        return wrap_async(lambda rr: self.client().lpop(rr, key, count))
+        return wrap_async(
+            lambda rr: self.client().lpop(rr, key, count),
+            wrap_return=self.codec and self.decode_pop(count),
+        )
 
     def rpop(self, key: Bytelike, count: int = 1) -> Optional[bytes]:
-        return wrap_async(lambda rr: self.client().rpop(rr, key, count))
+        return wrap_async(
+            lambda rr: self.client().rpop(rr, key, count),
+            wrap_return=self.codec and self.decode_pop(count),
+        )
 
     def blpop(self, key: Bytelike, timeout: int) -> Optional[Tuple[bytes, bytes]]:
-        return wrap_async(lambda rr: self.client().blpop(rr, key, timeout))
+        return wrap_async(
+            lambda rr: self.client().blpop(rr, key, timeout),
+            wrap_return=self.codec and self.decode_pair,
+        )
 
     def brpop(self, key: Bytelike, timeout: int) -> Optional[Tuple[bytes, bytes]]:
-        return wrap_async(lambda rr: self.client().brpop(rr, key, timeout))
+        return wrap_async(
+            lambda rr: self.client().brpop(rr, key, timeout),
+            wrap_return=self.codec and self.decode_pair,
+        )
 
     def lpush(self, key: Bytelike, value: Bytelike) -> int:
+        value = self.encode(value)
         return wrap_async(lambda rr: self.client().lpush(rr, key, value))
 
     def rpush(self, key: Bytelike, value: Bytelike) -> int:
+        value = self.encode(value)
         return wrap_async(lambda rr: self.client().rpush(rr, key, value))
 
     def rpoplpush(self, key: Bytelike, destination: Bytelike) -> int:
-        return wrap_async(lambda rr: self.client().rpoplpush(rr, key, destination))
+        return wrap_async(
+            lambda rr: self.client().rpoplpush(rr, key, destination),
+            wrap_return=self.decode,
+        )
 
     def command(self, command: List[Bytelike]) -> Any:
         return wrap_async(lambda rr: self.client().command(rr, command))
 
-    def pipeline(self):
+    def pipeline(self, transaction: bool = False) -> "Pipeline":
+        return Pipeline(self, transaction=transaction)
+
+    def register_script(self, source: str) -> "Script":
+        """
+        Return a callable that runs the Lua `source` atomically on Redis. See `Script`.
+        """
+        return Script(self, source)
+
+    def scan_iter(
+        self, match: Bytelike = None, count: int = None, _type: str = None
+    ) -> Iterator[bytes]:
+        """
+        Iterate over the keys matching `match` with SCAN.
+        """
+        for keys in scan_pages(self.command, ["SCAN"], match, count, _type):
+            yield from keys
+
+    def hscan_iter(
+        self, key: Bytelike, match: Bytelike = None, count: int = None
+    ) -> Iterator[Tuple[bytes, bytes]]:
+        """
+        Iterate over the `(field, value)` pairs of a hash with HSCAN.
+        """
+        for items in scan_pages(self.command, ["HSCAN", key], match, count):
+            yield from zip(items[::2], items[1::2])
+
+    def sscan_iter(
+        self, key: Bytelike, match: Bytelike = None, count: int = None
+    ) -> Iterator[bytes]:
+        """
+        Iterate over the members of a set with SSCAN.
+        """
+        for members in scan_pages(self.command, ["SSCAN", key], match, count):
+            yield from members
+
+    def zscan_iter(
+        self, key: Bytelike, match: Bytelike = None, count: int = None
+    ) -> Iterator[Tuple[bytes, float]]:
+        """
+        Iterate over the `(member, score)` pairs of a sorted set with ZSCAN.
+        """
+        for items in scan_pages(self.command, ["ZSCAN", key], match, count):
+            for member, score in zip(items[::2], items[1::2]):
+                yield member, float(score)
+
+    def delete_many(
+        self, keys: Iterable[Bytelike], batch_size: int = BULK_BATCH_SIZE
+    ) -> int:
+        """
+        Delete `keys` in batches of `batch_size`. Returns how many keys existed.
+        """
+        return self.bulk_delete("DEL", keys, batch_size)
+
+    def unlink_many(
+        self, keys: Iterable[Bytelike], batch_size: int = BULK_BATCH_SIZE
+    ) -> int:
+        """
+        Like `delete_many`, but Redis frees the memory in the background with UNLINK.
+        """
+        return self.bulk_delete("UNLINK", keys, batch_size)
+
+    def expire_many(
+        self, keys: Iterable[Bytelike], seconds: int, batch_size: int = BULK_BATCH_SIZE
+    ) -> int:
+        """
+        Set a timeout on `keys` in batches of `batch_size`. Returns how many keys exist.
+        """
+        total = 0
+        for batch in batched(keys, batch_size):
+            pipeline = self.pipeline()
+            for key in batch:
+                pipeline.expire(key, seconds)
+            total += sum(pipeline.execute())
+        return total
+
+    def bulk_delete(self, name: str, keys: Iterable[Bytelike], batch_size: int) -> int:
+        total = 0
+        for batch in batched(keys, batch_size):
+            pipeline = self.pipeline()
+            for group in self.key_groups(batch):
+                pipeline.written.extend(group)
+                pipeline.add([name, *group])
+            total += sum(pipeline.execute())
+        return total
+
+    def key_groups(self, keys: List[Bytelike]) -> List[List[Bytelike]]:
+        """
+        Split `keys` into groups that one multi key command can take.
+        """
+        return [keys]
+
+
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    items = iter(items)
+    while batch := list(islice(items, size)):
+        yield batch
+
+
+def scan_pages(run, command, match=None, count=None, _type=None) -> Iterator[list]:
+    """
+    Yield each page of a SCAN family command until the cursor returns to 0.
+    """
+    options = []
+    if match is not None:
+        options += ["MATCH", match]
+    if count is not None:
+        options += ["COUNT", count]
+    if _type is not None:
+        options += ["TYPE", _type]
+    cursor = "0"
+    while True:
+        cursor, items = run([*command, cursor, *options])
+        yield items
+        if int(cursor) == 0:
+            return
+
+
+def to_bool(value) -> bool:
+    return bool(value)
+
+
+def to_arg(value) -> Bytelike:
+    if isinstance(value, (str, bytes)):
+        return value
+    return str(value)
+
+
+class Pipeline:
+    """
+    Buffers commands and sends them to Redis in one round trip when `execute` is called.
+    """
+
+    def __init__(self, redis_client: RedisClient, transaction: bool = False):
+        self.redis_client = redis_client
+        self.transaction = transaction
+        self.commands = []
+        self.callbacks = []
+        self.written = []
+        self.scripts = {}
+
+    def __len__(self):
+        return len(self.commands)
+
+    def __enter__(self):
         return self
 
-    def execute(self):
+    def __exit__(self, *args):
+        self.reset()
+
+    def reset(self):
+        self.commands = []
+        self.callbacks = []
+        self.written = []
+        self.scripts = {}
+
+    def add(self, command, callback=None) -> "Pipeline":
+        self.commands.append([to_arg(arg) for arg in command])
+        self.callbacks.append(callback)
         return self
 
+    def get(self, key: Bytelike) -> "Pipeline":
+        return self.add(["GET", key], self.redis_client.decode)
+
+    def script(self, script: "Script", keys=(), args=()) -> "Pipeline":
+        """
+        Queue a run of `script`, with EVAL if this client hasn't loaded it yet.
+        """
+        keys = list(keys)
+        self.written.extend(keys)
+        self.scripts[len(self.commands)] = (script, keys, args)
+        loaded = script.sha in self.redis_client.loaded_scripts
+        return self.add(script.command(keys, args, load=not loaded))
+
+    def set(self, key: Bytelike, value: Bytelike, nx=None, ex=None) -> "Pipeline":
+        self.written.append(key)
+        command = ["SET", key, self.redis_client.encode(value)]
+        if ex is not None:
+            command += ["EX", ex]
+        if nx:
+            command.append("NX")
+        return self.add(command, lambda result: result is not None)
+
+    def mset(self, values: Dict[Bytelike, Bytelike], nx=None) -> "Pipeline":
+        if isinstance(values, dict):
+            values = values.items()
+        command = ["MSETNX" if nx else "MSET"]
+        encode = self.redis_client.encode
+        for key, value in values:
+            command += [key, encode(value)]
+            self.written.append(key)
+        return self.add(command, to_bool)
+
+    def mget(self, keys: List[Bytelike]) -> "Pipeline":
+        return self.add(["MGET", *keys], self.redis_client.decode_many)
+
+    def persist(self, key: Bytelike) -> "Pipeline":
+        return self.add(["PERSIST", key], to_bool)
+
+    def expire(self, key: Bytelike, seconds: int) -> "Pipeline":
+        return self.add(["EXPIRE", key, seconds], to_bool)
+
+    def delete(self, key: Bytelike) -> "Pipeline":
+        self.written.append(key)
+        return self.add(["DEL", key], to_bool)
+
+    def incr(self, key: Bytelike, delta: int) -> "Pipeline":
+        self.written.append(key)
+        return self.add(["INCRBY", key, delta])
+
+    def decr(self, key: Bytelike, delta: int) -> "Pipeline":
+        self.written.append(key)
+        return self.add(["DECRBY", key, delta])
+
+    def lpop(self, key: Bytelike, count: int = 1) -> "Pipeline":
+        return self.add(
+            ["LPOP", key] if count == 1 else ["LPOP", key, count],
+            self.redis_client.decode_pop(count),
+        )
+
+    def rpop(self, key: Bytelike, count: int = 1) -> "Pipeline":
+        return self.add(
+            ["RPOP", key] if count == 1 else ["RPOP", key, count],
+            self.redis_client.decode_pop(count),
+        )
+
+    def lpush(self, key: Bytelike, value: Bytelike) -> "Pipeline":
+        return self.add(["LPUSH", key, self.redis_client.encode(value)])
+
+    def rpush(self, key: Bytelike, value: Bytelike) -> "Pipeline":
+        return self.add(["RPUSH", key, self.redis_client.encode(value)])
+
+    def rpoplpush(self, key: Bytelike, destination: Bytelike) -> "Pipeline":
+        return self.add(["RPOPLPUSH", key, destination], self.redis_client.decode)
+
+    def command(self, command: List[Bytelike]) -> "Pipeline":
+        return self.add(command)
+
+    def execute(self, raise_on_error: bool = True) -> List[Any]:
+        """
+        Sends the buffered commands and returns their results.
+        """
+        commands, callbacks, written = self.commands, self.callbacks, self.written
+        scripts = self.scripts
+        self.reset()
+        if not commands:
+            return []
+        try:
+            results = self.send(commands)
+            if scripts:
+                self.reload_scripts(scripts, results)
+        finally:
+            if written:
+                self.redis_client.invalidate_near_cache(written)
+        for ix, (result, callback) in enumerate(zip(results, callbacks)):
+            if isinstance(result, Exception):
+                if raise_on_error:
+                    raise result
+            elif callback is not None:
+                results[ix] = callback(result)
+        return results
+
+    def reload_scripts(self, scripts, results):
+        """
+        Rerun scripts that failed with NOSCRIPT with EVAL, outside of transactions.
+        """
+        loaded_scripts = self.redis_client.loaded_scripts
+        retry = []
+        for ix, (script, keys, args) in scripts.items():
+            if is_noscript_error(results[ix]):
+                loaded_scripts.discard(script.sha)
+                retry.append((ix, script.command(keys, args, load=True)))
+            elif not isinstance(results[ix], Exception):
+                loaded_scripts.add(script.sha)
+        if retry and not self.transaction:
+            retried = self.send([command for _, command in retry])
+            for (ix, _), result in zip(retry, retried):
+                results[ix] = result
+
+    def send(self, commands):
+        client = self.redis_client.client()
+        if hasattr(client, "pipeline"):
+            return wrap_async(
+                lambda rr: client.pipeline(rr, commands, self.transaction)
+            )
+        if self.transaction:
+            raise Exception(
+                "This Redis client does not support MULTI/EXEC transactions"
+            )
+        return [self.run_one(client, command) for command in commands]
+
+    def run_one(self, client, command):
+        try:
+            return wrap_async(lambda rr: client.command(rr, command))
+        except Exception as e:
+            return e
+
+
+def is_noscript_error(e) -> bool:
+    return isinstance(e, Exception) and "NOSCRIPT" in str(e)
+
+
+class Script:
+    """
+    A Lua script registered with `RedisClient.register_script`, run with EVALSHA.
+    """
+
+    def __init__(self, redis_client: RedisClient, source: str):
+        self.redis_client = redis_client
+        self.source = source
+        self.sha = hashlib.sha1(source.encode("utf8")).hexdigest()
+
+    def command(self, keys, args, load=False):
+        if load:
+            return ["EVAL", self.source, len(keys), *keys, *args]
+        return ["EVALSHA", self.sha, len(keys), *keys, *args]
+
+    def __call__(self, keys=(), args=(), client=None):
+        client = self.redis_client if client is None else client
+        if isinstance(client, Pipeline):
+            return client.script(self, keys, args)
+        keys = list(keys)
+        try:
+            result = client.command(self.command(keys, args))
+        except Exception as e:
+            if not is_noscript_error(e):
+                raise
+            result = client.command(self.command(keys, args, load=True))
+        client.invalidate_near_cache(keys)
+        return result
+
+
+CLUSTER_SLOTS = 16384
+CLUSTER_MAX_REDIRECTS = 5
+REDIRECT_RE = re.compile(r"\b(MOVED|ASK):?\s+(\d+)\s+(\S+):(\d+)", re.I)
+
+
+def crc16_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021 if crc & 0x8000 else crc << 1) & 0xFFFF
+        table.append(crc)
+    return table
+
+
+CRC16_TABLE = crc16_table()
+
+
+def key_slot(key: Bytelike) -> int:
+    """
+    The Redis Cluster hash slot of `key`, honouring `{...}` hash tags.
+    """
+    key = key_bytes(key)
+    start = key.find(b"{")
+    if start != -1:
+        end = key.find(b"}", start + 1)
+        if end > start + 1:
+            key = key[start + 1 : end]
+    crc = 0
+    for byte in key:
+        crc = ((crc << 8) & 0xFFFF) ^ CRC16_TABLE[(crc >> 8) ^ byte]
+    return crc % CLUSTER_SLOTS
+
+
+def command_key(command) -> Optional[Bytelike]:
+    """
+    The key a raw command operates on, used to pick its cluster node.
+    """
+    if len(command) < 2:
+        return None
+    name = key_bytes(command[0]).upper()
+    if name in (b"EVAL", b"EVALSHA"):
+        return command[3] if len(command) > 3 and int(command[2]) else None
+    if name == b"XGROUP":
+        return command[2] if len(command) > 2 else None
+    if name in (b"XREAD", b"XREADGROUP"):
+        for ix, arg in enumerate(command):
+            if isinstance(arg, (str, bytes)) and key_bytes(arg).upper() == b"STREAMS":
+                return command[ix + 1] if ix + 1 < len(command) else None
+    return command[1]
+
+
+def parse_redirect(e) -> Optional[Tuple[str, int, Tuple[str, int]]]:
+    """
+    Parse a MOVED or ASK error into `(kind, slot, (host, port))`.
+    """
+    m = REDIRECT_RE.search(str(e))
+    if m is None:
+        return None
+    kind, slot, host, port = m.groups()
+    return kind.upper(), int(slot), (host, int(port))
+
+
+def to_str(value) -> str:
+    return value.decode("utf8") if isinstance(value, bytes) else str(value)
+
+
+class ClusterPipeline(Pipeline):
+    """
+    A pipeline for Redis Cluster that sends each node's commands concurrently.
+    """
+
+    def send(self, commands):
+        cluster = self.redis_client
+        results = [None] * len(commands)
+        pending = range(len(commands))
+        asking = {}
+        for _ in range(CLUSTER_MAX_REDIRECTS + 1):
+            groups = {}
+            for ix in pending:
+                address = asking.get(ix) or cluster.node_for_command(commands[ix])
+                groups.setdefault(address, []).append(ix)
+            if self.transaction and len(groups) > 1:
+                raise Exception("CROSSSLOT Keys in a cluster transaction span nodes")
+            batches = []
+            for address, ixs in groups.items():
+                batch = []
+                positions = []
+                for ix in ixs:
+                    if ix in asking:
+                        batch.append(["ASKING"])
+                    positions.append(len(batch))
+                    batch.append(commands[ix])
+                node = cluster.node(address)
+                sent = wrap_async(
+                    lambda rr: node.pipeline(rr, batch, self.transaction), join=False
+                )
+                batches.append((ixs, positions, sent))
+            join_all([sent for _, _, sent in batches])
+            retry = []
+            moved = []
+            asking = {}
+            for ixs, positions, sent in batches:
+                if sent.exception is not None:
+                    if parse_redirect(sent.exception) is None:
+                        raise sent.exception
+                    replies = [sent.exception] * (positions[-1] + 1)
+                else:
+                    replies = sent.result
+                for ix, position in zip(ixs, positions):
+                    reply = results[ix] = replies[position]
+                    if not isinstance(reply, Exception):
+                        continue
+                    redirect = parse_redirect(reply)
+                    if redirect is None:
+                        continue
+                    kind, slot, address = redirect
+                    if kind == "MOVED":
+                        moved.append((slot, address))
+                    else:
+                        asking[ix] = address
+                    retry.append(ix)
+            if moved:
+                cluster.moved(moved)
+            if not retry:
+                break
+            pending = retry
+        return results
+
+
+class ClusterRedisClient(RedisClient):
+    """
+    A `RedisClient` for Redis Cluster. Only greenlets are supported.
+    """
+
+    def __init__(
+        self,
+        client=None,
+        client_fn=None,
+        near_cache: NearCache = None,
+        node_fn=None,
+        serializer=None,
+        compressor=None,
+    ):
+        super().__init__(client, client_fn, near_cache, serializer, compressor)
+        self.node_fn = node_fn
+        self.nodes = {}
+        self.slots = None
+
+    def node(self, address):
+        if address is None:
+            return self.client()
+        node = self.nodes.get(address)
+        if node is None:
+            host, port = address
+            if self.node_fn is not None:
+                node = self.node_fn(host, port)
+            else:
+                node = self.client().node(host, port)
+            self.nodes[address] = node
+        return node
+
+    def refresh_slots(self):
+        reply = wrap_async(lambda rr: self.client().command(rr, ["CLUSTER", "SLOTS"]))
+        slots = [None] * CLUSTER_SLOTS
+        for start, end, primary, *replicas in reply:
+            address = (to_str(primary[0]), int(primary[1]))
+            slots[start : end + 1] = [address] * (end - start + 1)
+        self.slots = slots
+
+    def moved(self, redirects):
+        """
+        Reload the slot map after MOVED replies, given as `(slot, address)` pairs.
+        """
+        self.refresh_slots()
+        for slot, address in redirects:
+            self.slots[slot] = address
+
+    def node_for_slot(self, slot: int):
+        if self.slots is None:
+            self.refresh_slots()
+        return self.slots[slot]
+
+    def node_for_command(self, command):
+        key = command_key(command)
+        if key is None:
+            return None
+        return self.node_for_slot(key_slot(key))
+
+    def tracking_client(self):
+        # Tracking on one node would miss writes to the others.
+        return None
+
+    def primaries(self):
+        if self.slots is None:
+            self.refresh_slots()
+        return list(dict.fromkeys(address for address in self.slots if address))
+
+    def scan_iter(
+        self, match: Bytelike = None, count: int = None, _type: str = None
+    ) -> Iterator[bytes]:
+        # Every primary has its own keyspace to scan.
+        for address in self.primaries():
+            node = self.node(address)
+
+            def run(command):
+                return wrap_async(lambda rr: node.command(rr, command))
+
+            for keys in scan_pages(run, ["SCAN"], match, count, _type):
+                yield from keys
+
+    def key_groups(self, keys: List[Bytelike]) -> List[List[Bytelike]]:
+        return [[keys[ix] for ix in ixs] for ixs in self.group_by_slot(keys)]
+
+    def pipeline(self, transaction: bool = False) -> ClusterPipeline:
+        return ClusterPipeline(self, transaction=transaction)
+
+    def run(self, build):
+        pipeline = self.pipeline()
+        build(pipeline)
+        return pipeline.execute()[0]
+
+    def group_by_slot(self, keys):
+        groups = {}
+        for ix, key in enumerate(keys):
+            groups.setdefault(key_slot(key), []).append(ix)
+        return list(groups.values())
+
+    def fetch(self, key: Bytelike, raw=False) -> Optional[bytes]:
+        if raw:
+            return self.run(lambda p: p.add(["GET", key]))
+        return self.run(lambda p: p.get(key))
+
+    def fetch_many(self, keys: List[Bytelike], raw=False) -> List[bytes]:
+        groups = self.group_by_slot(keys)
+        pipeline = self.pipeline()
+        for ixs in groups:
+            group = [keys[ix] for ix in ixs]
+            if raw:
+                pipeline.add(["MGET", *group])
+            else:
+                pipeline.mget(group)
+        results = [None] * len(keys)
+        for ixs, values in zip(groups, pipeline.execute()):
+            for ix, value in zip(ixs, values):
+                results[ix] = value
+        return results
+
+    def set(self, key: Bytelike, value: Bytelike, nx=None, ex=None):
+        return self.run(lambda p: p.set(key, value, nx, ex))
+
+    def mset(self, values: Dict[Bytelike, Bytelike], nx=None):
+        if isinstance(values, dict):
+            values = values.items()
+        values = list(values)
+        groups = self.group_by_slot([key for key, _ in values])
+        if nx and len(groups) > 1:
+            raise Exception("CROSSSLOT Keys in MSETNX must hash to the same slot")
+        pipeline = self.pipeline()
+        for ixs in groups:
+            pipeline.mset([values[ix] for ix in ixs], nx)
+        return all(pipeline.execute())
+
+    def persist(self, key: Bytelike) -> bool:
+        return self.run(lambda p: p.persist(key))
+
+    def expire(self, key: Bytelike, seconds: int) -> bool:
+        return self.run(lambda p: p.expire(key, seconds))
+
+    def delete(self, *keys: Bytelike):
+        if len(keys) != 1:
+            return self.delete_many(keys)
+        return self.run(lambda p: p.delete(keys[0]))
+
+    def incr(self, key: Bytelike, delta: int) -> int:
+        return self.run(lambda p: p.incr(key, delta))
+
+    def decr(self, key: Bytelike, delta: int) -> int:
+        return self.run(lambda p: p.decr(key, delta))
+
+    def lpop(self, key: Bytelike, count: int = 1) -> Optional[bytes]:
+        return self.run(lambda p: p.lpop(key, count))
+
+    def rpop(self, key: Bytelike, count: int = 1) -> Optional[bytes]:
+        return self.run(lambda p: p.rpop(key, count))
+
+    def blpop(self, key: Bytelike, timeout: int) -> Optional[Tuple[bytes, bytes]]:
+        return self.run(lambda p: p.add(["BLPOP", key, timeout], self.decode_pair))
+
+    def brpop(self, key: Bytelike, timeout: int) -> Optional[Tuple[bytes, bytes]]:
+        return self.run(lambda p: p.add(["BRPOP", key, timeout], self.decode_pair))
+
+    def lpush(self, key: Bytelike, value: Bytelike) -> int:
+        return self.run(lambda p: p.lpush(key, value))
+
+    def rpush(self, key: Bytelike, value: Bytelike) -> int:
+        return self.run(lambda p: p.rpush(key, value))
+
+    def rpoplpush(self, key: Bytelike, destination: Bytelike) -> int:
+        return self.run(lambda p: p.rpoplpush(key, destination))
+
+    def command(self, command: List[Bytelike]) -> Any:
+        return self.run(lambda p: p.command(command))
+
+
+def cluster_enabled(name: str) -> bool:
+    """
+    True if `PUFF_<NAME>_REDIS_CLUSTER` turns on cluster mode for the named pool.
+    """
+    value = os.environ.get(f"PUFF_{name.upper()}_REDIS_CLUSTER", "")
+    return value.lower() in ("1", "true", "yes")
+
+
+global_redis = ClusterRedisClient() if cluster_enabled("default") else RedisClient()
+
+
+def named_client(
+    name: str = "default",
+    near_cache: NearCache = None,
+    cluster: Optional[bool] = None,
+    serializer=None,
+    compressor=None,
+):
+    if cluster is None:
+        cluster = cluster_enabled(name)
+    return (ClusterRedisClient if cluster else RedisClient)(
+        client_fn=lambda: rust_objects.global_redis_getter.by_name(name),
+        near_cache=near_cache,
+        serializer=serializer,
+        compressor=compressor,
+    )
+
+
+STREAM_BATCH_SIZE = 100
+STREAM_BLOCK_MS = 5000
+STREAM_CLAIM_IDLE_MS = 60 * 1000
+
+
+@dataclasses.dataclass(slots=True)
+class StreamMessage:
+    id: bytes
+    fields: Dict[bytes, bytes]
+
+
+def parse_stream_entries(entries) -> List[StreamMessage]:
+    messages = []
+    for id, fields in entries:
+        # Entries deleted while pending come back without fields.
+        fields = fields or []
+        messages.append(StreamMessage(id, dict(zip(fields[::2], fields[1::2]))))
+    return messages
+
+
+def message_id(message) -> Bytelike:
+    return message.id if isinstance(message, StreamMessage) else message
+
+
+class RedisStream:
+    """
+    A consumer in a Redis Streams consumer group.
+    """
+
+    def __init__(
+        self,
+        key: Bytelike,
+        group: str,
+        consumer: Optional[str] = None,
+        redis_client: RedisClient = None,
+        count: int = STREAM_BATCH_SIZE,
+        block_ms: int = STREAM_BLOCK_MS,
+        claim_idle_ms: int = STREAM_CLAIM_IDLE_MS,
+    ):
+        self.key = key
+        self.group = group
+        self.consumer = (
+            consumer or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        )
+        self.redis_client = redis_client or global_redis
+        self.count = count
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+        self.claim_start = "0-0"
+        self.next_claim_at = 0.0
+
+    def create_group(self, start_id: str = "$") -> bool:
+        """
+        Create the consumer group. Returns False if it already exists.
+        """
+        try:
+            self.redis_client.command(
+                ["XGROUP", "CREATE", self.key, self.group, start_id, "MKSTREAM"]
+            )
+        except Exception as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+            return False
+        return True
+
+    def add(
+        self,
+        fields: Dict[Bytelike, Bytelike],
+        maxlen: Optional[int] = None,
+        approximate: bool = True,
+        id: str = "*",
+    ) -> bytes:
+        command = ["XADD", self.key]
+        if maxlen is not None:
+            command += ["MAXLEN", "~" if approximate else "=", maxlen]
+        command.append(id)
+        for field, value in fields.items():
+            command += [field, value]
+        return self.redis_client.command(command)
+
+    def read_command(self, count=None, block_ms=None, id=">"):
+        command = ["XREADGROUP", "GROUP", self.group, self.consumer]
+        command += ["COUNT", count or self.count]
+        block_ms = self.block_ms if block_ms is None else block_ms
+        if block_ms:
+            command += ["BLOCK", block_ms]
+        return command + ["STREAMS", self.key, id]
+
+    def parse_read(self, reply) -> List[StreamMessage]:
+        if not reply:
+            return []
+        if isinstance(reply, dict):
+            reply = reply.items()
+        messages = []
+        for _, entries in reply:
+            messages.extend(parse_stream_entries(entries))
+        return messages
+
+    def read(self, count: int = None, block_ms: int = None) -> List[StreamMessage]:
+        """
+        Read up to `count` new messages, waiting up to `block_ms`.
+        """
+        return self.parse_read(
+            self.redis_client.command(self.read_command(count, block_ms))
+        )
+
+    def read_pending(self, count: int = None) -> List[StreamMessage]:
+        """
+        Read messages delivered to this consumer but not acknowledged yet.
+        """
+        return self.parse_read(
+            self.redis_client.command(self.read_command(count, 0, id="0"))
+        )
+
+    def ack_command(self, messages):
+        ids = [message_id(message) for message in messages]
+        if not ids:
+            return None
+        return ["XACK", self.key, self.group, *ids]
+
+    def ack(self, messages) -> int:
+        """
+        Acknowledge messages (or message ids) with a single XACK.
+        """
+        command = self.ack_command(messages)
+        return 0 if command is None else self.redis_client.command(command)
+
+    def claim_command(self, count=None, min_idle_ms=None):
+        min_idle_ms = self.claim_idle_ms if min_idle_ms is None else min_idle_ms
+        return [
+            "XAUTOCLAIM",
+            self.key,
+            self.group,
+            self.consumer,
+            min_idle_ms,
+            self.claim_start,
+            "COUNT",
+            count or self.count,
+        ]
+
+    def parse_claim(self, reply) -> List[StreamMessage]:
+        next_start, entries = reply[0], reply[1]
+        self.claim_start = next_start
+        if key_bytes(next_start) == b"0-0":
+            # Scanned the whole pending list, wait before checking again.
+            self.next_claim_at = time.monotonic() + self.claim_idle_ms / 2000
+        return parse_stream_entries(entries)
+
+    def claim_stale(
+        self, count: int = None, min_idle_ms: int = None
+    ) -> List[StreamMessage]:
+        """
+        Take over up to `count` messages left unacknowledged for `min_idle_ms`.
+        """
+        return self.parse_claim(
+            self.redis_client.command(self.claim_command(count, min_idle_ms))
+        )
 
-global_redis = RedisClient()
+    def claim_due(self) -> bool:
+        return self.claim_idle_ms is not None and time.monotonic() >= self.next_claim_at
 
+    def batches(
+        self, count: int = None, block_ms: int = None, auto_ack: bool = True
+    ) -> Iterator[List[StreamMessage]]:
+        """
+        Yield batches of messages forever, reclaiming stale messages first.
+        """
+        while True:
+            batch = self.claim_stale(count) if self.claim_due() else []
+            if not batch:
+                batch = self.read(count, block_ms)
+            if batch:
+                yield batch
+                if auto_ack:
+                    self.ack(batch)
 
-def named_client(name: str = "default"):
-    return RedisClient(client_fn=lambda: rust_objects.global_redis_getter.by_name(name))
+    async def abatches(
+        self, count: int = None, block_ms: int = None, auto_ack: bool = True
+    ):
+        """
+        The asyncio version of `batches`.
+        """
+        command = self.redis_client.command
+        while True:
+            batch = []
+            if self.claim_due():
+                batch = self.parse_claim(await command(self.claim_command(count)))
+            if not batch:
+                batch = self.parse_read(
+                    await command(self.read_command(count, block_ms))
+                )
+            if batch:
+                yield batch
+                if auto_ack:
+                    await command(self.ack_command(batch))
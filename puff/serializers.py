@@ -0,0 +1,222 @@
+"""
+Value serializers and compressors for `puff.redis.RedisClient` and the Django cache.
+
+A serializer turns Python objects into bytes with `dumps` and back with `loads`, and a compressor does the same for
+bytes with `compress` and `decompress`. `Codec` chains one of each.
+"""
+
+import pickle
+import struct
+import zlib
+from typing import Any, Optional
+
+from . import import_string
+
+
+class RawSerializer:
+    """
+    Stores `bytes` and `str` as they are, like `RedisClient` without a serializer.
+    """
+
+    def dumps(self, value) -> bytes:
+        if isinstance(value, str):
+            return value.encode("utf8")
+        return value
+
+    def loads(self, data: bytes):
+        return data
+
+
+class PickleSerializer:
+    """
+    Pickle with protocol 5. Buffers that support out-of-band pickling, such as `bytearray`, `pickle.PickleBuffer` and
+    numpy arrays, are appended after the pickle instead of being pickled inline. Writing copies them once into the
+    stored value, loading hands them back as views into it without another copy.
+    """
+
+    def __init__(self, protocol: int = 5):
+        self.protocol = protocol
+
+    def dumps(self, value) -> bytes:
+        buffers = []
+        body = pickle.dumps(
+            value, protocol=self.protocol, buffer_callback=buffers.append
+        )
+        views = [buffer.raw() for buffer in buffers]
+        header = struct.pack(
+            f"<I{len(views)}Q", len(views), *(view.nbytes for view in views)
+        )
+        return b"".join([header, body, *views])
+
+    def loads(self, data: bytes):
+        data = memoryview(data)
+        (count,) = struct.unpack_from("<I", data)
+        sizes = struct.unpack_from(f"<{count}Q", data, 4)
+        end = len(data)
+        buffers = []
+        for size in reversed(sizes):
+            buffers.append(data[end - size : end])
+            end -= size
+        buffers.reverse()
+        return pickle.loads(data[4 + 8 * count : end], buffers=buffers)
+
+
+class JsonSerializer:
+    """
+    JSON with the Rust encoder from `puff.json`, or the standard library outside of Puff.
+    """
+
+    def __init__(self):
+        from . import json_impl
+
+        if hasattr(json_impl, "dumpb"):
+            self.dumpb, self.loadb = json_impl.dumpb, json_impl.loadb
+        else:
+            import json
+
+            self.dumpb = lambda value: json.dumps(value).encode("utf8")
+            self.loadb = json.loads
+
+    def dumps(self, value) -> bytes:
+        return self.dumpb(value)
+
+    def loads(self, data: bytes):
+        return self.loadb(data)
+
+
+class MsgpackSerializer:
+    """
+    MessagePack, using the `msgpack` package.
+    """
+
+    def __init__(self):
+        import msgpack
+
+        self.msgpack = msgpack
+
+    def dumps(self, value) -> bytes:
+        return self.msgpack.packb(value, use_bin_type=True)
+
+    def loads(self, data: bytes):
+        return self.msgpack.unpackb(data, raw=False)
+
+
+class ZlibCompressor:
+    """
+    zlib from the standard library. Payloads smaller than `min_size` bytes are stored uncompressed.
+    """
+
+    def __init__(self, level: int = 6, min_size: int = 1024):
+        self.level = level
+        self.min_size = min_size
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zlib.decompress(data)
+
+
+class ZstdCompressor:
+    """
+    Zstandard, using the `zstandard` package.
+    """
+
+    def __init__(self, level: int = 3, min_size: int = 1024):
+        import zstandard
+
+        self.min_size = min_size
+        self.compressor = zstandard.ZstdCompressor(level=level)
+        self.decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data: bytes) -> bytes:
+        return self.compressor.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return self.decompressor.decompress(data)
+
+
+class Lz4Compressor:
+    """
+    LZ4 frames, using the `lz4` package.
+    """
+
+    def __init__(self, min_size: int = 1024):
+        import lz4.frame
+
+        self.lz4 = lz4.frame
+        self.min_size = min_size
+
+    def compress(self, data: bytes) -> bytes:
+        return self.lz4.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return self.lz4.decompress(data)
+
+
+SERIALIZERS = {
+    "raw": RawSerializer,
+    "pickle": PickleSerializer,
+    "json": JsonSerializer,
+    "msgpack": MsgpackSerializer,
+}
+
+COMPRESSORS = {
+    "zlib": ZlibCompressor,
+    "zstd": ZstdCompressor,
+    "lz4": Lz4Compressor,
+}
+
+STORED = b"\x00"
+COMPRESSED = b"\x01"
+
+
+def resolve(spec, registry, **kwargs):
+    """
+    Turn a short name from `registry`, a dotted import path, a class or an instance into an instance.
+    """
+    if spec is None or not (isinstance(spec, (str, type))):
+        return spec
+    if isinstance(spec, str):
+        spec = registry.get(spec) or import_string(spec)
+    return spec(**kwargs)
+
+
+class Codec:
+    """
+    Encodes values with `serializer` and then `compressor`. With a compressor every payload starts with a flag byte
+    saying whether it was compressed, so payloads below the compressor's `min_size` are stored as they are.
+    """
+
+    def __init__(self, serializer=None, compressor=None):
+        self.serializer = resolve(serializer, SERIALIZERS) or RawSerializer()
+        self.compressor = resolve(compressor, COMPRESSORS)
+
+    def encode(self, value) -> bytes:
+        data = self.serializer.dumps(value)
+        compressor = self.compressor
+        if compressor is None:
+            return data
+        if len(data) < compressor.min_size:
+            return STORED + data
+        return COMPRESSED + compressor.compress(data)
+
+    def decode(self, data: Optional[bytes]) -> Any:
+        if data is None:
+            return None
+        if self.compressor is not None:
+            flag, data = data[:1], data[1:]
+            if flag == COMPRESSED:
+                data = self.compressor.decompress(data)
+        return self.serializer.loads(data)
+
+    def decode_many(self, values):
+        return None if values is None else [self.decode(value) for value in values]
+
+
+def make_codec(serializer=None, compressor=None) -> Optional[Codec]:
+    if serializer is None and compressor is None:
+        return None
+    if isinstance(serializer, Codec):
+        return serializer
+    return Codec(serializer, compressor)
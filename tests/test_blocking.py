@@ -0,0 +1,135 @@
+import contextlib
+import queue
+import threading
+import time
+
+import puff
+from puff import local_runtime
+
+
+def setup_module():
+    local_runtime.install()
+
+
+def submit(pool, f, *args):
+    done = queue.Queue()
+    pool.submit(f, args, {}, lambda r, e: done.put((r, e)))
+    return done
+
+
+def test_blocking_pool_reuses_workers():
+    pool = puff.BlockingPool(max_workers=2)
+    try:
+        results = [submit(pool, threading.get_ident) for _ in range(10)]
+        idents = {r.get(timeout=5)[0] for r in results}
+        assert len(idents) <= 2
+        stats = pool.stats()
+        assert stats.workers <= 2
+        assert stats.completed == 10
+        assert stats.queued == 0
+    finally:
+        pool.shutdown()
+
+
+def test_blocking_pool_queues_when_saturated():
+    pool = puff.BlockingPool(max_workers=1, max_queued=1, queue_timeout_ms=10)
+    release = threading.Event()
+    try:
+        first = submit(pool, release.wait)
+        second = submit(pool, lambda: 2)
+        assert pool.stats().queued == 1
+        try:
+            submit(pool, lambda: 3)
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError("Expected the pool to reject the job")
+        release.set()
+        assert first.get(timeout=5) == (True, None)
+        assert second.get(timeout=5) == (2, None)
+        stats = pool.stats()
+        assert stats.rejected == 1
+        assert stats.max_wait_ms > 0
+    finally:
+        pool.shutdown()
+
+
+def test_blocking_pool_reaps_idle_workers():
+    pool = puff.BlockingPool(max_workers=2, idle_timeout_ms=10)
+    try:
+        submit(pool, lambda: 1).get(timeout=5)
+        time.sleep(0.05)
+        pool.reap()
+        assert pool.stats().workers == 0
+    finally:
+        pool.shutdown()
+
+
+@contextlib.contextmanager
+def blocking_pool(**options):
+    pool = puff.BlockingPool(**options)
+    previous = puff.blocking_pools.get(None)
+    puff.blocking_pools[None] = pool
+    try:
+        yield pool
+    finally:
+        pool.shutdown()
+        puff.blocking_pools[None] = previous
+
+
+def test_spawn_blocking_from_greenlet():
+    with blocking_pool():
+        assert local_runtime.run(lambda: puff.spawn_blocking(lambda x: x * 2, 21).join()) == 42
+
+
+def test_saturated_pool_parks_only_the_calling_greenlet():
+    release = threading.Event()
+
+    def f():
+        first = puff.spawn_blocking(release.wait)
+        second = puff.spawn_blocking(lambda: 2)
+        third = puff.spawn(lambda: puff.spawn_blocking(lambda: 3).join())
+        # The loop keeps running other greenlets while `third` waits for a slot.
+        puff.sleep_ms(10)
+        release.set()
+        return first.join(), second.join(), third.join()
+
+    with blocking_pool(max_workers=1, max_queued=1) as pool:
+        assert local_runtime.run(f) == (True, 2, 3)
+        assert pool.stats().rejected == 0
+
+
+def test_saturated_pool_rejects_after_queue_timeout():
+    release = threading.Event()
+
+    def f():
+        first = puff.spawn_blocking(release.wait)
+        second = puff.spawn_blocking(lambda: 2)
+        try:
+            puff.spawn_blocking(lambda: 3).join()
+        except RuntimeError as e:
+            return str(e)
+        finally:
+            release.set()
+            first.join()
+            second.join()
+
+    with blocking_pool(max_workers=1, max_queued=1, queue_timeout_ms=20) as pool:
+        assert "saturated" in local_runtime.run(f)
+        assert pool.stats().rejected == 1
+
+
+def test_nested_spawn_blocking_does_not_deadlock():
+    barrier = threading.Barrier(2)
+
+    def outer(i):
+        # Both workers are busy before either submits its nested job.
+        barrier.wait(timeout=5)
+        return puff.spawn_blocking(lambda: i).join()
+
+    def f():
+        return puff.join_all([puff.spawn_blocking(outer, i) for i in range(2)])
+
+    with blocking_pool(max_workers=2) as pool:
+        assert local_runtime.run(f) == [0, 1]
+        assert pool.stats().workers == 2
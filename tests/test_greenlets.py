@@ -0,0 +1,78 @@
+import queue
+import threading
+
+import puff
+
+
+def run_in_loop(f, *args):
+    done = queue.Queue()
+    thread = puff.start_event_loop()
+    thread.spawn(f, args, {}, lambda r, e: done.put((r, e)))
+    try:
+        result, exception = done.get(timeout=5)
+    finally:
+        thread.start_shutdown()
+    if exception is not None:
+        raise exception
+    return result
+
+
+def resolve_later(value, delay):
+    def start(rr):
+        threading.Timer(delay, rr, args=(value, None)).start()
+
+    return puff.wrap_async(start, join=False)
+
+
+def test_join():
+    assert run_in_loop(lambda: resolve_later(1, 0.01).join()) == 1
+
+
+def test_join_raises():
+    def fail(rr):
+        rr(None, ValueError("boom"))
+
+    def f():
+        try:
+            puff.wrap_async(fail)
+        except ValueError as e:
+            return str(e)
+
+    assert run_in_loop(f) == "boom"
+
+
+def test_join_all_keeps_input_order():
+    def f():
+        greenlets = [resolve_later(i, 0.001 * (5 - i)) for i in range(5)]
+        return puff.join_all(greenlets)
+
+    assert run_in_loop(f) == [0, 1, 2, 3, 4]
+
+
+def test_join_iter_yields_in_completion_order():
+    def f():
+        greenlets = [resolve_later(i, 0.02 * (3 - i)) for i in range(4)]
+        return list(puff.join_iter(greenlets))
+
+    assert run_in_loop(f) == [3, 2, 1, 0]
+
+
+def test_join_all_fan_out():
+    def f():
+        greenlets = [resolve_later(i, 0) for i in range(1000)]
+        return puff.join_all(greenlets)
+
+    assert run_in_loop(f) == list(range(1000))
+
+
+def test_event_queue_drains_batch():
+    q = puff.EventQueue()
+    try:
+        for i in range(3):
+            q.put(i)
+        assert q.get_batch() == [0, 1, 2]
+        threading.Timer(0.01, q.put, args=(3,)).start()
+        assert q.get_batch() == [3]
+    finally:
+        q.close()
+
@@ -0,0 +1,576 @@
+import array
+import io
+import time
+
+import puff
+from puff import local_runtime, postgres
+from puff.redis import RedisClient
+from puff.pubsub import global_pubsub
+from puff.task_queue import global_task_queue
+from puff.http import global_http_client
+
+
+def double(x):
+    return x * 2
+
+
+def hello_app(environ, start_response):
+    body = environ["wsgi.input"].read() or environ["PATH_INFO"].encode()
+    start_response("201 Created", [("Content-Type", "text/plain"), ("Set-Cookie", "a=1")])
+    return [body]
+
+
+def setup_module():
+    local_runtime.install(http_app=hello_app)
+
+
+def test_redis():
+    def f():
+        redis = RedisClient()
+        redis.set("a", "1")
+        redis.mset({"b": b"2", "c": b"3"})
+        redis.incr("c", 2)
+        redis.rpush("l", "x")
+        return (
+            redis.get("a"),
+            redis.mget(["a", "b", "c", "missing"]),
+            redis.blpop("l", 1),
+            redis.command(["HSET", "h", "f", "v"]),
+            redis.command(["HGETALL", "h"]),
+        )
+
+    assert local_runtime.run(f) == (
+        b"1",
+        [b"1", b"2", b"5", None],
+        (b"l", b"x"),
+        1,
+        [b"f", b"v"],
+    )
+
+
+def test_redis_delete_several_keys():
+    def f():
+        redis = RedisClient()
+        redis.mset({"d1": b"1", "d2": b"2", "d3": b"3"})
+        # Django's RedisCacheClient.delete_many calls `client.delete(*keys)`.
+        return redis.delete("d1", "d2", "missing"), redis.delete("d3"), redis.delete("d3")
+
+    assert local_runtime.run(f) == (2, True, False)
+
+
+def test_redis_blpop_waits_for_push():
+    def f():
+        redis = RedisClient()
+        waiting = puff.spawn(redis.blpop, "queue", 1)
+        redis.rpush("queue", "job")
+        return waiting.join(), redis.blpop("queue", 0.01)
+
+    assert local_runtime.run(f) == ((b"queue", b"job"), None)
+
+
+def test_redis_scan_and_bulk():
+    def f():
+        redis = RedisClient()
+        redis.mset({f"sweep:{i}": str(i) for i in range(25)})
+        redis.command(["HSET", "sweep-hash", "a", "1", "b", "2"])
+        keys = sorted(redis.scan_iter(match="sweep:*", count=7))
+        fields = dict(redis.hscan_iter("sweep-hash", count=1))
+        expired = redis.expire_many(keys[:5] + [b"sweep:missing"], 100, batch_size=2)
+        deleted = redis.delete_many(redis.scan_iter(match="sweep:*"), batch_size=4)
+        unlinked = redis.unlink_many(["sweep-hash", "sweep:missing"])
+        return len(keys), fields, expired, deleted, unlinked, list(redis.scan_iter("sweep*"))
+
+    assert local_runtime.run(f) == (25, {b"a": b"1", b"b": b"2"}, 5, 25, 1, [])
+
+
+def test_redis_stream():
+    from puff.redis import RedisStream
+
+    def f():
+        first = RedisStream("events", "workers", "first", count=3, block_ms=0)
+        second = RedisStream("events", "workers", "second", claim_idle_ms=0)
+        created = first.create_group(), second.create_group()
+        for i in range(5):
+            first.add({"n": str(i)})
+        unacked = first.read()
+        claimed = second.claim_stale()
+        acked = second.ack(claimed)
+        batches = second.batches(block_ms=1000)
+        rest = next(batches)
+        puff.spawn(lambda: puff.sleep_ms(20) or first.add({"n": "late"}))
+        late = next(batches)
+        return created, unacked, claimed, rest, late, acked, first.read_pending()
+
+    created, unacked, claimed, rest, late, acked, pending = local_runtime.run(f)
+    assert created == (True, False)
+    assert [m.fields[b"n"] for m in unacked] == [b"0", b"1", b"2"]
+    assert [m.id for m in claimed] == [m.id for m in unacked]
+    assert [m.fields[b"n"] for m in rest] == [b"3", b"4"]
+    assert [m.fields for m in late] == [{b"n": b"late"}]
+    assert acked == 3
+    assert pending == []
+
+
+RATE_LIMIT = """
+local count = redis.call('INCR', KEYS[1])
+if count == 1 then redis.call('PEXPIRE', KEYS[1], ARGV[1]) end
+return count
+"""
+
+
+def rate_limit(redis, keys, args):
+    count = redis.do_incr(keys[0])
+    if count == 1:
+        redis.do_pexpire(keys[0], args[0])
+    return count
+
+
+def test_redis_script():
+    local_runtime.emulate_script(RATE_LIMIT, rate_limit)
+
+    def f():
+        redis = RedisClient()
+        limit = redis.register_script(RATE_LIMIT)
+        first = limit(["rate"], [1000]), limit(["rate"], [1000])
+        pipe = redis.pipeline()
+        limit(["rate"], [1000], client=pipe)
+        limit(["other-rate"], [1000], client=pipe).get("rate")
+        piped = pipe.execute()
+        redis.command(["SCRIPT", "FLUSH"])
+        pipe = redis.pipeline()
+        flushed = limit(["rate"], [1000], client=pipe).execute()
+        return first, piped, flushed, redis.command(["PTTL", "rate"]) > 0
+
+    assert local_runtime.run(f) == ((1, 2), [3, 1, b"3"], [4], True)
+
+
+def test_redis_pipeline():
+    def f():
+        redis = RedisClient()
+        pipe = redis.pipeline()
+        pipe.set("p1", "1").mset({"p2": "2"}).expire("p2", 10).incr("p1", 5)
+        pipe.get("p1").rpush("p-list", "a").get("p-list").delete("p2")
+        results = pipe.execute(raise_on_error=False)
+        with redis.pipeline(transaction=True) as tx:
+            tx.incr("p1", 1).mget(["p1", "p2"])
+            return results, tx.execute()
+
+    results, tx = local_runtime.run(f)
+    assert results[:6] == [True, True, True, 6, b"6", 1]
+    assert isinstance(results[6], Exception)
+    assert results[7] is True
+    assert tx == [7, [b"7", None]]
+
+
+def test_redis_near_cache():
+    from puff.redis import NearCache
+
+    class UntrackedRedis:
+        def __init__(self, client):
+            self.client = client
+
+        def get(self, rr, key):
+            self.client.get(rr, key)
+
+        def set(self, rr, key, value, ex=None, nx=None):
+            self.client.set(rr, key, value, ex, nx)
+
+    def f():
+        writer = RedisClient()
+        tracked = RedisClient(near_cache=NearCache(prefixes=["flag:"]))
+        writer.set("flag:a", "1")
+        first = tracked.get("flag:a"), tracked.get("flag:a")
+        writer.set("flag:a", "2")
+        second = tracked.get("flag:a")
+
+        # Without CLIENT TRACKING, writes through near cached clients are broadcast over pub/sub.
+        raw = puff.rust_objects.global_redis_getter()
+        untracked_cache = NearCache()
+        reader = RedisClient(client_fn=lambda: UntrackedRedis(raw), near_cache=untracked_cache)
+        other = RedisClient(client_fn=lambda: UntrackedRedis(raw), near_cache=NearCache())
+        third = reader.get("flag:a")
+        other.get("flag:a")
+        other.set("flag:a", "3")
+        puff.sleep_ms(10)
+        fourth = reader.get("flag:a")
+        untracked_cache.stop()
+        other.near_cache.stop()
+        return first, second, third, fourth, untracked_cache.stats()
+
+    first, second, third, fourth, stats = local_runtime.run(f)
+    assert first == (b"1", b"1")
+    assert second == b"2"
+    assert third == b"2"
+    assert fourth == b"3"
+    assert stats.misses == 2 and stats.invalidations == 2
+
+
+def test_redis_near_cache_hands_out_fresh_values():
+    from puff.redis import NearCache
+
+    def f():
+        client = RedisClient(near_cache=NearCache(prefixes=["doc:"]), serializer="json")
+        client.set("doc:a", {"flags": [1]})
+        client.get("doc:a")["flags"].append(2)
+        client.mget(["doc:a"])[0]["flags"].append(3)
+        return client.get("doc:a"), client.mget(["doc:a"]), client.near_cache.stats().hits
+
+    assert local_runtime.run(f) == ({"flags": [1]}, [{"flags": [1]}], 3)
+
+
+def test_redis_near_cache_starts_one_listener():
+    from puff.redis import NearCache, NEAR_CACHE_CHANNEL
+
+    class UntrackedRedis:
+        def __init__(self, client):
+            self.client = client
+
+        def get(self, rr, key):
+            self.client.get(rr, key)
+
+    def subscribers():
+        pubsub = puff.rust_objects.global_pubsub_getter()
+        return len(pubsub.channels.get(NEAR_CACHE_CHANNEL, ()))
+
+    def f():
+        raw = puff.rust_objects.global_redis_getter()
+        cache = NearCache()
+        client = RedisClient(client_fn=lambda: UntrackedRedis(raw), near_cache=cache)
+        before = subscribers()
+        puff.join_all([puff.spawn(client.get, "flag:c") for _ in range(5)])
+        during = subscribers()
+        cache.stop()
+        puff.sleep_ms(10)
+        return during - before, subscribers() - before
+
+    assert local_runtime.run(f) == (1, 0)
+
+
+def test_redis_near_cache_is_bypassed_under_asyncio():
+    from puff.redis import NearCache
+
+    cache = NearCache()
+
+    async def f():
+        client = RedisClient(near_cache=cache)
+        await client.set("flag:b", "1")
+        return await client.get("flag:b"), await client.mget(["flag:b"])
+
+    assert local_runtime.run_async(f) == (b"1", [b"1"])
+    assert cache.listener is None and cache.stats().size == 0
+
+
+def run_with_cursor(f, **kwargs):
+    def run():
+        with postgres.connect(**kwargs) as conn:
+            return f(conn, conn.cursor())
+
+    return local_runtime.run(run)
+
+
+def test_postgres():
+    def f(conn, cursor):
+        cursor.execute("CREATE TABLE t (id INTEGER, name TEXT)")
+        cursor.executemany("INSERT INTO t VALUES (%s, %s)", [(1, "a"), (2, "b")])
+        conn.commit()
+        cursor.execute("SELECT name FROM t WHERE id = %s", [2])
+        result = cursor.description[0][0], cursor.fetchall()
+        cursor.row_factory = postgres.dict_row
+        cursor.execute("SELECT id, name FROM t ORDER BY id")
+        return result, cursor.fetchall()
+
+    assert run_with_cursor(f) == (("name", [("b",)]), [{"id": 1, "name": "a"}, {"id": 2, "name": "b"}])
+
+
+def test_postgres_iteration():
+    def f(conn, cursor):
+        cursor.execute("CREATE TABLE numbers (n INTEGER)")
+        cursor.executemany("INSERT INTO numbers VALUES (%s)", [(i,) for i in range(10)])
+        cursor.execute("SELECT n FROM numbers ORDER BY n")
+        cursor.itersize = 3
+        everything = [n for (n,) in cursor]
+
+        named = conn.cursor("numbers_cursor")
+        named.itersize = 4
+        named.execute("SELECT n FROM numbers WHERE n >= %s ORDER BY n", [2])
+        first = named.fetchone()
+        some = named.fetchmany(2)
+        rest = [n for (n,) in named]
+        named.close()
+        return everything, first, some, rest
+
+    everything, first, some, rest = run_with_cursor(f)
+    assert everything == list(range(10))
+    assert first == (2,)
+    assert some == [(3,), (4,)]
+    assert rest == list(range(5, 10))
+
+
+def test_postgres_copy():
+    def f(conn, cursor):
+        cursor.execute("CREATE TABLE people (id INTEGER, name TEXT, note TEXT)")
+        cursor.copy_from(io.StringIO("1\talice\t\\N\n2\tbob\ttab\\there\n"), "people")
+        rows = (f"{i}|p{i}\n".encode() for i in range(3, 6))
+        cursor.copy_expert("COPY people (id, name) FROM STDIN WITH (DELIMITER '|')", rows, size=4)
+        copied = cursor.rowcount
+        out = io.StringIO()
+        cursor.copy_to(out, "people", columns=["id", "note"])
+        binary = io.BytesIO()
+        cursor.copy_expert("COPY (SELECT name FROM people WHERE id < 3) TO STDOUT", binary)
+        return copied, out.getvalue(), binary.getvalue()
+
+    copied, out, binary = run_with_cursor(f)
+    assert copied == 3
+    assert out == "1\t\\N\n2\ttab\\there\n3\t\\N\n4\t\\N\n5\t\\N\n"
+    assert binary == b"alice\nbob\n"
+
+
+def test_postgres_replicas():
+    def f():
+        for dbname, name in [(None, "primary"), ("replica", "replica")]:
+            conn = postgres.connect(dbname=dbname)
+            with conn.cursor() as cursor:
+                cursor.execute("CREATE TABLE replicated (name TEXT)")
+                cursor.execute("INSERT INTO replicated VALUES (%s)", [name])
+            conn.commit()
+            conn.close()
+
+        conn = postgres.connect(autocommit=True, replicas=["replica"])
+        cursor = conn.cursor()
+        cursor.execute("SELECT name FROM replicated")
+        read = cursor.fetchall()
+        cursor.execute("INSERT INTO replicated VALUES (%s)", ["written"])
+        cursor.execute("SELECT count(*) FROM replicated")
+        counted = cursor.fetchone()
+        conn.set_autocommit(False)
+        cursor.execute("SELECT count(*) FROM replicated")
+        in_transaction = cursor.fetchone()
+        conn.close()
+        return read, counted, in_transaction
+
+    read, counted, in_transaction = local_runtime.run(f)
+    assert read == [("replica",)]
+    assert counted == (1,)
+    assert in_transaction == (2,)
+
+
+def test_postgres_query_hooks(caplog):
+    events = []
+
+    class Recorder(postgres.QueryHook):
+        def on_query_end(self, event):
+            events.append(event)
+
+    def f():
+        conn = postgres.connect()
+        with conn.cursor() as cursor:
+            cursor.execute("CREATE TABLE hooked (n INTEGER)")
+            cursor.executemany("INSERT INTO hooked VALUES (%s)", ((i,) for i in range(5)))
+            cursor.execute("SELECT n FROM hooked WHERE n < %s", [3])
+            cursor.fetchone()
+            cursor.fetchall()
+            cursor.execute("SELECT n FROM hooked")
+        conn.close()
+
+    hooks = [postgres.add_query_hook(Recorder()), postgres.add_query_hook(postgres.SlowQueryLog(0))]
+    try:
+        local_runtime.run(f)
+    finally:
+        for hook in hooks:
+            postgres.remove_query_hook(hook)
+
+    assert [(e.sql, e.param_count, e.rows) for e in events] == [
+        ("CREATE TABLE hooked (n INTEGER)", 0, None),
+        ("INSERT INTO hooked VALUES (?)", 1, None),
+        ("SELECT n FROM hooked WHERE n < ?", 1, 3),
+        ("SELECT n FROM hooked", 0, 0),
+    ]
+    assert all(e.error is None and e.duration_ms >= e.execute_ms for e in events)
+    assert len(caplog.records) == 4
+
+
+def test_postgres_fetch_columns():
+    def f(conn, cursor):
+        cursor.execute("CREATE TABLE measurements (n INTEGER, x REAL, label TEXT, maybe INTEGER)")
+        cursor.executemany(
+            "INSERT INTO measurements VALUES (%s, %s, %s, %s)",
+            [(i, i / 2, f"m{i}", None if i % 2 else i) for i in range(7)],
+        )
+        cursor.execute("SELECT * FROM measurements ORDER BY n")
+        cursor.itersize = 3
+        first = cursor.fetchone()
+        return first, cursor.fetch_columns()
+
+    first, columns = run_with_cursor(f)
+    assert first == (0, 0.0, "m0", 0)
+    assert columns["n"] == array.array("q", range(1, 7))
+    assert columns["x"] == array.array("d", [i / 2 for i in range(1, 7)])
+    assert columns["label"] == [f"m{i}" for i in range(1, 7)]
+    assert columns["maybe"] == [None, 2, None, 4, None, 6]
+
+
+def test_postgres_execute_values():
+    from psycopg2.extras import execute_batch, execute_values
+
+    progress = []
+
+    def f(conn, cursor):
+        cursor.execute("CREATE TABLE bulk (id INTEGER, name TEXT)")
+        ids = execute_values(
+            cursor,
+            "INSERT INTO bulk (id, name) VALUES %s RETURNING id",
+            ((i, f"n{i}") for i in range(5)),
+            page_size=2,
+            fetch=True,
+            progress=progress.append,
+        )
+        execute_values(
+            cursor,
+            "INSERT INTO bulk (id, name) VALUES %s",
+            [{"id": 5, "name": "five"}],
+            template="(%(id)s, %(name)s)",
+        )
+        execute_batch(
+            cursor, "UPDATE bulk SET name = %s WHERE id = %s", iter([("a", 0), ("b", 1)]), page_size=1
+        )
+        cursor.execute("SELECT id, name FROM bulk ORDER BY id")
+        return ids, cursor.fetchall()
+
+    ids, rows = run_with_cursor(f)
+    assert ids == [(i,) for i in range(5)]
+    assert progress == [2, 4, 5]
+    assert rows == [(0, "a"), (1, "b"), (2, "n2"), (3, "n3"), (4, "n4"), (5, "five")]
+
+
+def test_postgres_async():
+    import asyncio
+
+    async def f():
+        async with postgres.async_connect() as conn:
+            cursor = await conn.execute("CREATE TABLE async_rows (n INTEGER)")
+            await cursor.executemany("INSERT INTO async_rows VALUES (%s)", [(i,) for i in range(7)])
+            await conn.commit()
+            async with conn.transaction():
+                await conn.run("INSERT INTO async_rows VALUES (%s)", [7])
+                try:
+                    async with conn.transaction():
+                        await conn.run("INSERT INTO async_rows VALUES (%s)", [8])
+                        raise ValueError()
+                except ValueError:
+                    pass
+            cursor.itersize = 3
+            await cursor.execute("SELECT n FROM async_rows ORDER BY n")
+            first = await cursor.fetchone()
+            iterated = [n async for (n,) in cursor]
+            await cursor.close()
+
+        others = [postgres.async_connect() for _ in range(3)]
+        cursors = await asyncio.gather(
+            *(c.execute("SELECT count(*) FROM async_rows WHERE n < %s", [i]) for i, c in enumerate(others))
+        )
+        counts = [await c.fetchall() for c in cursors]
+        in_use = postgres.pool_stats().in_use
+        for c in others:
+            c.close()
+            c.close()
+        assert postgres.pool_stats().in_use == in_use - 3
+        return first, iterated, counts
+
+    first, iterated, counts = local_runtime.run_async(f)
+    assert first == (0,)
+    assert iterated == list(range(1, 8))
+    assert counts == [[(0,)], [(1,)], [(2,)]]
+
+
+def test_postgres_transaction():
+    def f():
+        with postgres.connect(autocommit=True) as conn:
+            conn.cursor().execute("CREATE TABLE ledger (n INTEGER)")
+            cursor = conn.cursor()
+            with conn.transaction():
+                cursor.execute("INSERT INTO ledger VALUES (1)")
+                try:
+                    with conn.transaction():
+                        conn.cursor().execute("INSERT INTO ledger VALUES (2)")
+                        raise ValueError()
+                except ValueError:
+                    pass
+            released = conn._client is None
+            try:
+                with conn.transaction():
+                    conn.cursor().execute("INSERT INTO ledger VALUES (3)")
+                    raise ValueError()
+            except ValueError:
+                pass
+            # Cursors from before a release move to the next pooled connection.
+            cursor.execute("SELECT n FROM ledger")
+            return released, cursor.fetchall(), conn.autocommit
+
+    assert local_runtime.run(f) == (True, [(1,)], True)
+
+
+def test_postgres_pool_stats():
+    samples = []
+
+    def f():
+        before = postgres.pool_stats("stats")
+        first = postgres.connect(dbname="stats")
+        second = postgres.connect(dbname="stats")
+        # Connections take a client from the pool on first use.
+        lazy = postgres.pool_stats("stats")
+        first.cursor()
+        second.cursor()
+        during = postgres.pool_stats("stats")
+        first.close()
+        second.close()
+        return before, lazy, during, postgres.PoolSampler(callback=samples.append).sample()
+
+    before, lazy, during, sample = local_runtime.run(f)
+    assert lazy.in_use == before.in_use
+    assert during.in_use == before.in_use + 2
+    assert during.acquired == before.acquired + 2
+    assert sum(during.acquire_counts) == during.acquired
+    after = next(stats for stats in sample if stats.name == "stats")
+    assert after.in_use == before.in_use
+    assert after.released == before.released + 2
+    assert samples == [sample]
+    text = postgres.pool_prometheus_text(sample)
+    assert 'puff_postgres_pool_in_use{pool="stats"} 0' in text
+    assert 'puff_postgres_pool_acquire_seconds_count{pool="stats"} 2' in text
+
+
+def test_pubsub():
+    def f():
+        conn = global_pubsub.connection()
+        conn.subscribe("ch")
+        global_pubsub.publish_as("other", "ch", "hello")
+        message = conn.receive()
+        return message.from_connection_id, message.text
+
+    assert local_runtime.run(f) == ("other", "hello")
+
+
+def test_task_queue():
+    def f():
+        task_id = global_task_queue.schedule_function(double, 21)
+        return global_task_queue.wait_for_task_result(task_id)
+
+    assert local_runtime.run(f) == 42
+
+
+def test_http_loopback():
+    def f():
+        response = global_http_client.post("http://localhost/echo", body=b"ping")
+        return response.status, response.cookies, response.body()
+
+    assert local_runtime.run(f) == (201, {"a": "1"}, b"ping")
+
+
+def test_latency():
+    local_runtime.install(latency_ms=20)
+    try:
+        start = time.monotonic()
+        local_runtime.run(lambda: RedisClient().get("a"))
+        assert time.monotonic() - start >= 0.02
+    finally:
+        local_runtime.install(http_app=hello_app)
@@ -0,0 +1,213 @@
+from puff.postgres import convert_placeholders
+
+
+def test_convert_placeholders():
+    assert convert_placeholders("SELECT %s, %s") == "SELECT $1, $2"
+
+
+def test_convert_placeholders_escapes():
+    assert (
+        convert_placeholders("SELECT * FROM t WHERE a LIKE %s AND b = '100%%' AND c %% 2 = %s")
+        == "SELECT * FROM t WHERE a LIKE $1 AND b = '100%' AND c % 2 = $2"
+    )
+
+
+def test_convert_placeholders_skips_literals():
+    assert (
+        convert_placeholders("""SELECT '%s', 'it''s %s', "col%s" FROM t WHERE id = %s""")
+        == """SELECT '%s', 'it''s %s', "col%s" FROM t WHERE id = $1"""
+    )
+
+
+def test_statement_cache():
+    from puff import local_runtime, postgres
+
+    local_runtime.install()
+
+    def f():
+        conn = postgres.connect(statement_cache_size=1)
+        cursor = conn.cursor()
+        for q in ("SELECT %s", "SELECT %s", "SELECT %s + 1", "SELECT %s"):
+            cursor.execute(q, [1])
+        cursor.execute("SELECT 1")
+        return conn.statement_cache.stats()
+
+    stats = local_runtime.run(f)
+    assert (stats.hits, stats.misses, stats.evictions, stats.size) == (1, 3, 2, 1)
+
+
+def test_is_preparable():
+    from puff.postgres import is_preparable
+
+    assert is_preparable("SELECT $1;", [1])
+    assert not is_preparable("SELECT 1", None)
+    assert not is_preparable("SELECT $1; SELECT 2", [1])
+
+
+def test_stale_statement_error():
+    from puff.postgres import is_stale_statement_error
+
+    assert is_stale_statement_error(Exception("cached plan must not change result type"))
+    assert not is_stale_statement_error(Exception("syntax error at or near"))
+
+
+def test_copy_chunks():
+    import io
+    from puff.postgres import copy_chunks
+
+    assert list(copy_chunks(io.BytesIO(b"abcdefg"), 3)) == [b"abc", b"def", b"g"]
+    assert list(copy_chunks(["a\n", b"b\n", "c\n"], 4)) == [b"a\nb\n", b"c\n"]
+
+
+def test_copy_errors_and_split_characters():
+    import io
+    from puff import local_runtime, postgres
+
+    class Source:
+        def __init__(self, chunks):
+            self.chunks = chunks
+
+        def read(self, rr):
+            rr(self.chunks.pop(0) if self.chunks else None, None)
+
+    class Cursor:
+        def close(self):
+            pass
+
+    class CopyCursor(Cursor):
+        def copy_out(self, rr, sql):
+            rr(Source(["é".encode("utf8")[:1], "é\n".encode("utf8")[1:]]), None)
+
+    def f():
+        out = io.StringIO()
+        postgres.PostgresCursor(CopyCursor(), None).copy_expert("COPY t TO STDOUT", out)
+        errors = []
+        for sql in ("COPY t TO STDOUT", "COPY t FROM STDIN", "SELECT 1"):
+            try:
+                postgres.PostgresCursor(Cursor(), None).copy_expert(sql, io.StringIO())
+            except postgres.Error as e:
+                errors.append(type(e))
+        return out.getvalue(), errors
+
+    local_runtime.install()
+    text, errors = local_runtime.run(f)
+    assert text == "é\n"
+    assert errors == [postgres.NotSupportedError, postgres.NotSupportedError, postgres.ProgrammingError]
+
+
+def test_replica_router():
+    from puff.postgres import LEAST_LATENCY, ReplicaRouter, is_read_query
+
+    assert is_read_query("SELECT * FROM t WHERE id = $1")
+    assert is_read_query("  with x AS (SELECT 1) SELECT * FROM x;")
+    assert not is_read_query("SELECT * FROM t FOR UPDATE")
+    assert not is_read_query("WITH x AS (DELETE FROM t RETURNING *) SELECT * FROM x")
+    assert not is_read_query("SELECT 1; DROP TABLE t")
+    assert not is_read_query("UPDATE t SET a = 1")
+
+    router = ReplicaRouter(["a", "b"])
+    assert {router.choose(), router.choose()} == {"a", "b"}
+
+    router = ReplicaRouter(["a", "b"], strategy=LEAST_LATENCY)
+    router.record("a", 0.05)
+    router.record("b", 0.01)
+    assert router.choose() == "b"
+
+    lags = {"a": 10.0, "b": 0.5}
+    router = ReplicaRouter(["a", "b"], max_lag_seconds=1)
+    router.measure_lag = lags.get
+    assert [router.choose() for _ in range(3)] == ["b"] * 3
+    lags["b"] = 5.0
+    router.lag_check_interval = 0
+    assert router.choose() is None
+
+
+def test_normalize_query():
+    from puff.postgres import normalize_query
+
+    assert (
+        normalize_query("SELECT *  FROM \"t 1\"\nWHERE a = 'x' AND b IN (%s, %s, 3) LIMIT 10")
+        == 'SELECT * FROM "t 1" WHERE a = ? AND b IN (?) LIMIT ?'
+    )
+    assert normalize_query("SELECT col2 FROM t WHERE id = $1") == (
+        "SELECT col2 FROM t WHERE id = ?"
+    )
+
+
+def test_query_histogram():
+    from puff.postgres import QueryEvent, QueryHistogram
+
+    histogram = QueryHistogram(buckets=(0.01, 0.1))
+    histogram.on_query_end(QueryEvent("SELECT ?", 1, execute_ms=5, fetch_ms=50, rows=3))
+    histogram.on_query_end(QueryEvent("SELECT ?", 1, execute_ms=500, error=Exception()))
+    text = histogram.prometheus_text()
+    assert 'puff_postgres_query_duration_seconds_bucket{phase="total",le="0.1"} 1' in text
+    assert 'puff_postgres_query_duration_seconds_count{phase="execute"} 2' in text
+    assert "puff_postgres_query_rows_total 3" in text
+    assert "puff_postgres_query_errors_total 1" in text
+
+
+def test_column_buffer():
+    from puff.postgres import ColumnBuffer
+
+    ints = ColumnBuffer("INT4")
+    ints.extend((1, 2))
+    assert ints.values().typecode == "i"
+    ints.extend((3, 2**40))
+    assert ints.values() == [1, 2, 3, 2**40]
+
+    guessed = ColumnBuffer()
+    guessed.extend((None, None))
+    guessed.extend((1.5,))
+    assert guessed.values() == [None, None, 1.5]
+
+
+def test_execute_values_template():
+    from puff.postgres import compile_template, split_values
+
+    assert split_values("INSERT INTO t VALUES %s ON CONFLICT DO NOTHING") == (
+        "INSERT INTO t VALUES ",
+        " ON CONFLICT DO NOTHING",
+    )
+    assert split_values("INSERT INTO t VALUES %s -- '%s'")[1] == " -- '%s'"
+    assert compile_template(None, (1, 2)) == ("(%s, %s)", None)
+    assert compile_template("(%(a)s, now(), %(b)s)", {}) == ("(%s, now(), %s)", ["a", "b"])
+
+
+def test_row_factories():
+    import dataclasses
+    from types import SimpleNamespace
+    from puff.postgres import class_row, dict_row, namedtuple_row
+
+    @dataclasses.dataclass
+    class Person:
+        id: int
+        name: str
+
+    cursor = SimpleNamespace(description=[("id",), ("name",)])
+    assert dict_row(cursor)((1, "a")) == {"id": 1, "name": "a"}
+    assert class_row(Person)(cursor)((1, "a")) == Person(1, "a")
+    cursor.description.append(("?column?",))
+    row = namedtuple_row(cursor)((1, "a", 2))
+    assert (row.id, row.name, row._2) == (1, "a", 2)
+
+
+def test_transaction_savepoints():
+    from types import SimpleNamespace
+    from puff.postgres import BaseTransaction
+
+    connection = SimpleNamespace(transaction_depth=0, autocommit=True)
+    outer, inner = BaseTransaction(connection), BaseTransaction(connection)
+    assert outer.begin() is None and outer.restore_autocommit
+    assert inner.begin() == "SAVEPOINT puff_savepoint_1"
+    assert inner.end(ValueError) == "ROLLBACK TO SAVEPOINT puff_savepoint_1"
+    assert outer.end(None) is None
+    assert connection.transaction_depth == 0
+
+
+def test_connection_wraps_replica_list():
+    from puff.postgres import PostgresConnection, ReplicaRouter
+
+    conn = PostgresConnection(replicas=["replica"])
+    assert isinstance(conn.replicas, ReplicaRouter)
+    assert conn._client is None
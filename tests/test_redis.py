@@ -0,0 +1,122 @@
+from puff import local_runtime
+from puff.redis import ClusterRedisClient, key_slot
+
+
+def test_key_slot():
+    assert key_slot("foo") == 12182
+    assert key_slot(b"123456789") == 12739
+    assert key_slot("{user1000}.following") == key_slot("user1000")
+    assert key_slot("{}.x") == key_slot("{}.x")
+
+
+class FakeCluster:
+    """
+    Two nodes splitting the slots in half. The first CLUSTER SLOTS reply is stale and puts every slot on node A.
+    """
+
+    def __init__(self):
+        self.a = FakeNode(self, ("a", 1))
+        self.b = FakeNode(self, ("b", 2))
+        self.slots_requests = 0
+        self.migrating = {}
+
+    def owner(self, slot):
+        return self.a if slot < 8192 else self.b
+
+    def node(self, host, port):
+        return self.a if host == "a" else self.b
+
+    def command(self, rr, command):
+        self.slots_requests += 1
+        if self.slots_requests == 1:
+            rr([[0, 16383, [b"a", 1]]], None)
+        else:
+            rr([[0, 8191, [b"a", 1]], [8192, 16383, [b"b", 2]]], None)
+
+
+class FakeNode:
+    def __init__(self, cluster, address):
+        self.cluster = cluster
+        self.address = address
+        self.redis = local_runtime.LocalRedis()
+
+    def redirect(self, command, asking):
+        slot = key_slot(command[1])
+        migrating_to = self.cluster.migrating.get(slot)
+        if migrating_to is not None:
+            if migrating_to is self and asking:
+                return None
+            if migrating_to is not self:
+                host, port = migrating_to.address
+                return local_runtime.RedisError(f"ASK {slot} {host}:{port}")
+        owner = self.cluster.owner(slot)
+        if owner is not self:
+            host, port = owner.address
+            return local_runtime.RedisError(f"MOVED {slot} {host}:{port}")
+
+    def pipeline(self, rr, commands, transaction=False):
+        results = []
+        asking = False
+        for command in commands:
+            if command[0] == "ASKING":
+                asking = True
+                results.append("OK")
+                continue
+            error = self.redirect(command, asking)
+            results.append(error or self.redis.try_command(command))
+            asking = False
+        rr(results, None)
+
+
+def test_cluster_routing():
+    cluster = FakeCluster()
+    keys = [f"key-{i}" for i in range(20)]
+    # A key that lives on node B while its slot is being migrated to node A.
+    migrating = next(k for k in keys if key_slot(k) >= 8192)
+    cluster.migrating[key_slot(migrating)] = cluster.a
+
+    def f():
+        redis = ClusterRedisClient(client_fn=lambda: cluster, node_fn=cluster.node)
+        redis.mset({k: k.upper() for k in keys})
+        redis.set("{tag}a", "1")
+        redis.incr("{tag}b", 2)
+        return redis.mget(keys), redis.mget(["{tag}a", "{tag}b", "missing"])
+
+    values, tagged = local_runtime.run(f)
+    assert values == [k.upper().encode() for k in keys]
+    assert tagged == [b"1", b"2", None]
+    assert cluster.a.redis.do_get(migrating) == migrating.upper().encode()
+    assert all(
+        cluster.owner(key_slot(k)).redis.do_get(k) for k in keys if k != migrating
+    )
+    assert cluster.slots_requests == 2
+
+
+def test_command_key():
+    from puff.redis import command_key
+
+    assert command_key(["GET", "a"]) == "a"
+    assert command_key(["XGROUP", "CREATE", "s", "g", "$"]) == "s"
+    assert command_key(["XREADGROUP", "GROUP", "g", "c", "STREAMS", "s", ">"]) == "s"
+    assert command_key(["PING"]) is None
+
+
+def test_redis_codec():
+    from puff.redis import RedisClient
+
+    raw = local_runtime.LocalRedis()
+
+    def f():
+        redis = RedisClient(
+            client_fn=lambda: raw, serializer="pickle", compressor="zlib"
+        )
+        redis.set("a", {"x": 1})
+        redis.mset({"b": [1, 2], "c": "c" * 5000})
+        redis.rpush("l", (1, 2))
+        results = redis.pipeline().get("a").mget(["b", "missing"]).lpop("l").execute()
+        return results, redis.get("c"), raw.do_get("c")
+
+    results, large, stored = local_runtime.run(f)
+    assert results == [{"x": 1}, [[1, 2], None], (1, 2)]
+    assert large == "c" * 5000
+    assert stored[:1] == b"\x01"
@@ -0,0 +1,33 @@
+import pytest
+
+from puff.serializers import Codec, PickleSerializer, make_codec
+
+
+def test_pickle_out_of_band_buffers():
+    serializer = PickleSerializer()
+    value = {"a": bytearray(b"x" * 100), "b": [1, 2, 3]}
+    data = serializer.dumps(value)
+    loaded = serializer.loads(data)
+    assert bytes(loaded["a"]) == bytes(value["a"])
+    assert loaded["b"] == [1, 2, 3]
+    assert serializer.loads(serializer.dumps("plain")) == "plain"
+
+
+def test_codec_compression_threshold():
+    codec = Codec("json", "zlib")
+    small = codec.encode({"a": 1})
+    assert small[:1] == b"\x00"
+    large = codec.encode(["value"] * 1000)
+    assert large[:1] == b"\x01"
+    assert len(large) < 1000
+    assert codec.decode(small) == {"a": 1}
+    assert codec.decode(large) == ["value"] * 1000
+    assert codec.decode_many([small, None]) == [{"a": 1}, None]
+    assert make_codec() is None
+
+
+def test_optional_codecs():
+    pytest.importorskip("msgpack")
+    pytest.importorskip("zstandard")
+    codec = Codec("msgpack", "zstd")
+    assert codec.decode(codec.encode({"a": b"x" * 4096})) == {"a": b"x" * 4096}